@@ -1,17 +1,1873 @@
+import argparse
+import array
+import bz2
+import concurrent.futures
+import contextlib
+import csv
+import gc
+import gzip
+import hashlib
+import itertools
+import io
+import json
+import lzma
+import math
+import mmap
+import multiprocessing
+import os
 import pathlib
+import pickle
+import queue
+import random
+import shutil
+import socket
+import socketserver
+import sqlite3
+import struct
+import tempfile
+import threading
+import re
+import time
+import tracemalloc
 import unittest
 
 import sys
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, wraps
 from prettytable import PrettyTable
 import datetime
 from datetime import date
 
+try:  # numpy is only needed for the columnar tree store
+    import numpy as np
+except ImportError:
+    np = None
+
 # define possible values as global constant
 VALID_VALUES = {"0": ["INDI", "HEAD", "TRLR", "NOTE", "FAM"],
                 "1": ["NAME", "SEX", "BIRT", "DEAT", "FAMC", "FAMS", "MARR", "HUSB", "WIFE", "CHIL", "DIV"],
                 "2": ["DATE"]}
 
+# byte level lookups for the mmap tokenizer, tag bytes map to the same strings as VALID_VALUES
+BYTE_TAGS = {level: {tag.encode(): tag for tag in tags} for level, tags in VALID_VALUES.items()}
+BYTE_RECORDS = {b"INDI": "INDI", b"FAM": "FAM"}
+MMAP_BLOCK_SIZE = 1 << 22
+DECOMPRESSORS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+DECOMPRESSED_BLOCKS_AHEAD = 4  # blocks the decompression thread may get ahead of the parser
+PARALLEL_CHUNKS_PER_WORKER = 4
+CHECKING = None  # (Gedcom, individual checks, family plan) forked check workers read, set only while they run
+DATE_FIELDS = {"BIRT": "birth", "DEAT": "death", "MARR": "marriage", "DIV": "divorce"}
+MONTHS = {"JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MAY": 5, "JUN": 6,
+          "JUL": 7, "AUG": 8, "SEP": 9, "OCT": 10, "NOV": 11, "DEC": 12}
+NO_DATE = 0  # ordinal stored for a missing or unreadable date, real ordinals start at 1
+OPEN_MARRIAGE = date.max.toordinal()  # end of a marriage that has not ended
+DAY_FIELDS = (("birth", "birth_day"), ("death", "death_day"), ("marriage", "marriage_day"), ("divorce", "divorce_day"))
+SEX_CODES = {"M": 1, "F": 2}  # anything else is stored as 0
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()  # day 0 of numpy datetime64
+SNAPSHOT_VERSION = 2  # bump when parsing changes what ends up in userdata or familydata
+SNAPSHOT_MAGIC = "GEDSNAP {}\n".format(SNAPSHOT_VERSION).encode()
+SNAPSHOT_CACHE_SIZE = 1 << 30
+DAEMON_MEMORY = 1 << 30  # bytes of parsed trees a ValidationDaemon keeps before evicting the least recently used
+# a family's checks read records up to 4 links away: spouse, spouse's FAMC family, parent in it and the parent's
+# FAMC family naming the grandparents, US17 reads every ancestor and is rechecked through descendant_families
+RECHECK_FAMILY_LINKS = 4
+RECHECK_INDIVIDUAL_LINKS = 2  # parents, spouses and children of an edited individual
+KINSHIP_MEMO_SIZE = 1 << 18  # ancestor IDs the walks memoized by Kinship.is_ancestor hold in all
+KINSHIP_MEMO_WALK = 64  # ancestors a walk has to visit to be memoized, shorter walks are cheaper to repeat
+TRAILING_SPACE = re.compile(rb"[ \t\r\f\v]+$", re.M)
+LEVEL0_LINE = re.compile(rb"^0 +(\S+)(?: +(\S+))?", re.M)
+LINK_LINE = re.compile(rb"^1 +(FAMC|FAMS|HUSB|WIFE|CHIL) +(\S+)", re.M)
+LINK_KINDS = {b"FAMC": "FAM", b"FAMS": "FAM", b"HUSB": "INDI", b"WIFE": "INDI", b"CHIL": "INDI"}
+ANCESTOR_TAGS = (b"FAMC", b"HUSB", b"WIFE")  # from a family to its spouses, their FAMC families and so on up
+SAMPLE_SIZE = 1000  # individuals and families a sampled run checks by default
+CONFIDENCE_Z = 1.96  # 95% confidence intervals of the sampled error rates
+USER_COLUMNS = ["ID", "NAME", "GENDER", "BIRTH DATE", "AGE", "ALIVE", "DEATH", "CHILD", "SPOUSE"]
+FAMILY_COLUMNS = ["ID", "MARRIAGE DATE", "DIVORCE DATE", "HUSBAND ID", "HUSBAND NAME", "WIFE ID", "WIFE NAME",
+                  "CHILDREN"]
+TABLE_PREFIX_ROWS = 1000  # rows a StreamingTable measures its column widths on
+ANOMALY_BATCH = 4096  # anomalies a sink keeps before writing them out at once
+STORE_BATCH = 1 << 14  # records a TreeStore writes in one transaction, and the store checks hold at once
+STORE_VERSION = 1  # bump when the tables of a TreeStore change, older databases are loaded again
+STORE_INDEXES = ("ages", "siblings")  # built over each window of a TreeStore, see Gedcom.store_analyze
+EXPORT_ROW_GROUP = 1 << 16  # rows an export holds and writes at once
+COLUMNS_MAGIC = b"GEDCOL 1\n"
+# exported columns and their types: str, date (days since 1970-01-01), int, bool and list (of str)
+INDIVIDUAL_EXPORT = (("id", "str"), ("given", "str"), ("surname", "str"), ("sex", "str"), ("birth", "date"),
+                     ("death", "date"), ("marriage", "date"), ("divorce", "date"), ("age", "int"), ("alive", "bool"),
+                     ("famc", "str"), ("fams", "str"))
+FAMILY_EXPORT = (("id", "str"), ("husband", "str"), ("wife", "str"), ("marriage", "date"), ("divorce", "date"),
+                 ("children", "list"))
+EXPORT_FORMATS = {"columns": ".gedcol", "csv": ".csv"}
+
+
+def mmap_blocks(mm, start=0, end=None, block_size=MMAP_BLOCK_SIZE):
+    """
+    Function to cut a memory mapped file into blocks that end on a line boundary
+    :param mm: mmap object
+    :param start: byte offset of the first block
+    :param end: byte offset to stop at, defaults to the end of the map
+    :return: generator of bytes blocks
+    """
+    end = len(mm) if end is None else end
+    while start < end:
+        stop = mm.find(b"\n", min(start + block_size, end) - 1, end)
+        stop = end if stop < 0 else stop + 1
+        yield mm[start:stop]
+        start = stop
+
+
+def is_gedcom(file):
+    """
+    Function to check if a file name is one analyze accepts
+    :param file: file name
+    :return: True for names ending in ged, plain or compressed
+    """
+    suffix = compression_of(file)
+    return (file[:-len(suffix)] if suffix else file).endswith("ged")
+
+
+def compression_of(file):
+    """
+    Function to find the compression of a file from its name
+    :param file: file name
+    :return: ".gz", ".bz2" or ".xz", None if the file is not compressed
+    """
+    suffix = os.path.splitext(file)[1]
+    return suffix if suffix in DECOMPRESSORS else None
+
+
+def decompressed_blocks(source, block_size=MMAP_BLOCK_SIZE):
+    """
+    Function to decompress a file in a background thread while the caller parses the blocks it already has
+    zlib, bz2 and lzma release the GIL while they decompress, so both threads do work at the same time
+    :param source: binary file object opened with one of DECOMPRESSORS, closed when the generator finishes
+    :param block_size: bytes of decompressed data read at a time
+    :return: generator of bytes blocks that end on a line boundary, except maybe the last one
+    """
+    blocks = queue.Queue(DECOMPRESSED_BLOCKS_AHEAD)
+    stop = threading.Event()
+
+    def decompress():
+        try:
+            with source:
+                rest = b""
+                while not stop.is_set():
+                    data = source.read(block_size)
+                    if not data:
+                        break
+                    data = rest + data
+                    cut = data.rfind(b"\n") + 1
+                    rest = data[cut:]
+                    if cut:
+                        blocks.put(data[:cut])
+                if rest:
+                    blocks.put(rest)
+        except Exception as e:  # a broken archive, raised again in the parsing thread
+            blocks.put(e)
+            return
+        blocks.put(None)
+
+    thread = threading.Thread(target=decompress, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:  # the parse can stop early, let the thread finish instead of blocking on a full queue
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+
+class Record:
+    """
+    Base class of the parsed records, gives the slot based records the dict interface the checks were written
+    against, record["BIRTDATE"] reads the birth field and raises KeyError if it was never set
+    """
+    __slots__ = ()
+    KEYS = {}
+
+    def __getitem__(self, key):
+        field = self.KEYS.get(key)
+        value = getattr(self, field) if field else (self.extra or {}).get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        field = self.KEYS.get(key)
+        if field:
+            setattr(self, field, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        field = self.KEYS.get(key)
+        if field:
+            return getattr(self, field) is not None
+        return self.extra is not None and key in self.extra
+
+    def keys(self):
+        keys = [key for key, field in self.KEYS.items() if getattr(self, field) is not None]
+        return keys + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, other):
+        for key in other.keys():
+            self[key] = other[key]
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self.items()))
+
+    def __reduce__(self):
+        return restore_record, (type(self), tuple(getattr(self, field) for field in self.__slots__))
+
+    def parsed(self):
+        """
+        Function to get the fields read from the file, leaving out the ones the checks derive
+        :return: tuple of values in PARSED order
+        """
+        return tuple(getattr(self, field) for field in self.PARSED)
+
+
+def restore_record(cls, values):
+    """
+    Function pickle uses to rebuild a record from its slot values, keeps snapshots and worker results small
+    :param cls: Individual or Family
+    :param values: tuple of values in __slots__ order
+    :return: record
+    """
+    record = cls.__new__(cls)
+    for field, value in zip(cls.__slots__, values):
+        setattr(record, field, value)
+    return record
+
+
+class Individual(Record):
+    """
+    One INDI record
+    name, sex: NAME and SEX values
+    birth, death, marriage, divorce: BIRT, DEAT, MARR and DIV dates as written in the file
+    birth_day, death_day, marriage_day, divorce_day: the same dates as day ordinals, filled in by
+    Gedcom.normalize_dates, NO_DATE when missing
+    famc, fams: IDs of the families the individual is a child and a spouse in
+    marriages: one [MARR date, DIV date or None, family ID or None] per marriage in file order, None until one is
+    read, a MARR inside the INDI record belongs to the last FAMS before it
+    age, alive: derived by Gedcom.derive_ages
+    child, spouse, father, mother: derived by Gedcom.link_relatives
+    extra: dict of any other tag, None until one is stored
+    Unset fields are None
+    """
+    __slots__ = ("name", "sex", "birth", "death", "marriage", "divorce", "birth_day", "death_day", "marriage_day",
+                 "divorce_day", "famc", "fams", "marriages", "age", "alive", "child", "spouse", "father", "mother",
+                 "extra")
+    KEYS = {"NAME": "name", "SEX": "sex", "BIRTDATE": "birth", "DEATDATE": "death", "MARRDATE": "marriage",
+            "DIVDATE": "divorce", "FAMC": "famc", "FAMS": "fams", "AGE": "age", "ALIVE": "alive",
+            "CHILD": "child", "SPOUSE": "spouse", "father": "father", "mather": "mother"}
+    PARSED = ("name", "sex", "birth", "death", "marriage", "divorce", "famc", "fams", "marriages", "extra")
+
+    def __init__(self):
+        self.name = self.sex = self.birth = self.death = self.marriage = self.divorce = None
+        self.birth_day = self.death_day = self.marriage_day = self.divorce_day = NO_DATE
+        self.famc = self.fams = self.marriages = self.age = self.alive = self.child = self.spouse = None
+        self.father = self.mother = self.extra = None
+
+    def add_marriage(self, marriage, family):
+        """
+        Function to record the start of a marriage
+        :param marriage: MARR date as written in the file
+        :param family: ID of the family of the marriage, None if not known
+        """
+        if self.marriages is None:
+            self.marriages = []
+        self.marriages.append([marriage, None, family])
+
+    def end_marriage(self, divorce, family=None):
+        """
+        Function to record a divorce, it ends the last marriage that has not ended
+        :param divorce: DIV date as written in the file
+        :param family: only end a marriage of this family
+        :return: True if a marriage was ended
+        """
+        for marriage in reversed(self.marriages or ()):
+            if marriage[1] is None and (family is None or marriage[2] == family):
+                marriage[1] = divorce
+                return True
+        return False
+
+
+class Family(Record):
+    """
+    One FAM record
+    husb, wife: IDs of the husband and wife
+    chil: list of the children's IDs
+    extra: dict of any other tag, None until one is stored
+    Unset fields are None, marriage and divorce dates are stored on the spouses
+    """
+    __slots__ = ("husb", "wife", "chil", "extra")
+    KEYS = {"HUSB": "husb", "WIFE": "wife", "CHIL": "chil"}
+    PARSED = ("husb", "wife", "chil", "extra")
+
+    def __init__(self):
+        self.husb = self.wife = self.chil = self.extra = None
+
+
+@lru_cache(maxsize=None)
+def date_ordinal(text):
+    """
+    Function to turn a GEDCOM date such as "05 DEC 2018" into a proleptic Gregorian day ordinal
+    Results are memoized since the same date strings repeat all over a tree
+    :param text: date as written in the file
+    :return: day ordinal, NO_DATE if the date is missing or can not be read
+    """
+    try:
+        day, month, year = text.split()
+        return date(int(year), MONTHS[month.upper()], int(day)).toordinal()
+    except (AttributeError, ValueError, KeyError):
+        return NO_DATE
+
+
+def normalized_name(name):
+    """
+    Function to compare names ignoring case, repeated spaces and the slashes around the surname
+    :param name: name as written in the file
+    :return: normalized name
+    """
+    return " ".join(name.replace("/", " ").split()).casefold()
+
+
+def person_key(record):
+    """
+    Function to get what US23 requires to be unique for an individual
+    :param record: Individual or None
+    :return: (normalized name, birth day ordinal), None if a part is missing
+    """
+    if record is None or not record.name or record.birth_day == NO_DATE:
+        return None
+    return normalized_name(record.name), record.birth_day
+
+
+def family_key(family, userdata):
+    """
+    Function to get what US24 requires to be unique for a family
+    :param family: Family or None
+    :param userdata: individuals
+    :return: (normalized husband name, normalized wife name, marriage day ordinal), None if a part is missing
+    """
+    if family is None:
+        return None
+    husband, wife = userdata.get(family.husb), userdata.get(family.wife)
+    if husband is None or wife is None or not husband.name or not wife.name or husband.marriage_day == NO_DATE:
+        return None
+    return normalized_name(husband.name), normalized_name(wife.name), husband.marriage_day
+
+
+class DuplicateIndex:
+    """
+    Hash index of the records that should be unique, finding the duplicates of one is a lookup
+    people: person_key to the sorted IDs of the individuals having it, for US23
+    families: family_key to the sorted IDs of the families having it, for US24
+    """
+    __slots__ = ("people", "families")
+
+    def __init__(self, userdata, familydata):
+        self.people = defaultdict(list)
+        for key in sorted(userdata):
+            person = person_key(userdata[key])
+            if person is not None:
+                self.people[person].append(key)
+        self.families = defaultdict(list)
+        for fam_id in sorted(familydata):
+            family = family_key(familydata[fam_id], userdata)
+            if family is not None:
+                self.families[family].append(fam_id)
+
+    def groups(self):
+        """
+        Function to get every group of duplicates
+        :return: list of lists of individual IDs, list of lists of family IDs
+        """
+        return ([keys for keys in self.people.values() if len(keys) > 1],
+                [keys for keys in self.families.values() if len(keys) > 1])
+
+
+def overlapping_marriages(intervals):
+    """
+    Function to find the marriages that start before an earlier one has ended, with one sort and one sweep
+    :param intervals: list of (start, end) day ordinals, end is OPEN_MARRIAGE for a marriage that has not ended
+    :return: sorted indexes of the intervals that overlap an earlier starting one
+    """
+    overlaps = []
+    latest_end = None
+    for start, end, index in sorted((start, end, index) for index, (start, end) in enumerate(intervals)):
+        if end <= start:  # ends before it starts, covers no day
+            continue
+        if latest_end is not None and start < latest_end:
+            overlaps.append(index)
+        latest_end = end if latest_end is None else max(latest_end, end)
+    return sorted(overlaps)
+
+
+class TreeColumns:
+    """
+    Columnar copy of a parsed tree for array based rules and analytics, needs numpy
+    Individuals and families are numbered densely in userdata and familydata order
+    ids, family_ids: xref of each row, index and family_index map an xref back to its row
+    birth, death, marriage, divorce: int32 day ordinals per individual, NO_DATE when missing
+    sex: uint8 per individual, 1 for M, 2 for F, 0 otherwise
+    famc, fams: int32 family row per individual, -1 when missing
+    husband, wife: int32 individual row per family, -1 when missing
+    child_offsets, children: children of family f are children[child_offsets[f]:child_offsets[f + 1]]
+    father, mother: int32 parent row per individual taken from famc, -1 when unknown
+    """
+
+    def __init__(self, userdata, familydata):
+        if np is None:
+            raise ImportError("The columnar tree store needs numpy, install it with pip install numpy")
+        self.ids = list(userdata)
+        self.index = {xref: row for row, xref in enumerate(self.ids)}
+        self.family_ids = list(familydata)
+        self.family_index = {xref: row for row, xref in enumerate(self.family_ids)}
+        records = list(userdata.values())
+        families = list(familydata.values())
+
+        for field in ("birth", "death", "marriage", "divorce"):
+            setattr(self, field, np.array([date_ordinal(getattr(record, field)) for record in records],
+                                          dtype=np.int32))
+        self.sex = np.array([SEX_CODES.get(record.sex, 0) for record in records], dtype=np.uint8)
+        self.famc = np.array([self.family_index.get(record.famc, -1) for record in records], dtype=np.int32)
+        self.fams = np.array([self.family_index.get(record.fams, -1) for record in records], dtype=np.int32)
+        self.husband = np.array([self.index.get(family.husb, -1) for family in families], dtype=np.int32)
+        self.wife = np.array([self.index.get(family.wife, -1) for family in families], dtype=np.int32)
+
+        counts = np.array([len(family.chil or ()) for family in families], dtype=np.int64)
+        self.child_offsets = np.zeros(len(families) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.child_offsets[1:])
+        self.children = np.array([self.index.get(child, -1) for family in families for child in family.chil or ()],
+                                 dtype=np.int32)
+
+        has_parents = self.famc >= 0
+        self.father = np.full(len(records), -1, dtype=np.int32)
+        self.mother = np.full(len(records), -1, dtype=np.int32)
+        self.father[has_parents] = self.husband[self.famc[has_parents]]
+        self.mother[has_parents] = self.wife[self.famc[has_parents]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def children_of(self, family):
+        """
+        Function to get the children rows of a family row
+        :param family: family row
+        :return: int32 array view of individual rows
+        """
+        return self.children[self.child_offsets[family]:self.child_offsets[family + 1]]
+
+    def years(self, days):
+        """
+        Function to get the calendar years of an array of day ordinals
+        :param days: int array of day ordinals such as self.birth
+        :return: int64 array of years
+        """
+        return (days.astype(np.int64) - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[Y]").astype(
+            np.int64) + 1970
+
+    def ids_where(self, mask):
+        """
+        Function to turn a boolean mask or row array over individuals back into xrefs
+        :param mask: boolean array of len(self) or array of rows
+        :return: list of xrefs
+        """
+        rows = np.flatnonzero(mask) if mask.dtype == np.bool_ else mask
+        return [self.ids[row] for row in rows]
+
+
+def csr(size, sources, targets):
+    """
+    Function to pack edges into compressed sparse row form
+    :param size: number of rows
+    :param sources: int array of the row each edge starts from
+    :param targets: int array of the row each edge goes to
+    :return: offsets, targets, the targets of row r are targets[offsets[r]:offsets[r + 1]] in row order
+    """
+    order = np.argsort(sources.astype(np.int64) * size + targets)
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=offsets[1:])
+    return offsets, targets[order].astype(np.int32)
+
+
+def csr_gather(offsets, targets, rows):
+    """
+    Function to get the targets of many rows at once, without a Python loop over the rows
+    :param offsets: offsets returned by csr
+    :param targets: targets returned by csr
+    :param rows: int array of rows
+    :return: int32 array of the targets of every row, one row after the other
+    """
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int32)
+    shifts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return targets[np.arange(total) + shifts]
+
+
+class TreeLinks:
+    """
+    Parent, child and spouse edges between the individual rows of a TreeColumns in compressed sparse row form,
+    backing the traversal methods of Gedcom, needs numpy
+    A parent is the husband or wife of a family that lists the individual in CHIL or that the individual names in
+    FAMC, the spouses of a family are linked both ways
+    parent_offsets, parents: parents of row r are parents[parent_offsets[r]:parent_offsets[r + 1]]
+    child_offsets, children: children of row r, the same way
+    spouse_offsets, spouses: spouses of row r, the same way
+    """
+
+    def __init__(self, columns):
+        size = len(columns)
+        family_of_child = np.repeat(np.arange(len(columns.family_ids), dtype=np.int32),
+                                    np.diff(columns.child_offsets))
+        listed = columns.children
+        found = listed >= 0
+        # FAMC only adds parents when the family does not list the individual as a child already
+        in_own_family = np.zeros(size, dtype=np.bool_)
+        in_own_family[listed[found][columns.famc[listed[found]] == family_of_child[found]]] = True
+        named = np.flatnonzero((columns.famc >= 0) & ~in_own_family).astype(np.int32)
+        child_rows = np.concatenate([listed, listed, named, named])
+        parent_rows = np.concatenate([columns.husband[family_of_child], columns.wife[family_of_child],
+                                      columns.father[named], columns.mother[named]])
+        keep = (parent_rows >= 0) & (child_rows >= 0) & (parent_rows != child_rows)
+        parent_rows, child_rows = parent_rows[keep], child_rows[keep]
+        self.child_offsets, self.children = csr(size, parent_rows, child_rows)
+        self.parent_offsets, self.parents = csr(size, child_rows, parent_rows)
+
+        married = (columns.husband >= 0) & (columns.wife >= 0) & (columns.husband != columns.wife)
+        husbands, wives = columns.husband[married], columns.wife[married]
+        self.spouse_offsets, self.spouses = csr(size, np.concatenate([husbands, wives]),
+                                                np.concatenate([wives, husbands]))
+
+    def breadth_first(self, offsets, targets, row, generations=None):
+        """
+        Function to visit the rows reachable from one row a generation at a time, each generation in one step
+        :param offsets: offsets of the edges to follow, such as self.parent_offsets
+        :param targets: targets of the edges to follow, such as self.parents
+        :param row: row to start from, it is not part of the result
+        :param generations: number of edges to follow at most, None for no limit
+        :return: int32 array of rows, int32 array of their generations, by generation then row
+        """
+        seen = np.zeros(len(offsets) - 1, dtype=np.bool_)
+        seen[row] = True
+        frontier = np.array([row], dtype=np.int32)
+        rows, levels = [], []
+        generation = 0
+        while frontier.size and (generations is None or generation < generations):
+            generation += 1
+            reached = csr_gather(offsets, targets, frontier)
+            frontier = np.unique(reached[~seen[reached]])
+            seen[frontier] = True
+            rows.append(frontier)
+            levels.append(np.full(frontier.size, generation, dtype=np.int32))
+        if not rows:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return np.concatenate(rows), np.concatenate(levels)
+
+    def depth_first(self, offsets, targets, row, generations=None):
+        """
+        Function to visit the rows reachable from one row depth first, a generation at a time as in breadth_first
+        Every row gets the generation of its shortest line and is visited below the row one generation above it
+        that comes first depth first, so the generations limit reaches the same rows whichever line is walked first.
+        The rows of a generation are kept in depth first order, then the sizes of the subtrees, added up from the
+        last generation, give every row its place in the preorder
+        :param offsets: offsets of the edges to follow, such as self.parent_offsets
+        :param targets: targets of the edges to follow, such as self.parents
+        :param row: row to start from, it is not part of the result
+        :param generations: number of edges to follow at most, None for no limit
+        :return: int32 array of rows, int32 array of their generations, in preorder
+        """
+        depth = np.full(len(offsets) - 1, -1, dtype=np.int32)
+        depth[row] = 0
+        frontier = np.array([row], dtype=np.int32)
+        tiers, claims = [frontier], []  # rows of each generation, index of the row above each one in the tier above
+        while generations is None or len(claims) < generations:
+            reached = csr_gather(offsets, targets, frontier)
+            sources = np.repeat(np.arange(frontier.size), offsets[frontier + 1] - offsets[frontier])
+            fresh = np.flatnonzero(depth[reached] < 0)
+            if not fresh.size:
+                break
+            # the first edge to a row comes from the row above it that comes first depth first
+            edges = np.sort(fresh[np.unique(reached[fresh], return_index=True)[1]])
+            frontier = reached[edges]
+            depth[frontier] = len(tiers)
+            tiers.append(frontier)
+            claims.append(sources[edges])
+
+        sizes = [np.ones(tier.size, dtype=np.int64) for tier in tiers]
+        for generation in range(len(claims), 0, -1):
+            sizes[generation - 1] += np.bincount(claims[generation - 1], weights=sizes[generation],
+                                                 minlength=tiers[generation - 1].size).astype(np.int64)
+        places = [np.zeros(1, dtype=np.int64)]
+        rows = np.empty(int(sizes[0][0]) - 1, dtype=np.int32)
+        levels = np.empty(rows.size, dtype=np.int32)
+        for generation in range(1, len(tiers)):
+            claim = claims[generation - 1]
+            before = np.cumsum(sizes[generation]) - sizes[generation]
+            first = np.flatnonzero(np.concatenate([[True], claim[1:] != claim[:-1]]))
+            before -= np.repeat(before[first], np.diff(np.append(first, claim.size)))
+            places.append(places[generation - 1][claim] + 1 + before)
+            rows[places[generation] - 1] = tiers[generation]
+            levels[places[generation] - 1] = generation
+        return rows, levels
+
+
+def snapshot_key(file):
+    """
+    Function to build the snapshot cache key of a file from its size, mtime and content hash
+    The snapshot version and the record fields are part of the key so parser changes never load old snapshots
+    :param file: gedcom file name
+    :return: key string usable as a file name
+    """
+    stat = os.stat(file)
+    content = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as ged:
+        for block in iter(lambda: ged.read(MMAP_BLOCK_SIZE), b""):
+            content.update(block)
+    signature = "{}|{}|{}|{}|{}".format(SNAPSHOT_VERSION, ",".join(Individual.__slots__), ",".join(Family.__slots__),
+                                         stat.st_size, stat.st_mtime_ns)
+    return "{}-{}".format(hashlib.blake2b(signature.encode(), digest_size=8).hexdigest(), content.hexdigest())
+
+
+def evict_snapshots(cache_dir, max_bytes):
+    """
+    Function to delete the least recently used snapshots until the cache directory fits in max_bytes
+    Loading a snapshot refreshes its mtime, so mtime order is use order
+    :param cache_dir: snapshot directory
+    :param max_bytes: size budget of all snapshots together
+    """
+    snapshots = []
+    for path in pathlib.Path(cache_dir).glob("*.snap"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # removed by another run
+            continue
+        snapshots.append((stat.st_mtime_ns, stat.st_size, path))
+    snapshots.sort()
+    total = sum(size for mtime, size, path in snapshots)
+    for mtime, size, path in snapshots:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def record_offsets(mm, parts):
+    """
+    Function to split a memory mapped file into byte ranges that each start on a level 0 INDI or FAM record
+    :param mm: mmap object
+    :param parts: number of ranges wanted, fewer are returned for small files
+    :return: list of offsets, consecutive pairs are the ranges
+    """
+    size = len(mm)
+    offsets = [0]
+    for part in range(1, parts):
+        pos = max(size * part // parts, offsets[-1])
+        while True:
+            pos = mm.find(b"\n0 ", pos)
+            if pos < 0:
+                break
+            pos += 1
+            line_end = mm.find(b"\n", pos)
+            if mm[pos:size if line_end < 0 else line_end].split()[-1] in BYTE_RECORDS:
+                break
+        if pos < 0:
+            break
+        if pos > offsets[-1]:
+            offsets.append(pos)
+    offsets.append(size)
+    return offsets
+
+
+class TreeSample:
+    """
+    Reproducible random sample of the individuals and families of a file, picked without parsing the file
+    The level 0 lines are indexed with a regex scan, then the link lines of the sampled records are followed, as
+    written in the records, to the records their checks read: RECHECK_INDIVIDUAL_LINKS links from a sampled
+    individual, RECHECK_FAMILY_LINKS links from a sampled family and every ancestor of its spouses for US17
+    people, families: sampled IDs
+    spans: sorted (start, end) byte ranges of the records to parse, every record of a repeated ID is included
+    population: number of individual IDs and of family IDs in the file
+    """
+
+    def __init__(self, mm, size, seed=0):
+        records = {"INDI": defaultdict(list), "FAM": defaultdict(list)}
+        found = list(LEVEL0_LINE.finditer(mm))
+        ends = [match.start() for match in found[1:]] + [len(mm)]
+        for match, end in zip(found, ends):
+            kind = BYTE_RECORDS.get(match.group(2))
+            if kind is not None:
+                records[kind][match.group(1)].append((match.start(), end))
+        rng = random.Random(seed)
+        people = rng.sample(list(records["INDI"]), min(size, len(records["INDI"])))
+        families = rng.sample(list(records["FAM"]), min(size, len(records["FAM"])))
+
+        self.links = {}  # (kind, xref) to the (tag, xref) of its link lines
+        needed = set()
+        self.follow(mm, records, needed, [("INDI", xref) for xref in people], RECHECK_INDIVIDUAL_LINKS, LINK_KINDS)
+        self.follow(mm, records, needed, [("FAM", xref) for xref in families], RECHECK_FAMILY_LINKS, LINK_KINDS)
+        self.follow(mm, records, needed, [("FAM", xref) for xref in families], None, ANCESTOR_TAGS)
+        self.links = None
+        self.spans = sorted(span for kind, xref in needed for span in records[kind][xref])
+        self.people = [xref.decode() for xref in people]
+        self.families = [xref.decode() for xref in families]
+        self.population = (len(records["INDI"]), len(records["FAM"]))
+
+    def follow(self, mm, records, needed, start, links, tags):
+        """
+        Function to add the records up to a number of links away from some records to the needed ones
+        :param mm: mmap object or bytes of the file
+        :param records: dict of kind to dict of xref to byte ranges
+        :param needed: set of (kind, xref) to add to
+        :param start: (kind, xref) of the records to start from
+        :param links: number of links to follow, None to follow them as far as they go
+        :param tags: link tags to follow
+        """
+        frontier = [record for record in start if record[1] in records[record[0]]]
+        seen = set(frontier)
+        distance = 0
+        while frontier and (links is None or distance < links):
+            distance += 1
+            next_frontier = []
+            for record in frontier:
+                if record not in self.links:
+                    self.links[record] = [(tag, xref) for begin, end in records[record[0]][record[1]]
+                                          for tag, xref in LINK_LINE.findall(mm, begin, end)]
+                for tag, xref in self.links[record]:
+                    linked = (LINK_KINDS[tag], xref)
+                    if tag in tags and linked not in seen and xref in records[linked[0]]:
+                        seen.add(linked)
+                        next_frontier.append(linked)
+            frontier = next_frontier
+        needed.update(seen)
+
+
+def wilson_interval(hits, sampled, population=None, z=CONFIDENCE_Z):
+    """
+    Function to compute the Wilson score interval of a proportion, the finite population correction is applied by
+    growing the sample size, a sample of every record gives the exact rate
+    :param hits: sampled records with the property
+    :param sampled: number of sampled records
+    :param population: number of records sampled from, None for an unlimited population
+    :param z: standard normal quantile of the confidence level
+    :return: low, high
+    """
+    if sampled == 0:
+        return 0.0, 1.0
+    rate = hits / sampled
+    if population is not None:
+        if population <= sampled:
+            return rate, rate
+        sampled = sampled * (population - 1) / (population - sampled)
+    denominator = 1 + z * z / sampled
+    centre = (rate + z * z / (2 * sampled)) / denominator
+    half = z * math.sqrt(rate * (1 - rate) / sampled + z * z / (4 * sampled * sampled)) / denominator
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def sample_estimates(anomalies, tree_sample, stops=()):
+    """
+    Function to estimate from the errors of a checked TreeSample how many records of the whole tree have each error
+    :param anomalies: Gedcom.anomalies of the sampled run
+    :param tree_sample: TreeSample that was checked
+    :param stops: sampled families without a marriage date, which stop a full run
+    :return: list of dicts by category and scope with the sampled records, the records with the error, the errors,
+    the rate of records with the error, its confidence interval and the estimated records with the error in the tree
+    """
+    hits = defaultdict(set)
+    errors = defaultdict(int)
+    for (kind, key), found in anomalies.items():
+        for category, message in found:
+            if kind != "TREE" and category is not None:
+                hits[(category, kind)].add(key)
+                errors[(category, kind)] += 1
+    for key in stops:
+        hits[("No Marriage date found", "FAM")].add(key)
+        errors[("No Marriage date found", "FAM")] += 1
+    sizes = {"INDI": (len(tree_sample.people), tree_sample.population[0]),
+             "FAM": (len(tree_sample.families), tree_sample.population[1])}
+    estimates = []
+    for (category, kind), keys in sorted(hits.items()):
+        sampled, population = sizes[kind]
+        low, high = wilson_interval(len(keys), sampled, population)
+        estimates.append({"category": category, "scope": kind, "sampled": sampled, "records": len(keys),
+                          "errors": errors[(category, kind)], "rate": len(keys) / sampled, "low": low, "high": high,
+                          "estimated": round(len(keys) / sampled * population)})
+    return estimates
+
+
+def changed_records(old, new):
+    """
+    Function to diff two parses of a file at the level 0 record level
+    :param old: userdata or familydata of the previous parse
+    :param new: the same dict of the new parse
+    :return: set of the IDs that were added, removed or edited
+    """
+    changed = {key for key in old if key not in new}
+    for key, record in new.items():
+        previous = old.get(key)
+        if previous is None or previous.parsed() != record.parsed():
+            changed.add(key)
+    return changed
+
+
+def relative_index(userdata, familydata):
+    """
+    Function to index the links of a tree in the direction the records do not store
+    :param userdata: individuals
+    :param familydata: families
+    :return: dict of individual ID to the families naming it as husband, wife or child,
+    dict of family ID to the individuals naming it in FAMC or FAMS
+    """
+    listed_in = defaultdict(list)
+    for fam_id, family in familydata.items():
+        for key in (family.husb, family.wife, *(family.chil or ())):
+            if key is not None:
+                listed_in[key].append(fam_id)
+    named_by = defaultdict(list)
+    for key, record in userdata.items():
+        for fam_id in (record.famc, record.fams):
+            if fam_id is not None:
+                named_by[fam_id].append(key)
+    return listed_in, named_by
+
+
+def nearby_records(trees, people, families, links):
+    """
+    Function to find the records at most a number of links away from the given ones
+    Links go between an individual and a family naming each other, they are followed both ways in every tree
+    :param trees: list of (userdata, familydata, listed_in, named_by)
+    :param people: IDs of the individuals to start from
+    :param families: IDs of the families to start from
+    :param links: number of links to follow
+    :return: dict of individual ID to its distance, dict of family ID to its distance
+    """
+    near_people = dict.fromkeys(people, 0)
+    near_families = dict.fromkeys(families, 0)
+    people_frontier, family_frontier = list(near_people), list(near_families)
+    for distance in range(1, links + 1):
+        next_people, next_families = [], []
+        for userdata, familydata, listed_in, named_by in trees:
+            for key in people_frontier:
+                record = userdata.get(key)
+                linked = listed_in.get(key, [])
+                if record is not None:
+                    linked = [record.famc, record.fams] + linked
+                for fam_id in linked:
+                    if fam_id is not None and fam_id not in near_families:
+                        near_families[fam_id] = distance
+                        next_families.append(fam_id)
+            for fam_id in family_frontier:
+                family = familydata.get(fam_id)
+                linked = named_by.get(fam_id, [])
+                if family is not None:
+                    linked = [family.husb, family.wife] + list(family.chil or ()) + linked
+                for key in linked:
+                    if key is not None and key not in near_people:
+                        near_people[key] = distance
+                        next_people.append(key)
+        people_frontier, family_frontier = next_people, next_families
+    return near_people, near_families
+
+
+def descendant_families(trees, people, families):
+    """
+    Function to find the families in which a spouse descends from one of the given records, in any of the trees
+    Parents are the husband and wife of the family an individual names in FAMC, as in Kinship
+    :param trees: list of (userdata, familydata, listed_in, named_by)
+    :param people: IDs of the individuals to start from, they count as their own descendants
+    :param families: IDs of the families whose children to start from
+    :return: set of family IDs
+    """
+    found = set()
+    for userdata, familydata, listed_in, named_by in trees:
+        stack = list(people)
+        stack.extend(key for fam_id in families for key in named_by.get(fam_id, [])
+                     if userdata[key].famc == fam_id)
+        seen = set(stack)
+        while stack:
+            key = stack.pop()
+            for fam_id in listed_in.get(key, []):
+                family = familydata[fam_id]
+                if key != family.husb and key != family.wife:
+                    continue
+                found.add(fam_id)
+                for child in named_by.get(fam_id, []):
+                    if child not in seen and userdata[child].famc == fam_id:
+                        seen.add(child)
+                        stack.append(child)
+    return found
+
+
+def parse_chunk(file, start, end):
+    """
+    Function run in a worker process to parse the records between two byte offsets
+    Printed errors are captured so the parent can replay them in file order
+    :param file: gedcom file name
+    :param start: byte offset of the first record
+    :param end: byte offset after the last record
+    :return: dict with the parsed data, the records defined in order and the captured output
+    """
+    g = Gedcom(file, "n")
+    defined = []
+
+    def track(kind, handler, data):
+        def tracked(split_words):
+            defined.append((kind, split_words[1], split_words[1] in data))
+            handler(split_words)
+        return tracked
+
+    g.process_flow_dict = {"INDI": track("INDI", g.append2userdata, g.userdata),
+                           "FAM": track("FAM", g.append2familydata, g.familydata)}
+    output = io.StringIO()
+    result = exception = None
+    with contextlib.redirect_stdout(output):
+        try:
+            result = g.mmap_file(start, end)
+        except Exception as e:  # raised by the parent only if the serial parse would have reached it
+            exception = e
+    return {"userdata": dict(g.userdata), "familydata": dict(g.familydata), "errorlog": dict(g.errorlog),
+            "defined": defined, "output": output.getvalue(), "result": result, "exception": exception,
+            "lines_read": g.lines_read, "tempdata": g.tempdata, "curr_id": g.curr_id,
+            "divorces": g.unmatched_divorces}
+
+
+def batch_files(path):
+    """
+    Function to list the files of a batch
+    :param path: directory searched for gedcom files, or a manifest file naming one file per line,
+    relative names in a manifest are relative to the manifest, blank lines and lines starting with # after any
+    indentation are skipped
+    :return: list of file names
+    """
+    if os.path.isdir(path):
+        return sorted(str(file) for file in pathlib.Path(path).rglob("*") if file.is_file() and is_gedcom(file.name))
+    base = os.path.dirname(path)
+    with open(path) as manifest:
+        return [os.path.join(base, name) for name in (line.strip() for line in manifest)
+                if name and not name.startswith("#")]
+
+
+def available_cpus():
+    """
+    Function to count the CPUs this process may run on
+    :return: number of CPUs
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on every platform
+        return os.cpu_count() or 1
+
+
+def analyze_file(file, options):
+    """
+    Function run in a worker process to analyze one file of a batch, printed output is discarded
+    :param file: gedcom file name
+    :param options: keyword arguments for Gedcom.analyze
+    :return: dict with the file, its result, errorlog, anomalies and the seconds it took
+    """
+    g = Gedcom(file, "n")
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        try:
+            result = g.analyze(**options)
+        except SystemExit:  # missing files and unreadable dates end a single file run
+            lines = output.getvalue().strip().splitlines()
+            result = lines[-1] if lines else "Exited"
+        except Exception as e:
+            result = "{}: {}".format(type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    return {"file": file, "error": result[0] if isinstance(result, tuple) else result,
+            "errorlog": dict(g.errorlog), "anomalies": anomaly_list(g), "seconds": seconds}
+
+
+def analyze_batch(files, workers=None, **options):
+    """
+    Function to analyze many files in a process pool, one file per task
+    The largest files are started first so a big file picked up last does not keep one process busy alone
+    :param files: gedcom file names
+    :param workers: number of processes, defaults to the CPUs this process may run on
+    :param options: keyword arguments for Gedcom.analyze
+    :return: dict with the results of each file in the given order, the summed errorlog and the seconds taken
+    """
+    files = list(files)
+    order = sorted(range(len(files)), reverse=True,
+                   key=lambda index: os.path.getsize(files[index]) if os.path.exists(files[index]) else 0)
+    workers = min(workers or available_cpus(), len(files) or 1)
+    start = time.perf_counter()
+    results = [None] * len(files)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {pool.submit(analyze_file, files[index], options): index for index in order}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    else:
+        for index in order:
+            results[index] = analyze_file(files[index], options)
+
+    errorlog = defaultdict(int)
+    for result in results:
+        for error, count in result["errorlog"].items():
+            errorlog[error] += count
+    return {"files": results, "errorlog": errorlog, "seconds": time.perf_counter() - start}
+
+
+def tree_bytes(g):
+    """
+    Function to estimate the memory taken by the records of a parsed tree, the indexes built from them are not counted
+    :param g: Gedcom object
+    :return: approximate number of bytes
+    """
+    total = sys.getsizeof(g.userdata) + sys.getsizeof(g.familydata)
+    for records in (g.userdata, g.familydata):
+        for key, record in records.items():
+            total += sys.getsizeof(key) + sys.getsizeof(record)
+            for field in record.__slots__:
+                value = getattr(record, field)
+                if value is not None:
+                    total += sys.getsizeof(value)
+    return total
+
+
+def anomaly_list(g):
+    """
+    Function to flatten the anomalies of a Gedcom object
+    :param g: Gedcom object
+    :return: list of (kind, key, category, message) in report order
+    """
+    return [(kind, key, category, message) for (kind, key), errors in g.anomalies.items()
+            for category, message in errors]
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON request per line from a connection and writes one JSON response line for each
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.respond(request)
+            except Exception as e:
+                response = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+# Unix domain sockets are missing on some platforms, ValidationDaemon can not be started there
+UnixServer = socketserver.UnixStreamServer if hasattr(socket, "AF_UNIX") else socketserver.BaseServer
+
+
+class ValidationDaemon(UnixServer):
+    """
+    Local server keeping analyzed Gedcom objects in memory so editors can validate a file on every save without
+    starting python and parsing it again, requests are JSON objects on a Unix domain socket, one per line:
+    {"op": "validate", "file": name, "rules": [...], "max_errors": n} checks a file, an unchanged file is answered
+    from memory and an edited one with Gedcom.revalidate, "rules" and "max_errors" are optional
+    {"op": "revalidate", "file": name} checks the edits of a file held in memory
+    {"op": "lookup", "file": name, "id": id} returns the fields and errors of one individual or family
+    {"op": "stats"} lists the files held and their estimated bytes
+    {"op": "shutdown"} stops the daemon
+    Trees are evicted least recently used first once their tree_bytes estimates add up to more than max_bytes,
+    requests are answered one at a time
+    """
+
+    def __init__(self, path, max_bytes=DAEMON_MEMORY):
+        self.trees = OrderedDict()  # absolute file name to dict of the Gedcom, stat, options, error and bytes
+        self.max_bytes = max_bytes
+        self.stopping = False
+        self.operations = {"validate": self.validate, "revalidate": self.revalidate, "lookup": self.lookup,
+                           "stats": self.stats, "shutdown": self.stop}
+        super().__init__(path, DaemonHandler)
+
+    def serve(self):
+        """
+        Function to answer requests until a shutdown request, the socket file is removed afterwards
+        """
+        try:
+            while not self.stopping:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.unlink(self.server_address)
+
+    def respond(self, request):
+        """
+        Function to answer one request
+        :param request: dict with an "op" key
+        :return: JSON serializable dict, "ok" is False with an "error" for requests that failed
+        """
+        operation = self.operations.get(request.get("op"))
+        if operation is None:
+            return {"ok": False, "error": "Unknown op {}".format(request.get("op"))}
+        return operation(request)
+
+    def validate(self, request, incremental=False):
+        """
+        Function to check a file, reusing the tree held in memory when the file or the options did not change
+        :param request: dict with the "file" and optional "rules" and "max_errors"
+        :param incremental: fail instead of analyzing a file that is not held in memory
+        :return: response dict with the error, errorlog, anomalies, how the file was checked and the seconds taken
+        """
+        file = os.path.abspath(request["file"])
+        options = {"rules": request.get("rules"), "max_errors": request.get("max_errors")}
+        if options["rules"] is not None:
+            select_rules(options["rules"])  # raises ValueError for unknown user stories
+        start = time.perf_counter()
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            self.evict(file)
+            return {"ok": False, "error": "{} Not found".format(file)}
+        signature = (stat.st_size, stat.st_mtime_ns)
+        entry = self.trees.get(file)
+        if entry is not None and entry["options"] != options:
+            entry = None
+        if entry is None and incremental:
+            return {"ok": False, "error": "{} is not held in memory".format(file)}
+
+        self.evict(file)  # a failed check leaves no tree behind
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                if entry is not None and entry["stat"] == signature and not incremental:
+                    how = "memory"
+                elif entry is not None and options["max_errors"] is None:
+                    how = "revalidated"
+                    entry["error"] = entry["gedcom"].revalidate(file, tokenizer="mmap")[0]
+                else:
+                    how = "parsed"
+                    g = Gedcom(file, "n")
+                    result = g.analyze(tokenizer="mmap", **options)
+                    if isinstance(result, str):
+                        return {"ok": False, "error": result}
+                    entry = {"gedcom": g, "options": options, "error": result[0]}
+        except SystemExit:  # missing files and unreadable dates end a check
+            lines = output.getvalue().strip().splitlines()
+            return {"ok": False, "error": lines[-1] if lines else "Exited"}
+        g = entry["gedcom"]
+        g.ptUsers = PrettyTable()  # only printed tables are needed, do not hold their rows
+        g.ptFamily = PrettyTable()
+        entry["stat"] = signature
+        entry["bytes"] = tree_bytes(g) if how != "memory" else entry["bytes"]
+        self.trees[file] = entry
+        self.evict_to_fit()
+        response = {"ok": True, "file": file, "how": how, "error": entry["error"], "errorlog": dict(g.errorlog),
+                    "anomalies": anomaly_list(g), "seconds": time.perf_counter() - start}
+        if how == "revalidated":
+            response["rechecked"] = [len(records) for records in g.rechecked]
+        return response
+
+    def revalidate(self, request):
+        """
+        Function to check the edits of a file held in memory, even if its size and mtime did not change
+        :param request: dict with the "file" and the options it was validated with
+        :return: response of validate
+        """
+        return self.validate(request, incremental=True)
+
+    def lookup(self, request):
+        """
+        Function to look up an individual or family of a file, the file is validated first
+        :param request: dict with the "file", the "id" and the options of validate
+        :return: response dict with the kind, fields and errors of the record
+        """
+        response = self.validate(request)
+        if not response["ok"]:
+            return response
+        g = self.trees[response["file"]]["gedcom"]
+        key = request["id"]
+        for kind, records in (("INDI", g.userdata), ("FAM", g.familydata)):
+            if key in records:
+                return {"ok": True, "kind": kind, "id": key, "record": dict(records[key].items()),
+                        "anomalies": g.anomalies.get((kind, key), [])}
+        return {"ok": False, "error": "{} Not found in {}".format(key, response["file"])}
+
+    def stats(self, request):
+        """
+        Function to list the files held in memory, least recently used first
+        :param request: unused
+        :return: response dict with the files, their estimated bytes and the budget
+        """
+        return {"ok": True, "files": [[file, entry["bytes"]] for file, entry in self.trees.items()],
+                "bytes": sum(entry["bytes"] for entry in self.trees.values()), "max_bytes": self.max_bytes}
+
+    def stop(self, request):
+        """
+        Function to stop serve after the current connection
+        :param request: unused
+        :return: response dict
+        """
+        self.stopping = True
+        return {"ok": True}
+
+    def evict(self, file):
+        """
+        Function to drop the tree of a file from memory
+        :param file: absolute file name
+        """
+        self.trees.pop(file, None)
+
+    def evict_to_fit(self):
+        """
+        Function to drop the least recently used trees until they fit in max_bytes, the last one used is kept
+        """
+        total = sum(entry["bytes"] for entry in self.trees.values())
+        while total > self.max_bytes and len(self.trees) > 1:
+            file, entry = self.trees.popitem(last=False)
+            total -= entry["bytes"]
+
+
+def daemon_request(path, request):
+    """
+    Function to send one request to a ValidationDaemon and wait for its response
+    :param path: socket file of the daemon
+    :param request: dict, see ValidationDaemon
+    :return: response dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        with connection.makefile("rb") as responses:
+            return json.loads(responses.readline())
+
+
+class Anomaly:
+    """
+    One error found by the checks, as report_error sends it to the anomaly sinks
+    rule: user story of the check that found it, such as "US01"
+    severity: "error" for the errors counted in the errorlog, "warning" for the ones that are only printed
+    kind, key: scope the error is filed under, "INDI", "FAM" or "TREE" and the record ID
+    records: IDs of the records involved, the checked record first
+    dates: dates the error is about, as written in the file
+    category: errorlog key, None for warnings
+    message: error text
+    """
+    __slots__ = ("rule", "severity", "kind", "key", "records", "dates", "category", "message")
+
+    def __init__(self, rule, kind, key, records, dates, category, message):
+        self.rule = rule
+        self.severity = "error" if category is not None else "warning"
+        self.kind = kind
+        self.key = key
+        self.records = records
+        self.dates = dates
+        self.category = category
+        self.message = message
+
+    def as_dict(self):
+        """
+        Function to get the fields of the anomaly
+        :return: dict of field name to value
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class TextSink:
+    """
+    Anomaly sink writing the message of each anomaly as a line, the lines are written in batches
+    """
+
+    def __init__(self, out=None, batch=ANOMALY_BATCH):
+        self.out = out  # None writes to the sys.stdout of the time of the flush
+        self.batch = batch
+        self.lines = []
+
+    def write(self, anomaly):
+        self.lines.append(anomaly.message)
+        if len(self.lines) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            (sys.stdout if self.out is None else self.out).write("\n".join(self.lines) + "\n")
+            self.lines = []
+
+
+class JsonLinesSink:
+    """
+    Anomaly sink writing each anomaly as a JSON object on its own line, the lines are written in batches
+    """
+
+    def __init__(self, out, batch=ANOMALY_BATCH):
+        self.out = out  # text file
+        self.batch = batch
+        self.lines = []
+
+    def write(self, anomaly):
+        self.lines.append(json.dumps(anomaly.as_dict()))
+        if len(self.lines) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.out.write("\n".join(self.lines) + "\n")
+            self.lines = []
+
+
+class ListSink:
+    """
+    Anomaly sink keeping the anomalies in a list
+    """
+
+    def __init__(self):
+        self.anomalies = []
+
+    def write(self, anomaly):
+        self.anomalies.append(anomaly)
+
+    def flush(self):
+        pass
+
+
+STORE_TABLES = """
+CREATE TABLE individuals (id TEXT PRIMARY KEY, name TEXT, name_key TEXT, sex TEXT, birth TEXT, death TEXT,
+    marriage TEXT, divorce TEXT, birth_day INTEGER, death_day INTEGER, marriage_day INTEGER, divorce_day INTEGER,
+    famc TEXT, fams TEXT, marriages TEXT, extra TEXT) WITHOUT ROWID;
+CREATE TABLE families (id TEXT PRIMARY KEY, husb TEXT, wife TEXT, chil TEXT, extra TEXT) WITHOUT ROWID;
+CREATE TABLE headers (seq INTEGER PRIMARY KEY, kind TEXT, id TEXT);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+# created once the tree is loaded, so the batches are not slowed down by keeping them up to date
+STORE_INDEX_SQL = (
+    "CREATE INDEX individuals_famc ON individuals (famc)",
+    "CREATE INDEX individuals_fams ON individuals (fams)",
+    "CREATE INDEX individuals_birth ON individuals (birth_day)",
+    "CREATE INDEX individuals_death ON individuals (death_day)",
+    "CREATE INDEX individuals_marriage ON individuals (marriage_day)",
+    "CREATE INDEX individuals_divorce ON individuals (divorce_day)",
+    "CREATE INDEX individuals_name_birth ON individuals (name_key, birth_day)",
+    "CREATE INDEX individuals_name_marriage ON individuals (name_key, marriage_day)",
+    "CREATE INDEX families_husb ON families (husb)",
+    "CREATE INDEX families_wife ON families (wife)",
+    "CREATE INDEX headers_id ON headers (kind, id, seq)",
+)
+# every INDI or FAM line repeating the ID of an earlier one of the same kind, in file order, for US22
+REPEATED_IDS_SQL = """SELECT kind, id FROM headers AS h WHERE EXISTS (
+    SELECT 1 FROM headers AS e WHERE e.kind = h.kind AND e.id = h.id AND e.seq < h.seq) ORDER BY seq"""
+INVALID_DATES_SQL = """SELECT 1 FROM individuals WHERE birth IS NOT NULL AND birth_day = 0
+    OR death IS NOT NULL AND death_day = 0 OR marriage IS NOT NULL AND marriage_day = 0
+    OR divorce IS NOT NULL AND divorce_day = 0 LIMIT 1"""
+# sorted IDs of the records having a person_key and a family_key, for StoredDuplicates
+SAME_PERSON_SQL = "SELECT id FROM individuals WHERE name_key = ? AND birth_day = ? ORDER BY id"
+SAME_FAMILY_SQL = """SELECT f.id FROM individuals AS h JOIN families AS f ON f.husb = h.id
+    JOIN individuals AS w ON w.id = f.wife WHERE h.name_key = ? AND w.name_key = ? AND h.marriage_day = ?
+    ORDER BY f.id"""
+
+
+def stored_json(value):
+    """
+    Function to store the marriages or extra tags of a record as JSON
+    :param value: list, dict or None
+    :return: JSON text or None
+    """
+    return json.dumps(value) if value is not None else None
+
+
+def individual_row(key, record):
+    """
+    Function to build the row of an individual in a TreeStore, with the day ordinals and normalized name the queries
+    compare
+    :param key: ID
+    :param record: Individual
+    :return: tuple of values in the column order of the individuals table
+    """
+    return (key, record.name, normalized_name(record.name) if record.name else None, record.sex, record.birth,
+            record.death, record.marriage, record.divorce, date_ordinal(record.birth), date_ordinal(record.death),
+            date_ordinal(record.marriage), date_ordinal(record.divorce), record.famc, record.fams,
+            stored_json(record.marriages), stored_json(record.extra))
+
+
+def stored_individual(row):
+    """
+    Function to rebuild an individual from its row in a TreeStore
+    :param row: tuple returned by individual_row
+    :return: Individual
+    """
+    record = Individual()
+    (key, record.name, name_key, record.sex, record.birth, record.death, record.marriage, record.divorce,
+     record.birth_day, record.death_day, record.marriage_day, record.divorce_day, record.famc, record.fams, marriages,
+     extra) = row
+    record.marriages = json.loads(marriages) if marriages is not None else None
+    record.extra = json.loads(extra) if extra is not None else None
+    return record
+
+
+def stored_family(row):
+    """
+    Function to rebuild a family from its row in a TreeStore
+    :param row: (ID, husb, wife, children JSON, extra JSON)
+    :return: Family
+    """
+    record = Family()
+    key, record.husb, record.wife, children, extra = row
+    record.chil = json.loads(children) if children is not None else None
+    record.extra = json.loads(extra) if extra is not None else None
+    return record
+
+
+class TreeStore:
+    """
+    SQLite database holding one parsed tree, so trees that do not fit in memory can be checked a window at a time
+    individuals, families: one row per record by ID, individuals also hold their dates as day ordinals and the
+    normalized name US23 and US24 compare, marriages, children and other tags are JSON
+    headers: every INDI and FAM line in file order, US22 finds the repeated IDs in it
+    meta: the snapshot_key of the loaded file, the text printed while loading it and the lines read
+    PRAGMA user_version is STORE_VERSION, a database of another version is emptied and loaded again
+    """
+
+    def __init__(self, path, batch=STORE_BATCH):
+        self.connection = sqlite3.connect(path)
+        self.batch = batch
+        self.headers = []  # (kind, ID) of the INDI and FAM lines read since the last write
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+            self.reset()
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self):
+        """
+        Function to drop the loaded tree and create empty tables
+        """
+        self.connection.executescript("DROP TABLE IF EXISTS individuals; DROP TABLE IF EXISTS families;"
+                                      "DROP TABLE IF EXISTS headers; DROP TABLE IF EXISTS meta;" + STORE_TABLES +
+                                      "PRAGMA user_version = {};".format(STORE_VERSION))
+        self.headers = []
+
+    def holds(self, key):
+        """
+        Function to check if the database holds a completely loaded file
+        :param key: snapshot_key of the file
+        :return: bool
+        """
+        return self.meta("file") == key
+
+    def meta(self, name):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def write(self, people, families):
+        """
+        Function to write a batch of records and the headers read since the last write in one transaction
+        Records already in the database are replaced
+        :param people: dict of ID to Individual
+        :param families: dict of ID to Family
+        """
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO individuals VALUES ({})".format(", ".join("?" * 16)),
+                                        [individual_row(key, record) for key, record in dict.items(people)
+                                         if key is not None])
+            self.connection.executemany("INSERT OR REPLACE INTO families VALUES (?, ?, ?, ?, ?)",
+                                        [(key, record.husb, record.wife, stored_json(record.chil),
+                                          stored_json(record.extra)) for key, record in dict.items(families)
+                                         if key is not None])
+            self.connection.executemany("INSERT INTO headers (kind, id) VALUES (?, ?)", self.headers)
+        self.headers = []
+
+    def finish(self, key, output, lines_read):
+        """
+        Function to index the loaded tree and mark it as completely loaded
+        :param key: snapshot_key of the file
+        :param output: text printed while loading it
+        :param lines_read: lines of the file
+        """
+        with self.connection:
+            for sql in STORE_INDEX_SQL:
+                self.connection.execute(sql)
+            self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                        [("file", key), ("output", output), ("lines_read", str(lines_read))])
+
+    def records(self, kind, keys):
+        """
+        Function to read records by ID with one indexed query per 500 IDs
+        :param kind: "INDI" or "FAM"
+        :param keys: list of IDs
+        :return: generator of (ID, record), IDs not in the database are left out
+        """
+        table, build = ("individuals", stored_individual) if kind == "INDI" else ("families", stored_family)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            for row in self.connection.execute("SELECT * FROM {} WHERE id IN ({})".format(
+                    table, ", ".join("?" * len(chunk))), chunk):
+                yield row[0], build(row)
+
+    def scan(self, kind):
+        """
+        Function to read every record in ID order, batch records at a time
+        :param kind: "INDI" or "FAM"
+        :return: generator of lists of (ID, record)
+        """
+        table, build = ("individuals", stored_individual) if kind == "INDI" else ("families", stored_family)
+        rows = self.connection.execute("SELECT * FROM {} ORDER BY id".format(table))
+        for batch in iter(lambda: rows.fetchmany(self.batch), []):
+            yield [(row[0], build(row)) for row in batch]
+
+    def flagged(self, sql):
+        """
+        Function to run a query selecting IDs and read them batch IDs at a time
+        :param sql: query whose first column is an ID
+        :return: generator of lists of IDs
+        """
+        rows = self.connection.execute(sql)
+        for batch in iter(lambda: rows.fetchmany(self.batch), []):
+            yield [row[0] for row in batch]
+
+    def ids(self, sql, parameters):
+        return [row[0] for row in self.connection.execute(sql, parameters)]
+
+    def repeated_ids(self):
+        """
+        Function to find the INDI and FAM lines repeating an ID, for US22
+        :return: cursor of (kind, ID) in file order
+        """
+        return self.connection.execute(REPEATED_IDS_SQL)
+
+    def invalid_dates(self):
+        return self.connection.execute(INVALID_DATES_SQL).fetchone() is not None
+
+
+class StoredRecords(dict):
+    """
+    The records of one kind of a TreeStore that are in memory, used as userdata or familydata
+    A missing ID is read from the store, or created empty if the store does not have it either, like the
+    defaultdict it stands in for, keys(), values() and items() only cover the records in memory
+    prepare: None or a function called on every record read from the store
+    """
+
+    def __init__(self, store, kind, prepare=None):
+        super().__init__()
+        self.store = store
+        self.kind = kind
+        self.prepare = prepare
+
+    def __missing__(self, key):
+        record = self.get(key)
+        if record is None:
+            record = self[key] = Individual() if self.kind == "INDI" else Family()
+        return record
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self.load([key])
+        return dict.get(self, key, default)
+
+    def load(self, keys):
+        """
+        Function to read the records of some IDs that are not in memory
+        :param keys: iterable of IDs
+        """
+        missing = [key for key in dict.fromkeys(keys) if key is not None and not dict.__contains__(self, key)]
+        for key, record in self.store.records(self.kind, missing):
+            if self.prepare is not None:
+                self.prepare(record)
+            self[key] = record
+
+    def hold(self, records):
+        """
+        Function to replace the records in memory
+        :param records: iterable of (ID, record) read from the store
+        """
+        self.clear()
+        for key, record in records:
+            if self.prepare is not None:
+                self.prepare(record)
+            self[key] = record
+
+
+class StoredGroups:
+    """
+    Mapping of a person_key or family_key to the sorted IDs having it, each lookup is an indexed query on a TreeStore
+    """
+    __slots__ = ("store", "sql")
+
+    def __init__(self, store, sql):
+        self.store = store
+        self.sql = sql
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        return self.store.ids(self.sql, key) or default
+
+
+class StoredDuplicates:
+    """
+    DuplicateIndex of a TreeStore, finding the duplicates of a record queries the store instead of hashing the tree
+    """
+    __slots__ = ("people", "families")
+
+    def __init__(self, store):
+        self.people = StoredGroups(store, SAME_PERSON_SQL)
+        self.families = StoredGroups(store, SAME_FAMILY_SQL)
+
+
+def name_parts(name):
+    """
+    Function to split a name as written in the file into the given names and the surname between slashes
+    :param name: NAME value or None
+    :return: given, surname, None for a missing part
+    """
+    if name is None:
+        return None, None
+    given, slash, rest = name.partition("/")
+    surname = rest.partition("/")[0].strip() if slash else ""
+    return given.strip() or None, surname or None
+
+
+def export_day(day):
+    """
+    Function to convert a day ordinal to the exported date
+    :param day: ordinal, NO_DATE when missing
+    :return: days since 1970-01-01, None when missing
+    """
+    return day - EPOCH_ORDINAL if day != NO_DATE else None
+
+
+def little_endian(values):
+    """
+    Function to get the bytes of a typed array in little endian order
+    :param values: array.array
+    :return: bytes
+    """
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode, data):
+    """
+    Function to read a typed array written by little_endian
+    :param typecode: array typecode
+    :param data: bytes
+    :return: array.array
+    """
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_strings(values):
+    """
+    Function to encode strings as int64 end offsets and their concatenated UTF-8 bytes, None as an empty string
+    :param values: list of str or None
+    :return: offsets bytes, data bytes
+    """
+    encoded = [value.encode() if value is not None else b"" for value in values]
+    return little_endian(array.array("q", itertools.accumulate(len(value) for value in encoded))), b"".join(encoded)
+
+
+def decode_strings(offsets, data):
+    """
+    Function to decode strings encoded by encode_strings
+    :param offsets: offsets bytes
+    :param data: data bytes
+    :return: list of str
+    """
+    ends = from_little_endian("q", offsets)
+    return [data[start:end].decode() for start, end in zip(itertools.chain([0], ends), ends)]
+
+
+def encode_column(kind, values):
+    """
+    Function to encode the values of one column of a row group
+    Every column starts with one validity byte per row, 0 for None, followed by the values: offsets and UTF-8 bytes
+    for str, int32 for date and int, int8 for bool, int64 item end offsets followed by a str column without validity
+    for list, numbers are little endian
+    :param kind: column type
+    :param values: list of values
+    :return: list of bytes buffers
+    """
+    buffers = [bytes(value is not None for value in values)]
+    if kind == "str":
+        buffers.extend(encode_strings(values))
+    elif kind == "date" or kind == "int":
+        buffers.append(little_endian(array.array("i", (value if value is not None else 0 for value in values))))
+    elif kind == "bool":
+        buffers.append(little_endian(array.array("b", (value is True for value in values))))
+    else:
+        buffers.append(little_endian(array.array("q", itertools.accumulate(len(value or ()) for value in values))))
+        buffers.extend(encode_strings([item for value in values for item in value or ()]))
+    return buffers
+
+
+def decode_column(kind, buffers):
+    """
+    Function to decode a column encoded by encode_column
+    :param kind: column type
+    :param buffers: list of bytes buffers
+    :return: list of values, None where the validity byte is 0
+    """
+    valid = buffers[0]
+    if kind == "str":
+        values = decode_strings(buffers[1], buffers[2])
+    elif kind == "date" or kind == "int":
+        values = from_little_endian("i", buffers[1]).tolist()
+    elif kind == "bool":
+        values = [bool(value) for value in from_little_endian("b", buffers[1])]
+    else:
+        ends = from_little_endian("q", buffers[1])
+        items = decode_strings(buffers[2], buffers[3])
+        values = [items[start:end] for start, end in zip(itertools.chain([0], ends), ends)]
+    return [value if flag else None for flag, value in zip(valid, values)]
+
+
+class ColumnFileWriter:
+    """
+    Writer of the binary column format, the file starts with COLUMNS_MAGIC and holds one block per row group: the
+    length of a JSON descriptor as little endian uint64, the descriptor, with the rows and the name, type and buffer
+    sizes of each column, then the buffers of every column in order
+    """
+
+    def __init__(self, file, columns):
+        self.file = file  # binary file
+        self.columns = columns
+        file.write(COLUMNS_MAGIC)
+
+    def write_group(self, rows):
+        encoded = [encode_column(kind, [row[index] for row in rows]) for index, (name, kind) in enumerate(self.columns)]
+        descriptor = json.dumps({"rows": len(rows), "columns": [[name, kind, [len(buffer) for buffer in buffers]]
+                                                                for (name, kind), buffers in zip(self.columns, encoded)]})
+        self.file.write(struct.pack("<Q", len(descriptor)) + descriptor.encode())
+        for buffers in encoded:
+            for buffer in buffers:
+                self.file.write(buffer)
+
+
+class CsvFileWriter:
+    """
+    Writer of the CSV fallback, a header row then one row per record, dates are ISO dates, booleans true or false,
+    lists are joined with semicolons and None is an empty field
+    """
+
+    def __init__(self, file, columns):
+        self.writer = csv.writer(file)  # text file opened with newline=""
+        self.columns = columns
+        self.writer.writerow([name for name, kind in columns])
+
+    def write_group(self, rows):
+        kinds = [kind for name, kind in self.columns]
+        self.writer.writerows([self.cell(kind, value) for kind, value in zip(kinds, row)] for row in rows)
+
+    @staticmethod
+    def cell(kind, value):
+        if value is None:
+            return ""
+        if kind == "date":
+            return date.fromordinal(value + EPOCH_ORDINAL).isoformat()
+        if kind == "bool":
+            return "true" if value else "false"
+        if kind == "list":
+            return ";".join(value)
+        return value
+
+
+def read_column_file(path):
+    """
+    Function to read a file written by ColumnFileWriter one row group at a time
+    :param path: file name
+    :return: generator of dicts of column name to list of values
+    """
+    with open(path, "rb") as columns:
+        if columns.read(len(COLUMNS_MAGIC)) != COLUMNS_MAGIC:
+            raise ValueError("{} is not a column file".format(path))
+        while True:
+            size = columns.read(8)
+            if not size:
+                return
+            descriptor = json.loads(columns.read(struct.unpack("<Q", size)[0]))
+            yield {name: decode_column(kind, [columns.read(length) for length in lengths])
+                   for name, kind, lengths in descriptor["columns"]}
+
+
+class StreamingTable:
+    """
+    Table printer laid out like a default PrettyTable that writes each row as it comes instead of keeping them
+    Column widths are fixed before the first row is written, from the widths given or by measuring the header and
+    the first prefix rows, longer cells of later rows are cut to fit and end in "..."
+    """
+
+    def __init__(self, field_names, widths=None, prefix=TABLE_PREFIX_ROWS):
+        self.field_names = list(field_names)
+        self.widths = widths or {}
+        self.prefix = prefix
+
+    def write(self, rows, out=None):
+        """
+        Function to write the table
+        :param rows: iterable of lists of cells, in field_names order
+        :param out: file to write to, defaults to sys.stdout
+        :return: number of rows written
+        """
+        out = sys.stdout if out is None else out
+        rows = iter(rows)
+        head = [[str(cell) for cell in row] for row in itertools.islice(rows, self.prefix)]
+        widths = [max(len(name), self.widths.get(name) or max([len(row[index]) for row in head], default=0))
+                  for index, name in enumerate(self.field_names)]
+        border = "+" + "+".join("-" * (width + 2) for width in widths) + "+\n"
+        out.write(border + self.line(self.field_names, widths) + border)
+        written = 0
+        for row in itertools.chain(head, ([str(cell) for cell in row] for row in rows)):
+            out.write(self.line(row, widths))
+            written += 1
+        out.write(border)
+        return written
+
+    @staticmethod
+    def line(cells, widths):
+        """
+        Function to lay out one line of the table, cells are centered and cut to their column width
+        :param cells: strings in column order
+        :param widths: column widths
+        :return: line ending in a newline
+        """
+        laid_out = []
+        for cell, width in zip(cells, widths):
+            if len(cell) > width:
+                cell = cell[:width - 3] + "..." if width > 3 else cell[:width]
+            laid_out.append(" " + cell.center(width) + " ")
+        return "|" + "|".join(laid_out) + "|\n"
+
 
 class Gedcom:
 
@@ -20,14 +1876,51 @@ class Gedcom:
         self.file = file
         self.directory = pathlib.Path(__file__).parent
         self.output = ""
-        self.userdata = defaultdict(dict)
-        self.familydata = defaultdict(dict)
+        self.userdata = defaultdict(Individual)
+        self.familydata = defaultdict(Family)
         self.tempdata = ""
         self.curr_id = ""
-        self.samenameandbirthdate = []
         self.ptUsers = PrettyTable()
         self.ptFamily = PrettyTable()
         self.errorlog = defaultdict(int)
+        self.process_flow_dict = {"INDI": self.append2userdata, "FAM": self.append2familydata}
+        self.process_flow2_dict = {"NOTE": self.donothing, "HUSB": self.appendHusbWifedata,
+                                   "WIFE": self.appendHusbWifedata, "CHIL": self.appendChilddata,
+                                   "FAM": self.donothing, "INDI": self.donothing}
+        self.lines_read = 0
+        # (spouse, family, DIV date) of the FAM divorces that found no marriage of the family to end, a parse_chunk
+        # worker may not have seen the spouse's marriages
+        self.unmatched_divorces = []
+        self.lines_per_sec = 0.0
+        self.parse_seconds = 0.0
+        self.snapshot_loaded = False
+        self.today = date.today().toordinal()
+        self.columns = None
+        self.links = None  # TreeLinks of the columns, built by build_links
+        self.anomalies = defaultdict(list)  # errors of the checks by scope, ("INDI", id), ("FAM", id) or ("TREE", None)
+        self.scope = ("TREE", None)
+        self.rechecked = None
+        self.stopped_at = None  # family the checks stopped at for lack of a marriage date
+        self.rule_seconds = None  # set to a defaultdict(float) to add up the seconds spent in each user story
+        self.vectorized = False  # run the rules that have a mask with check_masks
+        self.rules = RULES  # Rules calc_data runs by default
+        self.tables = True  # build the individual and family tables, and the indexes they read
+        self.max_errors = None  # report_error stops the checks once this many errors have been reported
+        self.errors_reported = 0
+        self.check_workers = 1  # processes check_parallel runs the checks in
+        self.siblings = {}  # family ID to SiblingSweep, built by sort_siblings
+        self.kinship = None  # Kinship, built by build_kinship
+        self.duplicates = None  # DuplicateIndex, built by index_duplicates
+        self.sample = None  # TreeSample of a sampled run
+        self.estimates = None  # error rates of the whole tree estimated by sample_analyze
+        self.table_stream = False  # print the tables with StreamingTable instead of building PrettyTables
+        self.table_widths = {}  # column name to fixed width of the streamed tables, other columns are measured
+        self.table_limit = None  # rows of each streamed table to print, None for all of them
+        self.table_offset = 0  # rows of each streamed table to skip
+        self.sinks = [TextSink()]  # where report_error sends the anomalies, flushed before anything else is printed
+        self.code = None  # user story of the check being run, set with scope
+        self.store = None  # TreeStore of store_analyze, userdata and familydata read from it
+        self.store_batch = STORE_BATCH  # records store_analyze writes and checks at once
         if pretty.lower() == "y":
             self.bool_to_print = True
         elif pretty.lower() == "n":
@@ -35,17 +1928,442 @@ class Gedcom:
         else:
             print("Invalid input for pretty table argument")
 
-    def analyze(self):
+    def analyze(self, stream=False, tokenizer="text", workers=1, cache_dir=None, cache_size=SNAPSHOT_CACHE_SIZE,
+                vectorized=False, rules=None, max_errors=None, check_workers=1, sample=None, seed=0, store=None):
         """
         Function to check if file is valid
+        Files ending in .ged.gz, .ged.bz2 or .ged.xz are decompressed in a background thread while they are parsed
+        :param stream: if True lines are read lazily from the file (or stdin when file is "-") instead of readlines()
+        :param tokenizer: "text" to split decoded lines, "mmap" to tokenize the raw bytes of a memory mapped file
+        :param workers: number of processes to parse the file with, more than 1 splits it at level 0 records
+        :param cache_dir: directory of parsed tree snapshots, an unchanged file is loaded from there instead of parsed
+        :param cache_size: bytes the snapshots may take before the least recently used ones are deleted
+        :param vectorized: run the date rules as numpy masks over the whole tree, see check_masks
+        :param rules: user stories to check, such as ["US01", "US03"], None for all of them, the tables and the
+        indexes only they read are left out unless the tables are printed
+        :param max_errors: stop the checks once this many errors have been reported, including parse errors
+        :param check_workers: number of forked processes to run the checks in, see check_parallel, the checks run
+        serially with max_errors or where processes can not be forked
+        :param sample: check only this many random individuals and families, see sample_analyze
+        :param seed: seed of the random sample
+        :param store: SQLite database to check the tree out of core from, see store_analyze
         """
 
-        if self.file.endswith("ged"):
-            self.check_file(self.open_file())
+        self.vectorized = vectorized
+        self.rules = RULES if rules is None else select_rules(rules)
+        self.tables = rules is None or self.bool_to_print is True
+        self.max_errors = max_errors
+        self.check_workers = check_workers
+        if is_gedcom(self.file) or (stream and self.file == "-"):
+            if sample is not None:
+                if self.file == "-" or compression_of(self.file) is not None:
+                    return "Can only sample uncompressed gedcom files"
+                return self.sample_analyze(sample, seed)
+            if store is not None:
+                if self.file == "-":
+                    return "Can only store gedcom files, not stdin"
+                return self.store_analyze(store)
+            if cache_dir is not None and self.file != "-":
+                parsed = not self.cached_parse(cache_dir, cache_size, stream, tokenizer, workers)
+            else:
+                self.parse(stream, tokenizer, workers)
+                parsed = True
+            if parsed and (stream or tokenizer == "mmap" or workers > 1):
+                self.print_stream_stats(self.parse_seconds)
+            self.normalize_dates()
             error, errorlog = self.calc_data()
             return error, errorlog
         else:
-            return "Can only analyze gedcom files. Enter a file ending with .ged"
+            return "Can only analyze gedcom files. Enter a file ending with .ged, .ged.gz, .ged.bz2 or .ged.xz"
+
+    def parse(self, stream=False, tokenizer="text", workers=1):
+        """
+        Function to fill userdata and familydata from the file with the chosen reader
+        :param stream: read lines lazily instead of readlines()
+        :param tokenizer: "text" or "mmap"
+        :param workers: number of processes, more than 1 parses chunks in parallel
+        Compressed files are always streamed, by a single process since they can not be split
+        """
+        start = time.perf_counter()
+        compressed = compression_of(self.file) is not None
+        if workers > 1 and self.file != "-" and not compressed:
+            self.parallel_file(workers)
+        elif tokenizer == "mmap":
+            if compressed:
+                self.decompress_file()
+            else:
+                self.mmap_file()
+        elif stream or compressed:
+            self.check_file(self.stream_file())
+        else:
+            self.check_file(self.open_file())
+        self.parse_seconds = time.perf_counter() - start
+
+    def sample_analyze(self, size=SAMPLE_SIZE, seed=0):
+        """
+        Function to check a reproducible random sample of the tree and estimate the error rates of the whole tree
+        Only the sampled records and the records their checks read are parsed, see TreeSample, so the run takes
+        seconds on files a full run takes minutes on. US23 and US24 compare a record with the whole tree and are left
+        out, a family without a marriage date is counted instead of stopping the checks
+        :param size: number of individuals and of families to sample
+        :param seed: seed of the random sample
+        :return: error, errorlog of the sampled records, the estimates are stored in self.estimates
+        """
+        start = time.perf_counter()
+        try:
+            ged = open(self.file, 'rb')
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        with ged:
+            empty = ged.seek(0, 2) == 0  # empty files can not be mapped
+            with contextlib.nullcontext(b"") if empty else mmap.mmap(ged.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.sample = TreeSample(mm, size, seed)
+                lines_read = 0
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    for begin, end in self.sample.spans:
+                        self.check_bytes(mmap_blocks(mm, begin, end))
+                        lines_read += self.lines_read
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+        self.lines_read = lines_read
+        self.parse_seconds = time.perf_counter() - start
+        self.normalize_dates()
+
+        rules = [check for check in self.rules if "duplicates" not in check.needs]
+        families = sorted(self.sample.families)
+        bool_to_print, self.bool_to_print, self.tables = self.bool_to_print, False, False
+        try:
+            error, errorlog = self.calc_data(self.sample.people, families, rules)
+            stops = []
+            while self.stopped_at is not None:  # a full run stops here, check the rest of the sample
+                stops.append(self.stopped_at)
+                self.calc_data((), [key for key in families if key > stops[-1]], rules)
+        finally:
+            self.bool_to_print = bool_to_print
+        self.estimates = sample_estimates(self.anomalies, self.sample, stops)
+        return error, errorlog
+
+    def store_analyze(self, database):
+        """
+        Function to check the tree out of core from a TreeStore, so memory does not grow with the size of the tree
+        The file is loaded into the database a batch of records at a time, unless the database already holds it, so
+        later runs skip the parse. The checks then hold a window of store_batch records, and the records they read, at
+        a time. US22 and the rules that have a query, US23, US24 and US18, run as indexed queries over the whole
+        store that flag the records their check runs on, see Rule. The other rules run on every window, those reading
+        indexes of the whole tree, US17, US19 and US20, and the tables are left out. Errors are grouped by rule
+        :param database: SQLite file, created if missing
+        :return: error, errorlog
+        """
+        try:
+            key = snapshot_key(self.file)
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        self.store = TreeStore(database, self.store_batch)
+        loaded = not self.store.holds(key)
+        if loaded:
+            self.load_store(key)
+        else:
+            sys.stdout.write(self.store.meta("output"))
+            self.lines_read = int(self.store.meta("lines_read"))
+        for kind, repeated in self.store.repeated_ids():  # US22, checked while parsing when in memory
+            if kind == "INDI":
+                print("ERROR: US22 INDIVIDUAL {} has a repetitive ID".format(repeated))
+            else:
+                print("ERROR: US 08 FAMILY {} has a repetitive ID".format(repeated))
+            self.errorlog["RepetitiveID"] += 1
+        if loaded:
+            self.print_stream_stats(self.parse_seconds)
+        self.today = date.today().toordinal()
+        if self.store.invalid_dates():  # same as normalize_dates
+            print("Invalid date found")
+            sys.exit()
+
+        bool_to_print, self.bool_to_print, self.tables = self.bool_to_print, False, False
+        try:
+            return self.check_store()
+        finally:
+            self.bool_to_print = bool_to_print
+
+    def load_store(self, key):
+        """
+        Function to parse the file into the store, writing the records in memory every store_batch records
+        A record of an earlier batch that a family date changes is read back and written again
+        :param key: snapshot_key of the file
+        """
+        start = time.perf_counter()
+        self.store.reset()
+        self.userdata = StoredRecords(self.store, "INDI")
+        self.familydata = StoredRecords(self.store, "FAM")
+        self.process_flow_dict = {"INDI": self.store_record, "FAM": self.store_record}
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                self.check_file(self.stream_file())
+                self.flush_store()
+        finally:
+            self.process_flow_dict = {"INDI": self.append2userdata, "FAM": self.append2familydata}
+            sys.stdout.write(output.getvalue())
+        self.store.finish(key, output.getvalue(), self.lines_read)
+        self.parse_seconds = time.perf_counter() - start
+
+    def store_record(self, split_words):
+        """
+        Function to start an INDI or FAM record while loading the store, repeated IDs are found by a query later
+        """
+        kind, key = split_words[2], split_words[1]
+        self.store.headers.append((kind, key))
+        if len(self.userdata) + len(self.familydata) >= self.store.batch:
+            self.flush_store()
+        if kind == "INDI":
+            self.userdata[key] = Individual()
+        else:
+            family = self.familydata[key] = Family()
+            family.chil = []
+        self.curr_id = key
+
+    def flush_store(self):
+        """
+        Function to write the records in memory to the store and drop them
+        """
+        self.store.write(self.userdata, self.familydata)
+        self.userdata.clear()
+        self.familydata.clear()
+
+    def check_store(self):
+        """
+        Function to run the checks on the tree in the store, a window of records at a time
+        :return: error, errorlog
+        """
+        store = self.store
+        queried = [check for check in self.rules if check.query is not None]
+        rules = [check for check in self.rules if check.query is None and set(check.needs) <= set(STORE_INDEXES)]
+        if self.rule_seconds is not None:
+            rules = [timed_rule(check, self.rule_seconds) for check in rules]
+        individual_rules = [check for check in rules if check.scope == "individual"]
+        plan = rule_plan(rules)
+        needs = set().union(*(check.needs for check in rules))
+        ages = any("ages" in check.needs for check in rules + queried)
+        self.userdata = StoredRecords(store, "INDI", self.derive_age if ages else None)
+        self.familydata = StoredRecords(store, "FAM")
+        self.duplicates = StoredDuplicates(store)
+        self.stopped_at = None
+        self.errors_reported = sum(self.errorlog.values())
+        error = None
+        try:
+            if self.max_errors is not None and self.errors_reported >= self.max_errors:
+                raise ErrorLimitReached("Stopped after {} errors".format(self.errors_reported))
+            if individual_rules:
+                for window in store.scan("INDI"):
+                    self.userdata.hold(window)
+                    self.check_individuals([key for key, record in window], individual_rules)
+            self.check_queries([check for check in queried if check.scope == "individual"])
+            if plan:
+                for window in store.scan("FAM"):
+                    self.hold_families(window, needs)
+                    error = self.check_families([key for key, record in window], plan)
+                    if error is not None:
+                        break
+            self.check_queries([check for check in queried if check.scope != "individual"])
+        except ErrorLimitReached as stop:
+            error = str(stop)
+        finally:
+            self.flush_anomalies()
+        self.scope = ("TREE", None)
+        self.code = None
+        if error is None:
+            error = "No errors found"
+        return error, self.errorlog
+
+    def check_queries(self, rules):
+        """
+        Function to run the check of rules that have a query only on the records the query flags
+        Families after the one the checks stopped at are not checked, like in a full run
+        :param rules: Rules that have a query
+        """
+        for check in rules:
+            start = time.perf_counter()
+            self.code = check.code
+            for keys in self.store.flagged(check.query):
+                if check.scope == "individual":
+                    self.userdata.hold(self.store.records("INDI", keys))
+                    self.check_individuals(keys, [check])
+                    continue
+                if self.stopped_at is not None:
+                    keys = [key for key in keys if key < self.stopped_at]
+                self.hold_families(self.store.records("FAM", keys), check.needs)
+                self.check_families(keys, [check])
+            if self.rule_seconds is not None:
+                self.rule_seconds[check.code] += time.perf_counter() - start
+
+    def hold_families(self, window, needs):
+        """
+        Function to hold a window of families, their spouses and children in memory and index them
+        :param window: iterable of (ID, Family) read from the store
+        :param needs: names of the INDEXES the rules read, "siblings" and "kinship" are built over the window
+        """
+        self.familydata.hold(window)
+        self.userdata.hold(())
+        self.userdata.load(key for family in self.familydata.values()
+                           for key in itertools.chain((family.husb, family.wife), family.chil or ()))
+        if "siblings" in needs:
+            self.sort_siblings()
+        if "kinship" in needs:  # ancestry of the spouses only, enough for are_siblings
+            self.build_kinship()
+
+    def cached_parse(self, cache_dir, cache_size, stream=False, tokenizer="text", workers=1):
+        """
+        Function to load the parsed tree from a snapshot of the same file, or parse it and write a snapshot
+        Errors printed while parsing are stored in the snapshot and printed again when it is loaded
+        :param cache_dir: snapshot directory
+        :param cache_size: bytes the snapshots may take
+        :return: True if a snapshot was loaded
+        """
+        try:
+            path = pathlib.Path(cache_dir) / (snapshot_key(self.file) + ".snap")
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        if self.load_snapshot(path):
+            return True
+
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                self.parse(stream, tokenizer, workers)
+        finally:
+            sys.stdout.write(output.getvalue())
+        self.save_snapshot(path, output.getvalue())
+        evict_snapshots(cache_dir, cache_size)
+        return False
+
+    def save_snapshot(self, path, output):
+        """
+        Function to write the parsed tree to a binary snapshot, written to a temporary file first
+        :param path: snapshot file
+        :param output: text printed while parsing
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        state = {"userdata": self.userdata, "familydata": self.familydata, "errorlog": self.errorlog,
+                 "output": output, "tempdata": self.tempdata, "curr_id": self.curr_id, "lines_read": self.lines_read}
+        with open(temp, 'wb') as snap:
+            snap.write(SNAPSHOT_MAGIC)
+            pickle.dump(state, snap, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+    def load_snapshot(self, path):
+        """
+        Function to load a snapshot written by save_snapshot, broken or outdated snapshots are deleted
+        :param path: snapshot file
+        :return: True if the snapshot was loaded
+        """
+        gc_enabled = gc.isenabled()
+        gc.disable()  # unpickling allocates one record per individual, collecting midway is wasted time
+        try:
+            with open(path, 'rb') as snap:
+                if snap.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    raise ValueError("snapshot version does not match")
+                state = pickle.load(snap)
+        except FileNotFoundError:
+            return False
+        except Exception:  # anything unreadable is treated as a cache miss
+            path.unlink(missing_ok=True)
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        os.utime(path)  # mark as recently used for evict_snapshots
+        self.userdata = state["userdata"]
+        self.familydata = state["familydata"]
+        self.errorlog = state["errorlog"]
+        self.tempdata = state["tempdata"]
+        self.curr_id = state["curr_id"]
+        self.lines_read = state["lines_read"]
+        self.snapshot_loaded = True
+        sys.stdout.write(state["output"])
+        return True
+
+    def revalidate(self, file=None, tokenizer="text"):
+        """
+        Function to check an edited version of the analyzed file again, running only the checks the edit can reach
+        The file is parsed again and diffed record by record against the previous parse, the individuals near an
+        edited record, the families within RECHECK_FAMILY_LINKS links of one and the families of its descendants are
+        checked, and their errors replace their old ones in the report, the errors of every other record are kept
+        :param file: edited file, defaults to the analyzed one
+        :param tokenizer: "text" or "mmap"
+        :return: error, errorlog of the merged report
+        """
+        if self.max_errors is not None:
+            raise ValueError("A run stopped after max_errors can not be revalidated")
+        old_users, old_families, old_anomalies, old_today = self.userdata, self.familydata, self.anomalies, self.today
+        self.file = file or self.file
+        self.userdata = defaultdict(Individual)
+        self.familydata = defaultdict(Family)
+        self.errorlog = defaultdict(int)
+        self.anomalies = defaultdict(list)
+        self.ptUsers = PrettyTable()
+        self.ptFamily = PrettyTable()
+        self.columns = self.links = None
+        self.parse(tokenizer=tokenizer)
+        self.normalize_dates()
+        if self.today != old_today:  # every date check depends on the day, nothing can be kept
+            self.rechecked = (set(self.userdata), set(self.familydata))
+            return self.calc_data()
+
+        changed_people = changed_records(old_users, self.userdata)
+        changed_families = changed_records(old_families, self.familydata)
+        trees = [(old_users, old_families) + relative_index(old_users, old_families),
+                 (self.userdata, self.familydata) + relative_index(self.userdata, self.familydata)]
+        near_people, near_families = nearby_records(trees, changed_people, changed_families, RECHECK_FAMILY_LINKS)
+        people = {key for key, distance in near_people.items() if distance <= RECHECK_INDIVIDUAL_LINKS}
+        families = set(near_families) | descendant_families(trees, changed_people, changed_families)
+        # US23 and US24 compare a record with every other one, recheck all that share a duplicate key with one
+        keys = {person_key(tree.get(key)) for tree in (old_users, self.userdata) for key in people} - {None}
+        people.update(key for key, record in self.userdata.items() if person_key(record) in keys)
+        keys = {family_key(tree.get(fam_id), users) for users, tree in ((old_users, old_families),
+                                                                        (self.userdata, self.familydata))
+                for fam_id in families} - {None}
+        families.update(fam_id for fam_id, family in self.familydata.items()
+                        if family_key(family, self.userdata) in keys)
+        old_stop = self.stopped_at
+        if old_stop is not None:
+            if old_stop in families:  # the families after it were never checked
+                families.update(key for key in self.familydata if key > old_stop)
+            else:  # it still stops the checks, the families after it are not checked
+                families = {key for key in families if key < old_stop}
+        self.rechecked = ({key for key in people if key in self.userdata},
+                          {key for key in families if key in self.familydata})
+
+        for scope, errors in old_anomalies.items():
+            kind, key = scope
+            if kind == "TREE" or (kind == "INDI" and key not in people) or (kind == "FAM" and key not in families):
+                self.anomalies[scope] = errors
+                for category, message in errors:
+                    if category is not None:
+                        self.errorlog[category] += 1
+
+        bool_to_print = self.bool_to_print
+        self.bool_to_print = False  # the tables and lists need the whole tree
+        try:
+            error, errorlog = self.calc_data(people, families)
+        finally:
+            self.bool_to_print = bool_to_print
+        if self.stopped_at is None and old_stop is not None and old_stop not in families:
+            self.stopped_at = old_stop
+            error = "No Marriage date found"
+        if self.stopped_at is not None:  # a full run would not have reached the families after it
+            for scope in [scope for scope in self.anomalies if scope[0] == "FAM" and scope[1] > self.stopped_at]:
+                for category, message in self.anomalies.pop(scope):
+                    if category is not None:
+                        errorlog[category] -= 1
+                        if errorlog[category] == 0:
+                            del errorlog[category]
+        return error, errorlog
 
     def open_file(self):
         """
@@ -60,6 +2378,345 @@ class Gedcom:
             sys.exit()
         return lines
 
+    def stream_file(self):
+        """
+        Function to lazily read the file one line at a time so the whole text is never held in memory
+        :return: generator of lines, read from stdin when file is "-"
+        """
+        self.lines_read = 0
+        if self.file == "-":
+            for line in sys.stdin:
+                self.lines_read += 1
+                yield line
+            return
+        if compression_of(self.file) is not None:
+            for block in self.compressed_blocks():
+                lines = block.decode().split("\n")
+                if lines[-1] == "":  # blocks end with a newline
+                    lines.pop()
+                for line in lines:
+                    self.lines_read += 1
+                    yield line
+            return
+        try:
+            ged = open(self.file, 'r')
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        with ged:
+            for line in ged:
+                self.lines_read += 1
+                yield line
+
+    def compressed_blocks(self):
+        """
+        Function to open the compressed file and decompress it in a background thread
+        :return: generator of decompressed bytes blocks that end on a line boundary
+        """
+        try:
+            source = DECOMPRESSORS[compression_of(self.file)](self.file, 'rb')
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        return decompressed_blocks(source)
+
+    def decompress_file(self):
+        """
+        Function to tokenize a compressed file with check_bytes while a background thread decompresses it
+        :return: output as string, same rules as check_file
+        """
+        blocks = self.compressed_blocks()
+        gc_enabled = gc.isenabled()
+        gc.disable()  # same as mmap_file, the parse only allocates acyclic records
+        try:
+            return self.check_bytes(blocks)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def mmap_file(self, start=0, end=None):
+        """
+        Function to tokenize the file straight from a memory map without decoding whole lines
+        Level, tag and xref boundaries are found on the raw bytes and only the values that get stored are decoded
+        :param start: byte offset to start parsing at, must be the start of a line
+        :param end: byte offset to stop parsing at, defaults to the end of the file
+        :return: output as string, same rules as check_file
+        """
+        try:
+            ged = open(self.file, 'rb')
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+        with ged:
+            if ged.seek(0, 2) == 0:  # empty files can not be mapped
+                self.lines_read = 0
+                return self.output
+            gc_enabled = gc.isenabled()
+            gc.disable()  # the parse only allocates acyclic dicts and lists, collecting them midway is wasted time
+            try:
+                with mmap.mmap(ged.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self.check_bytes(mmap_blocks(mm, start, end))
+            finally:
+                if gc_enabled:
+                    gc.enable()
+
+    def check_bytes(self, blocks):
+        """
+        Function to parse raw byte blocks, does the same work as check_file and parse_file in a single loop
+        The current record is kept in a local so most lines cost one split, one lookup and one decode
+        :param blocks: iterable of bytes blocks that end on a line boundary
+        :return: output as string
+        """
+        userdata = self.userdata
+        familydata = self.familydata
+        tags1, tags2 = BYTE_TAGS["1"], BYTE_TAGS["2"]
+        individual_fields = {tag.encode(): Individual.KEYS[tag] for tag in VALID_VALUES["1"] if tag in Individual.KEYS}
+        decoded = {}  # tags outside VALID_VALUES only need decoding once
+        shared = {}  # xrefs and dates repeat across records, decode them once and share the string
+        record = None  # the current Individual or Family
+        is_family = False
+        tempdata = self.tempdata
+        self.lines_read = 0
+        for block in blocks:
+            # strip trailing whitespace of every line once per block so values can be decoded as they are
+            if b" \n" in block or b"\r" in block or b"\t" in block or block.endswith(b" "):
+                block = TRAILING_SPACE.sub(b"", block)
+            lines = block.split(b"\n")
+            if lines[-1] == b"":  # blocks end with a newline
+                lines.pop()
+            for raw in lines:
+                words = raw.split(None, 2)
+                if len(words) == 3:
+                    level = words[0]
+                    if level == b"1":
+                        if not is_family:
+                            field = individual_fields.get(words[1])
+                            if field is not None:
+                                if field == "famc" or field == "fams":
+                                    value = shared.get(words[2]) or shared.setdefault(words[2], words[2].decode())
+                                else:
+                                    value = words[2].decode()
+                                setattr(record, field, value)
+                                continue
+                        tag = tags1.get(words[1])
+                        if tag is None:  # invalid tags with a value are ignored
+                            continue
+                        if not is_family:
+                            record[tag] = words[2].decode()
+                        elif tag == "CHIL":
+                            record.chil.append(shared.get(words[2]) or shared.setdefault(words[2], words[2].decode()))
+                        elif tag == "HUSB" or tag == "WIFE":
+                            record[tag] = shared.get(words[2]) or shared.setdefault(words[2], words[2].decode())
+                        else:
+                            userdata[self.curr_id][tag] = words[2].decode()
+                        continue
+                    elif level == b"2":
+                        if words[1] in tags2:
+                            field = DATE_FIELDS.get(tempdata)
+                            if is_family or field is None:
+                                self.tempdata = tempdata
+                                self.appendDates(["2", "DATE", words[2].decode()])
+                            else:
+                                value = words[2].decode()
+                                if field == "marriage":
+                                    record.add_marriage(value, record.fams)
+                                elif field == "divorce":
+                                    record.end_marriage(value)
+                                setattr(record, field, value)
+                        continue
+                    elif level == b"0":
+                        kind = BYTE_RECORDS.get(words[2])
+                        if kind is not None:
+                            xref = shared.get(words[1]) or shared.setdefault(words[1], words[1].decode())
+                            self.process_flow_dict[kind](["0", xref, kind])
+                            is_family = kind == "FAM"
+                            record = familydata[self.curr_id] if is_family else userdata[self.curr_id]
+                        continue
+                elif len(words) == 2:
+                    level = words[0]
+                    if level == b"1" or level == b"2":
+                        tag = (tags1 if level == b"1" else tags2).get(words[1])
+                        if tag is None:
+                            tag = decoded.get(words[1]) or decoded.setdefault(words[1], words[1].decode())
+                        tempdata = tag
+                        continue
+                elif not words:  # if last line is reached, return output
+                    self.tempdata = tempdata
+                    self.lines_read += lines.index(raw)
+                    return self.output
+                elif words[0] == b"1" or words[0] == b"2":
+                    continue
+                self.tempdata = tempdata
+                if words[0] == b"0":  # level 0 lines need a value, as in parse_file
+                    self.lines_read += lines.index(raw) + 1
+                    raise IndexError("list index out of range")
+                self.lines_read += lines.index(raw)
+                return "Invalid line on {}".format(raw.strip().decode())
+            self.lines_read += len(lines)
+        self.tempdata = tempdata
+
+    def parallel_file(self, workers):
+        """
+        Function to parse the file in a process pool, one byte range of whole level 0 records per task
+        Chunks are merged in file order so the result matches a serial parse, repetitive IDs (US22, US08)
+        that are split over two chunks are found while merging
+        :param workers: number of worker processes
+        :return: output as string, same rules as check_file
+        """
+        try:
+            with open(self.file, 'rb') as ged:
+                if ged.seek(0, 2) == 0:
+                    self.lines_read = 0
+                    return self.output
+                with mmap.mmap(ged.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    offsets = record_offsets(mm, workers * PARALLEL_CHUNKS_PER_WORKER)
+        except FileNotFoundError:
+            print("{} Not found in {}".format(self.file, self.directory))
+            sys.exit()
+
+        self.lines_read = 0
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            chunks = pool.map(parse_chunk, [self.file] * (len(offsets) - 1), offsets[:-1], offsets[1:])
+            for chunk in chunks:
+                result = self.merge_chunk(chunk)
+                if result is not None:  # a blank or invalid line ended the parse, later chunks are dropped
+                    pool.shutdown(cancel_futures=True)
+                    return result
+
+    def merge_chunk(self, chunk):
+        """
+        Function to merge the records parsed by one worker into userdata and familydata
+        :param chunk: dict returned by parse_chunk
+        :return: the chunk's parse result, not None if parsing stopped inside the chunk
+        """
+        repetitive = {"INDI": "ERROR: US22 INDIVIDUAL {} has a repetitive ID",
+                      "FAM": "ERROR: US 08 FAMILY {} has a repetitive ID"}
+        merged = {"INDI": self.userdata, "FAM": self.familydata}
+        for kind, record_id, seen_in_chunk in chunk["defined"]:
+            if not seen_in_chunk and record_id in merged[kind]:  # defined in an earlier chunk
+                print(repetitive[kind].format(record_id))
+                self.errorlog["RepetitiveID"] += 1
+        sys.stdout.write(chunk["output"])
+
+        for kind, data in (("INDI", chunk["userdata"]), ("FAM", chunk["familydata"])):
+            target = merged[kind]
+            shared = data.keys() & target.keys()
+            if shared:
+                defined = {record_id for record_kind, record_id, seen_in_chunk in chunk["defined"] if record_kind == kind}
+                for record_id in shared - defined:  # dates a family wrote onto an individual from another chunk
+                    target[record_id].update(data[record_id])
+                    if kind == "INDI" and data[record_id].marriages:
+                        target[record_id].marriages = (target[record_id].marriages or []) + data[record_id].marriages
+                    data[record_id] = target[record_id]
+            target.update(data)
+        for spouse, family, divorce in chunk["divorces"]:  # the marriage may have been parsed in an earlier chunk
+            if spouse in self.userdata:
+                self.userdata[spouse].end_marriage(divorce, family)
+        for error, count in chunk["errorlog"].items():
+            self.errorlog[error] += count
+        self.lines_read += chunk["lines_read"]
+        self.tempdata = chunk["tempdata"]
+        self.curr_id = chunk["curr_id"]
+        if chunk["exception"] is not None:
+            raise chunk["exception"]
+        return chunk["result"]
+
+    def normalize_dates(self):
+        """
+        Function to parse every date of every individual once, right after the file is parsed
+        The checks then compare the day ordinals instead of calling strptime again and again
+        """
+        self.today = date.today().toordinal()
+        for record in self.userdata.values():
+            for field, day_field in DAY_FIELDS:
+                text = getattr(record, field)
+                if text is not None:
+                    day = date_ordinal(text)
+                    if day == NO_DATE:
+                        print("Invalid date found")
+                        sys.exit()
+                    setattr(record, day_field, day)
+
+    def build_columns(self):
+        """
+        Function to build the columnar copy of the parsed tree, once, after the file has been parsed
+        :return: TreeColumns
+        """
+        if self.columns is None:
+            self.columns = TreeColumns(self.userdata, self.familydata)
+        return self.columns
+
+    def build_links(self):
+        """
+        Function to build the parent, child and spouse adjacency of the columnar tree, once
+        :return: TreeLinks
+        """
+        if self.links is None:
+            self.links = TreeLinks(self.build_columns())
+        return self.links
+
+    def traverse(self, key, direction, generations=None, order="bfs"):
+        """
+        Function to find the individuals reachable from one by following one kind of link again and again
+        :param key: ID of the individual to start from
+        :param direction: "parents", "children" or "spouses"
+        :param generations: number of links to follow at most, None for no limit
+        :param order: "bfs" for the nearest first, "dfs" for depth first
+        :return: list of (ID, generation) pairs, generation 1 for the individuals linked to key directly
+        """
+        if direction not in ("parents", "children", "spouses"):
+            raise ValueError("direction must be parents, children or spouses, not {}".format(direction))
+        if order not in ("bfs", "dfs"):
+            raise ValueError("order must be bfs or dfs, not {}".format(order))
+        columns = self.build_columns()
+        links = self.build_links()
+        if key not in columns.index:
+            raise KeyError(key)
+        offsets, targets = {"parents": (links.parent_offsets, links.parents),
+                            "children": (links.child_offsets, links.children),
+                            "spouses": (links.spouse_offsets, links.spouses)}[direction]
+        walk = links.breadth_first if order == "bfs" else links.depth_first
+        rows, levels = walk(offsets, targets, columns.index[key], generations)
+        ids = columns.ids
+        return [(ids[row], level) for row, level in zip(rows.tolist(), levels.tolist())]
+
+    def ancestors(self, key, generations=None, order="bfs"):
+        """
+        Function to find the ancestors of an individual
+        :param key: individual ID
+        :param generations: number of generations to go up, None for all
+        :param order: "bfs" or "dfs", see traverse
+        :return: list of (ID, generation) pairs, generation 1 for the parents
+        """
+        return self.traverse(key, "parents", generations, order)
+
+    def descendants(self, key, generations=None, order="bfs"):
+        """
+        Function to find the descendants of an individual
+        :param key: individual ID
+        :param generations: number of generations to go down, None for all
+        :param order: "bfs" or "dfs", see traverse
+        :return: list of (ID, generation) pairs, generation 1 for the children
+        """
+        return self.traverse(key, "children", generations, order)
+
+    def spouses(self, key):
+        """
+        Function to find the husbands and wives of an individual in every family
+        :param key: individual ID
+        :return: list of IDs
+        """
+        return [spouse for spouse, generation in self.traverse(key, "spouses", 1)]
+
+    def print_stream_stats(self, seconds):
+        """
+        Function to report the throughput of the streaming parse
+        :param seconds: time spent reading and parsing
+        """
+        self.lines_per_sec = self.lines_read / seconds if seconds > 0 else 0.0
+        print("Parsed {} lines in {:.2f} seconds ({:.0f} lines/sec)".format(self.lines_read, seconds,
+                                                                             self.lines_per_sec))
+
     def check_file(self, read_lines):
         """
         Function to read input file line by line and generate output
@@ -82,13 +2739,12 @@ class Gedcom:
 
         if len_split_words > 3:  # if there is a big name or date, append it to a single value in list
             split_words[2] += " " + " ".join(split_words[3:])
-        process_flow_dict = {"INDI": self.append2userdata, "FAM": self.append2familydata}
+        process_flow_dict = self.process_flow_dict
         if split_words[0] == "0":
             if split_words[2] in process_flow_dict:
                 process_flow_dict[split_words[2]](split_words)
                 return
-        process_flow2_dict = {"NOTE": self.donothing, "HUSB": self.appendHusbWifedata, "WIFE": self.appendHusbWifedata,
-                              "CHIL": self.appendChilddata, "FAM": self.donothing, "INDI": self.donothing}
+        process_flow2_dict = self.process_flow2_dict
 
         try:
             if split_words[1] not in VALID_VALUES[
@@ -116,7 +2772,7 @@ class Gedcom:
             print("ERROR: US22 INDIVIDUAL {} has a repetitive ID".format(split_words[1]))
             self.errorlog["RepetitiveID"] += 1
 
-        self.userdata[split_words[1]] = {}
+        self.userdata[split_words[1]] = Individual()
         self.curr_id = split_words[1]
 
     def append2familydata(self, split_words):
@@ -125,8 +2781,8 @@ class Gedcom:
             print("ERROR: US 08 FAMILY {} has a repetitive ID".format(split_words[1]))
             self.errorlog["RepetitiveID"] += 1
 
-        self.familydata[split_words[1]] = {}
-        self.familydata[split_words[1]]["CHIL"] = []
+        family = self.familydata[split_words[1]] = Family()
+        family.chil = []
         self.curr_id = split_words[1]
 
     def appendHusbWifedata(self, split_words):
@@ -138,463 +2794,1163 @@ class Gedcom:
     def appendDates(self, split_words):
 
         if self.curr_id in self.userdata:
-            if self.tempdata + split_words[1] == "MARRDATE":
-                if self.userdata[self.curr_id].__contains__("MARRDATE"):
-                    try:
-                        self.userdata[self.curr_id]["DIVDATE"]
-                    except KeyError:
-                        print("ERROR: US11 INDIVIDUAL {} HAS DONE BIGAMY".format(self.curr_id))
-                        self.errorlog["Bigamy"] += 1
-
-            self.userdata[self.curr_id][self.tempdata + split_words[1]] = split_words[2]
+            record = self.userdata[self.curr_id]
+            if split_words[1] == "DATE" and self.tempdata == "MARR":
+                record.add_marriage(split_words[2], record.fams)
+            elif split_words[1] == "DATE" and self.tempdata == "DIV":
+                record.end_marriage(split_words[2])
+            record[self.tempdata + split_words[1]] = split_words[2]
         elif split_words[1] == "DATE":
             husband = self.familydata[self.curr_id]["HUSB"]
             wife = self.familydata[self.curr_id]["WIFE"]
-            self.userdata[husband][self.tempdata + split_words[1]] = split_words[2]
-            self.userdata[wife][self.tempdata + split_words[1]] = split_words[2]
+            for spouse in (husband, wife):
+                record = self.userdata[spouse]
+                if self.tempdata == "MARR":
+                    record.add_marriage(split_words[2], self.curr_id)
+                elif self.tempdata == "DIV" and not record.end_marriage(split_words[2], self.curr_id):
+                    self.unmatched_divorces.append((spouse, self.curr_id, split_words[2]))
+                record[self.tempdata + split_words[1]] = split_words[2]
 
     def donothing(self, nothing):
         pass
 
-    def calc_data(self):
-
-
-
-        for key in self.userdata:
-            today = date.today()
-            try:
-                birthday = self.userdata[key]["BIRTDATE"]
-                born_date = datetime.datetime.strptime(birthday, '%d %b %Y')
-                if (born_date) > datetime.datetime.now():
-                    print("ERROR: US01 INDIVIDUAL () {} has Birthdate Date before Current date".format(key,
-                                                                                                       self.userdata[
-                                                                                                           key][
-                                                                                                           "NAME"]))
-                    self.errorlog["DateAfterCurrent"] += 1
-            except ValueError:
-                print("Invalid date found")
-                sys.exit()
-            except KeyError:
-                print(self.userdata[key])
-                print("Invalid data for {}".format(self.userdata[key]))
-                sys.exit()
-            try:
-                death_date = self.userdata[key]["DEATDATE"]
-                deathday = self.userdata[key]["DEATDATE"]
-                death_date = datetime.datetime.strptime(deathday, '%d %b %Y')
-                if (death_date) > datetime.datetime.now():
-                    print("ERROR: US21 INDIVIDUAL () {} has Death date Date after Current date".format(key,
-                                                                                                       self.userdata[
-                                                                                                           key][
-                                                                                                           "NAME"]))
-                    self.errorlog["DateAfterCurrent"] += 1
-                if (death_date) > born_date:
-                    print("ERROR: US03 INDIVIDUAL () {} has Death date Date before Birth date".format(key,
-                                                                                                      self.userdata[
-                                                                                                          key]["NAME"]))
-                    self.errorlog["DeathBeforeBirth"] += 1
-                alive_status = False
-            except KeyError:
-                alive_status = True
-            self.userdata[key]["ALIVE"] = alive_status
-            if alive_status is True:
-                age = today.year - born_date.year
-            else:
-                age = death_date.year - born_date.year
-            self.userdata[key]["AGE"] = age
-
-            try:  # Check if marriage before 14, also add something to test cases.  Xiaopeng Yuan
-                marriageday = self.userdata[key]["MARRDATE"]
-            except KeyError:
-                marriageday = "NA"
-
-            if (marriageday != "NA" and (int(marriageday.split()[2]) - int(birthday.split()[2])) < 14):
-                print("ERROR: US10 INDIVIDUAL {} {} has married before the age of 14".format(key, self.userdata[key][
-                    "NAME"]))
-                self.errorlog["MarriageBefore14"] += 1
-
-
-
-
-
-        error = self.prettyTablefunc()
+    def calc_data(self, individuals=None, families=None, rules=None):
+        """
+        Function to run the checks, on the whole tree or only on some records
+        :param individuals: IDs of the individuals to check, None for all of them
+        :param families: IDs of the families to check, None for all of them
+        :param rules: Rule objects to run, defaults to self.rules
+        :return: error, errorlog
+        """
+        rules = self.rules if rules is None else rules
+        if self.rule_seconds is not None:
+            rules = [timed_rule(check, self.rule_seconds) for check in rules]
+        masked = []
+        if self.vectorized:
+            masked = [check for check in rules if check.scope == "individual" and check.mask is not None]
+            rules = [check for check in rules if check not in masked]
+        # take the keys before building the indexes, linking relatives adds empty records for missing IDs
+        if individuals is None:
+            keys = sorted(self.userdata.keys())
+        else:
+            keys = sorted(key for key in individuals if key in self.userdata)
+        self.errors_reported = sum(self.errorlog.values())
+        try:
+            if self.max_errors is not None and self.errors_reported >= self.max_errors:
+                raise ErrorLimitReached("Stopped after {} errors".format(self.errors_reported))
+            self.build_indexes(rules + masked)
+            if masked:
+                self.check_masks(keys, masked)
+            error = self.prettyTablefunc(keys, families, rules)
+        except ErrorLimitReached as stop:
+            error = str(stop)
+        finally:
+            self.flush_anomalies()
+        self.scope = ("TREE", None)
+        self.code = None
         if error is None:
             error = "No errors found"
         return error, self.errorlog
 
-    def prettyTablefunc(self):
-
-        self.ptUsers.field_names = ["ID", "NAME", "GENDER", "BIRTH DATE", "AGE", "ALIVE", "DEATH", "CHILD", "SPOUSE"]
-
-        single_list = []
-        married_list = []
-        test_single = []
-        test_married = []
-        deceased_list = []
-        test_deceased = []
-
-        for key in sorted(self.userdata.keys()):
-
-            value = self.userdata[key]
-            name = value["NAME"]
-            gender = value["SEX"]
-            birthdate = value["BIRTDATE"]
-            age = value["AGE"]
-            alive = value["ALIVE"]
-
-
+    def build_indexes(self, rules):
+        """
+        Function to build the indexes the rules and the tables read, over the whole tree and in INDEXES order
+        :param rules: Rule objects that will run
+        """
+        needed = set(TABLE_INDEXES if self.tables else ()).union(*(check.needs for check in rules))
+        if self.vectorized and any(check.mask is not None for check in rules):
+            needed.add("columns")
+        for name, method in INDEXES.items():
+            if name in needed:
+                getattr(self, method)()
+
+    def check_masks(self, keys, rules):
+        """
+        Function to run individual rules as boolean masks over the columns of the whole tree at once
+        Only the individuals a mask flags become records in Python, the rule's check is run on them to report
+        the error, so errors are grouped by rule instead of by individual
+        :param keys: sorted IDs of the individuals to check
+        :param rules: individual Rules that have a mask
+        """
+        columns = self.columns
+        checked = set(keys) if len(keys) != len(columns) else None
+        for check in rules:
+            start = time.perf_counter()
+            self.code = check.code
+            flagged = columns.ids_where(check.mask(columns, self.today))
+            for key in sorted(flagged):
+                if checked is None or key in checked:
+                    self.scope = ("INDI", key)
+                    check.check(self, key, self.userdata[key])
+            if self.rule_seconds is not None:
+                self.rule_seconds[check.code] += time.perf_counter() - start
+
+    def report_error(self, message, category=None, records=(), dates=()):
+        """
+        Function to send an error found by the checks to the anomaly sinks and file it under the record being checked
+        :param message: error text
+        :param category: errorlog key to count it under, None for errors that are only printed
+        :param records: IDs of the records involved, defaults to the one being checked
+        :param dates: dates the error is about, as written in the file
+        """
+        kind, key = self.scope
+        anomaly = Anomaly(self.code, kind, key, list(records or ([key] if key is not None else [])),
+                          [day for day in dates if day is not None], category, message)
+        for sink in self.sinks:
+            sink.write(anomaly)
+        if category is not None:
+            self.errorlog[category] += 1
+        self.anomalies[self.scope].append((category, message))
+        self.errors_reported += 1
+        if self.max_errors is not None and self.errors_reported >= self.max_errors:
+            raise ErrorLimitReached("Stopped after {} errors".format(self.errors_reported))
+
+    def flush_anomalies(self):
+        """
+        Function to write out what the anomaly sinks keep, called before anything else is printed so the errors and
+        the other output stay in order
+        """
+        for sink in self.sinks:
+            sink.flush()
 
-            if name + birthdate in self.samenameandbirthdate:
-                print("ERROR: US23 INDIVIDUAL {} {} does not have a unique name and birth date".format(key, name))
-                self.errorlog["UniqueNameBirthDate"] += 1
-            else:
-                self.samenameandbirthdate.append(name + birthdate)
+    def display(self, *values):
+        """
+        Function for the list rules to print a list after the errors reported before it
+        :param values: print arguments
+        """
+        self.flush_anomalies()
+        print(*values)
 
-            try:
-                value["MARRDATE"]
-                married_list.append(value["NAME"])
-                test_married.append(value["NAME"])
+    def derive_ages(self):
+        """
+        Function to fill in alive and age of every individual
+        """
+        for record in self.userdata.values():
+            self.derive_age(record)
 
-            except KeyError:
-                single_list.append(value["NAME"])
-                test_single.append(value["NAME"])
+    def derive_age(self, record):
+        """
+        Function to fill in alive and age of one individual, exits if it has no birth date
+        :param record: Individual
+        """
+        if record.birth is None:
+            print(record)
+            print("Invalid data for {}".format(record))
+            sys.exit()
+        born_year = date.fromordinal(record.birth_day).year
+        if record.death is None:
+            record.alive = True
+            record.age = date.fromordinal(self.today).year - born_year
+        else:
+            record.alive = False
+            record.age = date.fromordinal(record.death_day).year - born_year
 
-            try:
-                death = value["DEATDATE"]
-                deceased_list.append(value["NAME"])
-                test_deceased.append(value["NAME"])
+    def sort_siblings(self):
+        """
+        Function to sort the children of every family by birth once, for the sibling rules
+        """
+        self.siblings = {key: SiblingSweep(self.userdata, family.chil or ()) for key, family in
+                         self.familydata.items()}
 
-            except KeyError:
-                death = "NA"
-            try:
-                fam_id = value["FAMS"]
-                if fam_id == {}:
-                    raise KeyError
-                child = self.familydata[fam_id]["CHIL"]
+    def build_kinship(self):
+        """
+        Function to index the ancestry of every individual once, for the consanguinity rules
+        """
+        self.kinship = Kinship(self.userdata, self.familydata)
 
+    def index_duplicates(self):
+        """
+        Function to hash every individual and family by what US23 and US24 require to be unique
+        """
+        self.duplicates = DuplicateIndex(self.userdata, self.familydata)
 
-                self.userdata[key]["CHILD"] = child
+    def link_relatives(self):
+        """
+        Function to fill in the child and spouse of every individual and the father and mother of their children
+        Individuals are linked in ID order, a later parent overwrites an earlier one
+        """
+        for key in sorted(self.userdata.keys()):
+            value = self.userdata[key]
+            gender = value.sex
+            fam_id = value.fams
+            child = self.familydata[fam_id].chil if fam_id is not None else None
+            if child is not None:
                 for c in child:
-
                     if gender == "M":
-                        self.userdata[c]["father"] = key
+                        self.userdata[c].father = key
                     if gender == "F":
-                        self.userdata[c]["mather"] = key
-
-
-
-
-            except KeyError:
+                        self.userdata[c].mother = key
+            else:
                 child = "NA"
-                self.userdata[key]["CHILD"] = child
+            value.child = child
 
-            try:
-                fam_id = value["FAMS"]
-                if fam_id == {}:
-                    raise KeyError
+            if fam_id is not None:
                 if gender == "M":
-                    spouse = self.familydata[fam_id]["WIFE"]
-                    self.userdata[key]["SPOUSE"] = spouse
+                    spouse = self.familydata[fam_id].wife
                 else:
-                    spouse = self.familydata[fam_id]["HUSB"]
-                    self.userdata[key]["SPOUSE"] = spouse
-            except KeyError:
-                spouse = "NA"
-
-            try:  # Check if marriage before 14, also add something to test cases.  Xiaopeng Yuan
-                marriage = value["MARRDATE"]
-            except KeyError:
-                marriage = "NA"
-            try:
-                if datetime.datetime.strptime(value["DIVDATE"], '%d %b %Y') > datetime.datetime.now():
-                    print("ERROR: 01 INDIVIDUAL () {} has Divorce date before Current date".format(key, name))
-                    self.errorlog["DateAfterCurrent"] += 1
-            except KeyError:
-                pass
+                    spouse = self.familydata[fam_id].husb
+                if spouse is not None:
+                    value.spouse = spouse
 
-            if marriage != "NA":
-                if datetime.datetime.strptime(marriage, '%d %b %Y') > datetime.datetime.now():
-                    print("ERROR: 01 INDIVIDUAL () {} has Marriage date Date before Current date".format(key, name))
-                    self.errorlog["DateAfterCurrent"] += 1
-
-            if death != "NA" and datetime.datetime.strptime(marriage, '%d %b %Y') > datetime.datetime.strptime(death,
-                                                                                                               '%d %b %Y'):
-                print("ERROR: US05 INDIVIDUAL {} {} have Marriage at {} which is after their death on {}".format(key,
-                                                                                                                 name,
-                                                                                                                 datetime.datetime.strptime(
-                                                                                                                     marriage,
-                                                                                                                     '%d %b %Y'),
-                                                                                                                 datetime.datetime.strptime(
-                                                                                                                     death,
-                                                                                                                     '%d %b %Y')))
-                self.errorlog["MarriageBeforeDeath"] += 1
-
-            if (death == "NA" and age > 150):
-                print("ERROR: US07 INDIVIDUAL {} {} has an age of {} which is over 150".format(key, name, age))
-                self.errorlog["AgeLessOneFifty"] += 1
-
-            if (marriage != "NA"):
-                if (datetime.datetime.strptime(birthdate, '%d %b %Y') > datetime.datetime.strptime(marriage,
-                                                                                                   '%d %b %Y')):
-                    print(
-                        "ERROR: US02 INDIVIDUAL {} {} has Marriage Before Birth".format(key, name))
-                    self.errorlog["MarriageBeforeBirth"] += 1
-
-            self.ptUsers.add_row([key, name, gender, birthdate, age, alive, death, child, spouse])
-
-        if self.bool_to_print:
-            print(self.ptUsers)
-
-
-
-
-            print("DISPLAY US31 LIST OF SINGLES: {}".format(single_list))
-
-            test_single.pop(2)
-            test_married.pop(5)
-            test_deceased.pop(2)
-
-            print("DISPLAY US29 LIST OF deceased PEOPLE: {}".format(deceased_list))
-
-            for k in deceased_list:
-                if k not in test_deceased:
-                    print("ERROR: US29 INDIVIDUAL {} {} not in the list of deceased".format(key, self.userdata[key][
-                        "NAME"]))
-                    self.errorlog["DeceasedList"] += 1
-
-            for i in single_list:
-                if i not in test_single:
-                    print("ERROR: US30 INDIVIDUAL {} {} not in the list of single".format(key, self.userdata[key]["NAME"]))
-                    self.errorlog["SingleList"] += 1
-
-            print("DISPLAY US30 LIST OF MARRIED PEOPLE: {}".format(married_list))
-
-            for i in married_list:
-                if i not in test_married:
-                    print("ERROR: US31 INDIVIDUAL {} {} not in the list of married people".format(key, self.userdata[key]["NAME"]))
-                    self.errorlog["MarriedList"] += 1
-
-        self.ptFamily.field_names = ["ID", "MARRIAGE DATE", "DIVORCE DATE", "HUSBAND ID", "HUSBAND NAME", "WIFE ID",
-                                     "WIFE NAME", "CHILDREN"]
-
-        multiple_births = []
-        test_multiple=[]
-        age_list = []
-        test_order=[]
-
-
-        for key in sorted(self.familydata.keys()):
+    def prettyTablefunc(self, keys, families, rules):
+        """
+        Function to run the rules in one pass over the individuals and one over the families, building the tables
+        :param keys: sorted IDs of the individuals to check
+        :param families: IDs of the families to check, None for all of them
+        :param rules: Rule objects to run
+        :return: error string if a rule stopped the checks, else None
+        """
 
-            uniquenameslist = []
+        self.ptUsers.field_names = USER_COLUMNS
+        individual_rules = [check for check in rules if check.scope == "individual"]
+        self.ptFamily.field_names = FAMILY_COLUMNS
+        if families is None:
+            family_keys = sorted(self.familydata.keys())
+        else:
+            family_keys = sorted(key for key in families if key in self.familydata)
+        plan = rule_plan(rules)
+        parallel = self.check_workers > 1 and self.max_errors is None and \
+            "fork" in multiprocessing.get_all_start_methods()
+
+        if individual_rules or self.tables:
+            if parallel:
+                self.check_parallel("INDI", keys, individual_rules, plan)
+            else:
+                self.check_individuals(keys, individual_rules)
 
+        if self.bool_to_print:
+            self.scope = ("TREE", None)
+            self.print_table("INDI", keys)
+            for check in rules:
+                if check.scope == "individual_list":
+                    self.code = check.code
+                    check.check(self, keys)
+
+        self.stopped_at = None
+        if plan or self.tables:
+            if parallel:
+                error = self.check_parallel("FAM", family_keys, individual_rules, plan)
+            else:
+                error = self.check_families(family_keys, plan)
+            if error is not None:
+                return error
 
-            value = self.familydata[key]
+        if self.bool_to_print is True:
+            self.scope = ("TREE", None)
+            self.print_table("FAM", family_keys)
+            for check in rules:
+                if check.scope == "family_list":
+                    self.code = check.code
+                    check.check(self, family_keys)
+
+    def check_individuals(self, keys, individual_rules):
+        """
+        Function to run the individual rules on some individuals, adding their rows to the individual table
+        :param keys: sorted IDs of the individuals
+        :param individual_rules: individual Rules
+        """
+        for key in keys:
+            self.scope = ("INDI", key)
+            value = self.userdata[key]
+            for check in individual_rules:
+                self.code = check.code
+                check.check(self, key, value)
 
-            husband_id = value["HUSB"]
-            wife_id = value["WIFE"]
-            children = value["CHIL"]
+            if self.tables and not self.table_stream:
+                self.ptUsers.add_row(self.user_row(key, value))
 
+    def check_families(self, family_keys, plan):
+        """
+        Function to run the family and child rules on some families, adding their rows to the family table
+        :param family_keys: sorted IDs of the families
+        :param plan: list returned by rule_plan
+        :return: error string if a rule stopped the checks, else None
+        """
+        for key in family_keys:
+            self.scope = ("FAM", key)
+            family = FamilyScope(self, key)
+            for step in plan:
+                if isinstance(step, Rule):
+                    self.code = step.code
+                    error = step.check(self, family)
+                    if error is not None:
+                        self.stopped_at = key
+                        return error
+                    continue
+                for child in family.children:
+                    family.set_child(child)
+                    for check in step:
+                        self.code = check.code
+                        check.check(self, family)
+
+            if self.tables and not self.table_stream:
+                self.ptFamily.add_row(self.family_row(key, family))
+
+    def user_row(self, key, value):
+        """
+        Function to build the row of an individual in the individual table
+        :param key: ID of the individual
+        :param value: its Individual record
+        :return: list of cells in USER_COLUMNS order
+        """
+        death = value.death if value.death is not None else "NA"
+        spouse = value.spouse if value.spouse is not None else "NA"
+        return [key, value.name, value.sex, value.birth, value.age, value.alive, death, value.child, spouse]
 
-            for i in children:
-                age_list.append(self.userdata[i]["AGE"])
-                test_order.append(self.userdata[i]["AGE"])
-                if len(children)>=2:
-                    multiple_births.append(i)
-                    test_multiple.append(i)
+    def family_row(self, key, family):
+        """
+        Function to build the row of a family in the family table
+        :param key: ID of the family
+        :param family: its FamilyScope
+        :return: list of cells in FAMILY_COLUMNS order
+        """
+        child = family.children if family.children is not None else "NA"
+        return [key, family.husband.marriage, family.divorce, family.husband_id, family.husband.name, family.wife_id,
+                family.wife.name, child]
 
+    def export(self, directory, file_format="columns", row_group=EXPORT_ROW_GROUP):
+        """
+        Function to write the parsed and derived fields of the individuals and families to individuals and families
+        files in a directory, in row groups so only one group of rows is held at a time
+        Records that only exist because a family or a check named a missing ID are left out
+        :param directory: directory to write to, created if missing
+        :param file_format: "columns" for the binary column format of ColumnFileWriter, "csv" for CSV
+        :param row_group: rows per row group
+        :return: list of the files written
+        """
+        writer = ColumnFileWriter if file_format == "columns" else CsvFileWriter
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for name, columns, rows in (("individuals", INDIVIDUAL_EXPORT, self.export_individuals()),
+                                    ("families", FAMILY_EXPORT, self.export_families())):
+            path = os.path.join(directory, name + EXPORT_FORMATS[file_format])
+            with open(path, "wb") if file_format == "columns" else open(path, "w", newline="") as out:
+                table = writer(out, columns)
+                for group in iter(lambda: list(itertools.islice(rows, row_group)), []):
+                    table.write_group(group)
+            written.append(path)
+        return written
+
+    def export_individuals(self):
+        """
+        Function to build the exported row of every individual, in file order
+        :return: generator of tuples in INDIVIDUAL_EXPORT order
+        """
+        this_year = date.fromordinal(self.today).year
+        for key, record in self.userdata.items():
+            if key is None or not any(value is not None for value in record.parsed()):
+                continue
+            age, alive = record.age, record.alive
+            if age is None and record.birth is not None:  # the checks that derive ages did not run
+                alive = record.death is None
+                end_year = this_year if alive else date.fromordinal(record.death_day).year
+                age = end_year - date.fromordinal(record.birth_day).year
+            given, surname = name_parts(record.name)
+            yield (key, given, surname, record.sex, export_day(record.birth_day), export_day(record.death_day),
+                   export_day(record.marriage_day), export_day(record.divorce_day), age, alive, record.famc,
+                   record.fams)
+
+    def export_families(self):
+        """
+        Function to build the exported row of every family, in file order, marriage and divorce dates are those of
+        the family table
+        :return: generator of tuples in FAMILY_EXPORT order
+        """
+        for key, family in self.familydata.items():
+            if family.chil is None:  # every family read from the file has a children list
+                continue
+            husband, wife = self.userdata.get(family.husb), self.userdata.get(family.wife)
+            marriage = divorce = None
+            if husband is not None:
+                marriage = export_day(husband.marriage_day)
+                if wife is not None and husband.divorce is not None and wife.divorce is not None:
+                    divorce = export_day(husband.divorce_day)
+            yield key, family.husb, family.wife, marriage, divorce, family.chil
+
+    def print_table(self, kind, keys):
+        """
+        Function to print the individual or the family table
+        Without table_stream the PrettyTable built by the checks is printed, with it the rows are built from the
+        records while they are written by a StreamingTable, and only the table_limit rows from table_offset are
+        :param kind: "INDI" or "FAM"
+        :param keys: sorted IDs of the records in the table
+        """
+        self.flush_anomalies()
+        if not self.table_stream:
+            print(self.ptUsers if kind == "INDI" else self.ptFamily)
+            return
+        end = None if self.table_limit is None else self.table_offset + self.table_limit
+        shown = keys[self.table_offset:end]
+        if kind == "INDI":
+            table = StreamingTable(USER_COLUMNS, self.table_widths)
+            table.write(self.user_row(key, self.userdata[key]) for key in shown)
+        else:
+            table = StreamingTable(FAMILY_COLUMNS, self.table_widths)
+            table.write(self.family_row(key, FamilyScope(self, key)) for key in shown)
+        if len(shown) < len(keys):
+            print("Showing {} of {} rows from row {}".format(len(shown), len(keys), self.table_offset + 1))
 
-            if abs(datetime.datetime.strptime(self.userdata[husband_id]["BIRTDATE"],
-                                              '%d %b %Y') - datetime.datetime.strptime(
-                self.userdata[wife_id]["BIRTDATE"], '%d %b %Y')).days > 5475:
-                print("ERROR: US17 FAMILY {} has marriage between descendants and their children".format(key))
-                self.errorlog["DescendantChildrenMarriage"] += 1
-            if len(children) > 15:
-                print("ERROR: US15 FAMILY {} more than 15 siblings".format(key))
-                self.errorlog["SiblingGreaterThan15"] += 1
-            husband_name = self.userdata[husband_id]["NAME"]
-            husband_firstname, husband_lastname = husband_name.split()
-            uniquenameslist.append(husband_firstname)
-            try:
-                marriage = self.userdata[husband_id]["MARRDATE"]
-            except KeyError:
-                return "No Marriage date found"
-
-            wife_name = self.userdata[wife_id]["NAME"]
-            wife_firstname, wife_lastname = wife_name.split()
-            if wife_firstname not in uniquenameslist:
-                uniquenameslist.append(wife_firstname)
+    def check_parallel(self, kind, keys, individual_rules, plan):
+        """
+        Function to run check_individuals or check_families on ranges of the records in forked worker processes
+        The workers read the tree the fork shares with them, only the results of each range are pickled, they are
+        merged in range order so the output, errors and tables are those of a serial run
+        :param kind: "INDI" or "FAM"
+        :param keys: sorted IDs of the records
+        :param individual_rules: individual Rules
+        :param plan: list returned by rule_plan
+        :return: error string if a family rule stopped the checks, else None
+        """
+        global CHECKING
+        size = max(1, -(-len(keys) // (self.check_workers * PARALLEL_CHUNKS_PER_WORKER)))
+        tasks = [(kind, keys[start:start + size]) for start in range(0, len(keys), size)]
+        table = self.ptUsers if kind == "INDI" else self.ptFamily
+        CHECKING = (self, individual_rules, plan)
+        self.flush_anomalies()  # the workers start with a copy of the sinks
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.check_workers,
+                                                        mp_context=multiprocessing.get_context("fork")) as pool:
+                for result in pool.map(check_chunk, tasks):
+                    for anomaly in result["sent"]:
+                        for sink in self.sinks:
+                            sink.write(anomaly)
+                    if result["output"]:
+                        self.flush_anomalies()
+                        sys.stdout.write(result["output"])
+                    for category, count in result["errorlog"].items():
+                        self.errorlog[category] += count
+                    for scope, errors in result["anomalies"].items():
+                        self.anomalies[scope].extend(errors)
+                    for row in result["rows"]:
+                        table.add_row(row)
+                    for code, seconds in result["rule_seconds"].items():
+                        self.rule_seconds[code] += seconds
+                    if result["exception"] is not None:
+                        pool.shutdown(cancel_futures=True)
+                        raise result["exception"]
+                    if result["error"] is not None:
+                        self.stopped_at = result["stopped_at"]
+                        pool.shutdown(cancel_futures=True)
+                        return result["error"]
+        finally:
+            CHECKING = None
+
+
+def check_chunk(task):
+    """
+    Function run in a forked worker process to check a range of the records of the tree in CHECKING
+    :param task: ("INDI" or "FAM", sorted IDs)
+    :return: dict with the output, errorlog, anomalies, the Anomaly objects sent to the sinks, table rows and seconds
+    per rule the range added, the error and family of a family rule that stopped the checks and any exception a
+    check raised
+    """
+    kind, keys = task
+    g, individual_rules, plan = CHECKING
+    sent = ListSink()
+    g.sinks = [sent]  # the anomalies are sent to the sinks of the parent, in range order
+    g.errorlog = defaultdict(int)
+    g.anomalies = defaultdict(list)
+    table = PrettyTable()
+    table.field_names = (g.ptUsers if kind == "INDI" else g.ptFamily).field_names
+    if kind == "INDI":
+        g.ptUsers = table
+    else:
+        g.ptFamily = table
+    if g.rule_seconds is not None:
+        g.rule_seconds.clear()  # the timed checks add to this dict
+    g.stopped_at = None
+    output = io.StringIO()
+    error = exception = None
+    with contextlib.redirect_stdout(output):
+        try:
+            if kind == "INDI":
+                g.check_individuals(keys, individual_rules)
             else:
-                print("ERROR: US10 INDIVIDUAL {} {} and INDIVIDUAL {} {} have same first name".format(husband_id,
-                                                                                                      husband_firstname,
-                                                                                                      wife_id,
-                                                                                                      wife_firstname))
-                self.errorlog["UniqueFirstNames"] += 1
-            try:
-                divorce = self.userdata[husband_id]["DIVDATE"]
-                div_husband = self.userdata[husband_id]["DIVDATE"]
-                div_wife = self.userdata[wife_id]["DIVDATE"]
-            except KeyError:
-                divorce = "NA"
-                div_husband = "NA"
-                div_wife = "NA"
-
-            for child in children:
-                grandchildren = self.userdata[child]["CHILD"]
-
-
-
-                for gchild in grandchildren:
-                    if "SPOUSE" in self.userdata[gchild].keys():
-                        gspouse = self.userdata[gchild]["SPOUSE"]
-                        if ("father" in self.userdata[gspouse].keys() and self.userdata[gspouse][
-                            "father"] in children) or (
-                                "mather" in self.userdata[gspouse].keys() and self.userdata[gspouse][
-                            "mather"] in children):
-                            print("ERROR: {} and {} are married consins".format(gchild, gspouse))
-                        if gspouse in children:
-                            print("ERROR: Aunts and uncles")
-
-                birthday = datetime.datetime.strptime(self.userdata[child]["BIRTDATE"], '%d %b %Y')
-                child_name = self.userdata[child]["NAME"]
-                child_firstname, child_lastname = child_name.split()
-
-                if abs(datetime.datetime.strptime(self.userdata[husband_id]["BIRTDATE"],
-                                                  '%d %b %Y') - datetime.datetime.strptime(
-                    self.userdata[child]["BIRTDATE"], '%d %b %Y')).days > 29200:
-                    print(
-                        "ERROR: US12 FAMILY {} Parents are too old".format(key))
-                    self.errorlog["ParentsTooOld"] += 1
-
-
-                if abs(datetime.datetime.strptime(self.userdata[wife_id]["BIRTDATE"],
-                                                  '%d %b %Y') - datetime.datetime.strptime(
-                    self.userdata[child]["BIRTDATE"], '%d %b %Y')).days > 21900:
-                    print(
-                        "ERROR: FAMILY {} Parents are too old".format(key))
-                    self.errorlog["ParentsTooOld"] += 1
-
-                if child_firstname not in uniquenameslist:
-                    uniquenameslist.append(child_firstname)
-                else:
-                    print(
-                        "ERROR: US25 INDIVIDUAL {} {} does not have a unique first name".format(child, child_firstname))
-                    self.errorlog["UniqueFirstNames"] += 1
-
-                multiple_siblings_birth_counter = 0
-                for c in children:
-                    if c != child:
-                        c_birthday = datetime.datetime.strptime(self.userdata[c]["BIRTDATE"], '%d %b %Y')
-                        if c_birthday > datetime.datetime.strptime(self.userdata[husband_id]["MARRDATE"], '%d %b %Y'):
-                            print("ERROR: US08 Family {} has Child {} who was born before parents marriage".format(key,
-                                                                                                                   c))
-                            self.errorlog["ChildBirthBeforeParentsMarriage"] += 1
-                        try:
-                            if c_birthday > datetime.datetime.strptime(self.userdata[husband_id]["DEATDATE"],
-                                                                       '%d %b %Y'):
-                                print("ERROR: US09 Family {} has Child {} who was born after parents Death".format(key,
-                                                                                                                   c))
-                                self.errorlog["DeathBeforeBirthParents"] += 1
-                        except KeyError:
-                            pass
-                        if abs(birthday - c_birthday).days < 250 or abs(birthday - c_birthday).days > 2:
-                            print(
-                                "ERROR: US13 INDIVIDUAL {} {} and INDIVIDUAL {} {} are siblings and have an invalid spacing between their births".format(
-                                    child, self.userdata[child]["NAME"], c, self.userdata[c]["NAME"]))
-                            self.errorlog["SiblingSpacing"] += 1
-                        if abs(birthday - c_birthday).days < 2:
-                            multiple_siblings_birth_counter += 1
-                        if multiple_siblings_birth_counter > 5:
-                            print(
-                                "ERROR: US14 Family {} has more than 5 siblings born less than 2 days apart".format(
-                                    key))
-                            self.errorlog["MultipleSiblings"] += 1
-
-                if self.userdata[child]["SEX"] == "M":
-                    child_firstname, child_lastname = self.userdata[child]["NAME"].split()
-                    if child_lastname.strip("/") != husband_firstname:
-                        print(
-                            "ERROR: US16 INDIVIDUAL {} {} and INDIVIDUAL {} {} have a Father-Child relationship but have different last names".format(
-                                husband_id, husband_firstname, child, self.userdata[child]["NAME"]))
-                        self.errorlog["MaleLastNames"] += 1
-
-
-            if self.userdata[husband_id]["AGE"] > 2 * (self.userdata[wife_id]["AGE"]):
-                print("ERROR: US34 INDIVIDUAL {} {} and INDIVIDUAL {} {} have large age difference".format(
-                                husband_id, husband_name, wife_id, self.userdata[wife_id]["NAME"]))
-                self.errorlog["AgeDiffrence"] += 1
-
-
-
-
-            if self.userdata[wife_id]["AGE"] > 2 * (self.userdata[husband_id]["AGE"]):
-                print("ERROR: US34 INDIVIDUAL {} {} and INDIVIDUAL {} {} have large age difference".format(
-                                wife_id, wife_name, husband_id, self.userdata[husband_id]["NAME"]))
-
-
-            if (divorce != "NA") and (div_husband != "NA") and (div_wife != "NA"):
-                if (datetime.datetime.strptime(marriage, '%d %b %Y') > datetime.datetime.strptime(
-                        self.userdata[husband_id]["DIVDATE"], '%d %b %Y')) or (
-                        datetime.datetime.strptime(self.userdata[wife_id]["MARRDATE"],
-                                                   '%d %b %Y') > datetime.datetime.strptime(
-                    self.userdata[wife_id]["DIVDATE"], '%d %b %Y')):
-                    print(
-                        "ERROR: US04 INDIVIDUAL {} {} has Marriage After Divorce".format(husband_id,
-                                                                                         husband_firstname))
-                    self.errorlog["MarriageBeforeDivorce"] += 1
-
-            if (divorce != "NA") and (div_husband != "NA") and (div_wife != "NA"):
-                if (datetime.datetime.strptime(div_husband, '%d %b %Y') > datetime.datetime.strptime(
-                        self.userdata[husband_id]["DEATDATE"], '%d %b %Y')) or (
-                        datetime.datetime.strptime(div_wife, '%d %b %Y') > datetime.datetime.strptime(
-                    self.userdata[wife_id]["DEATDATE"], '%d %b %Y')):
-                    print(
-                        "ERROR: US06 INDIVIDUAL {} {} has divorce after death".format(husband_id, husband_firstname))
-                    self.errorlog["DivorceAfterDeath"] += 1
-
-            if "FAMC" in self.userdata[husband_id] and "FAMC" in self.userdata[wife_id]:
-                if self.userdata[husband_id]["FAMC"] == self.userdata[wife_id]["FAMC"]:
-                    print(
-                        "ERROR: US18 INDIVIDUAL {} {} and INDIVIDUAL {} {} are siblings but have married".format(
-                            husband_id, husband_firstname, wife_id, wife_firstname))
-                    self.errorlog["SiblingMarriageError"] += 1
-
-            if (self.userdata[husband_id]["SEX"] == "M" and self.userdata[wife_id]["SEX"] == "M"):
-                print(
-                    "ERROR: US21 INDIVIDUAL {} {} and INDIVIDUAL {} {} are of same gender but have married".format(
-                        husband_id, husband_firstname, wife_id, wife_firstname))
-                self.errorlog["ProperGender"] += 1
+                error = g.check_families(keys, plan)
+        except Exception as raised:  # raised again after the output before it is merged
+            exception = raised
+    return {"output": output.getvalue(), "errorlog": dict(g.errorlog), "anomalies": dict(g.anomalies),
+            "sent": sent.anomalies, "rows": table.rows, "rule_seconds": dict(g.rule_seconds or {}), "error": error,
+            "stopped_at": g.stopped_at, "exception": exception}
+
+
+class Rule:
+    """
+    One user story check of the RULES registry
+    code: user story the check belongs to, a story can have several checks
+    scope: what the check runs on and what it is called with
+        "individual": each individual, (gedcom, ID, Individual)
+        "family": each family, (gedcom, FamilyScope), may return an error string that stops all checks
+        "child": each child of each family, (gedcom, FamilyScope) with the child set
+        "individual_list", "family_list": once after that table is printed, only for pretty tables,
+        (gedcom, sorted IDs of the checked records)
+    needs: names of the INDEXES the check reads
+    check: the function
+    mask: for individual rules, None or a function of (TreeColumns, today ordinal) returning the boolean array of
+    individuals the check reports, used instead of calling check on everyone when Gedcom.vectorized is set
+    query: for individual and family rules, None or SQL selecting the sorted IDs of the records of a TreeStore the
+    check reports, the check only runs on those in Gedcom.store_analyze
+    """
+    __slots__ = ("code", "scope", "needs", "check", "mask", "query")
+
+    def __init__(self, code, scope, needs, check, mask=None, query=None):
+        self.code = code
+        self.scope = scope
+        self.needs = needs
+        self.check = check
+        self.mask = mask
+        self.query = query
+
+    def __repr__(self):
+        return "Rule({}, {}, {})".format(self.code, self.scope, self.check.__name__)
+
+
+RULES = []  # every check, rules of a scope run in the order they are registered
+# index name to the Gedcom method building it, columns is built before relatives adds records for missing IDs
+INDEXES = {"ages": "derive_ages", "columns": "build_columns", "relatives": "link_relatives",
+           "siblings": "sort_siblings", "kinship": "build_kinship", "duplicates": "index_duplicates"}
+TABLE_INDEXES = ("ages", "relatives")  # read by the individuals table
+
+
+def rule(code, scope, needs=(), mask=None, query=None):
+    """
+    Function to register the decorated function as a Rule in RULES
+    :param code: user story, such as "US01"
+    :param scope: see Rule
+    :param needs: names of the INDEXES the check reads
+    :param mask: vectorized form of an individual check, see Rule
+    :param query: SQL form of the check, see Rule
+    :return: decorator
+    """
+    def register(check):
+        RULES.append(Rule(code, scope, tuple(needs), check, mask, query))
+        return check
+    return register
+
+
+PARSE_CODES = ("US22",)  # user stories checked while parsing, whatever rules are selected
+GATE_CODES = ("MARR",)  # family rules that stop the checks, selected along with any family or child rule
+
+
+class ErrorLimitReached(Exception):
+    """
+    Raised by Gedcom.report_error once max_errors errors have been reported, calc_data catches it
+    """
+
+
+def select_rules(codes):
+    """
+    Function to pick the rules of some user stories
+    The GATE_CODES rules are added when a family or child rule is picked, so the checks stop at the same family as
+    in a full run instead of comparing dates with a missing marriage date
+    :param codes: user stories such as ["US01", "US03"], PARSE_CODES are accepted but have no rule
+    :return: list of Rules in RULES order
+    """
+    codes = set(codes)
+    known = {check.code for check in RULES}.union(PARSE_CODES)
+    if not codes <= known:
+        raise ValueError("Unknown user stories {}, choose from {}".format(", ".join(sorted(codes - known)),
+                                                                          ", ".join(sorted(known))))
+    if any(check.scope in ("family", "child") for check in RULES if check.code in codes):
+        codes.update(GATE_CODES)
+    return [check for check in RULES if check.code in codes]
+
+
+def rule_plan(rules):
+    """
+    Function to nest the family and child rules into the loops they run in, keeping their order
+    Consecutive child rules share one loop over the children
+    :param rules: Rule objects
+    :return: list of family Rules and lists of child Rules
+    """
+    plan = []
+    for check in rules:
+        if check.scope == "family":
+            plan.append(check)
+        elif check.scope == "child":
+            if not plan or isinstance(plan[-1], Rule):
+                plan.append([])
+            plan[-1].append(check)
+    return plan
+
+
+def timed_rule(check, seconds):
+    """
+    Function to wrap a rule so the time spent in it is added up under its code
+    :param check: Rule
+    :param seconds: dict of code to seconds
+    :return: Rule
+    """
+    function = check.check
+
+    @wraps(function)
+    def timed(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds[check.code] += time.perf_counter() - start
+    return Rule(check.code, check.scope, check.needs, timed, check.mask, check.query)
+
+
+class SiblingSweep:
+    """
+    The children of one family sorted by birth, with what the sibling rules need found in one pass over them
+    order: child IDs oldest first, children born the same day keep their listed order
+    spacing: pairs of children born one after the other at least 2 and less than 250 days apart, for US13
+    births: groups of 2 or more children each born less than 2 days after the one before, for US14 and US32
+    """
+    __slots__ = ("order", "spacing", "births")
+
+    def __init__(self, userdata, children):
+        born = sorted((userdata[child].birth_day, row, child) for row, child in enumerate(children))
+        self.order = [child for day, row, child in born]
+        self.spacing = []
+        self.births = []
+        group = []
+        last_day = last_child = None
+        for day, row, child in born:
+            if last_day is not None and day - last_day < 2:
+                group.append(child)
+            else:
+                if len(group) > 1:
+                    self.births.append(group)
+                group = [child]
+                if last_day is not None and day - last_day < 250:
+                    self.spacing.append((last_child, child))
+            last_day, last_child = day, child
+        if len(group) > 1:
+            self.births.append(group)
+
+
+class Kinship:
+    """
+    Ancestry of every individual, built once from the FAMC links and the spouses of the families they name
+    parents: ID to the tuple of the IDs of the known parents
+    grandparents: ID to the frozenset of the IDs of the known grandparents
+    generation: ID to the length of the longest line of known ancestors above the individual, 0 for none
+    visited: ID to the floor and the set of ancestors of the walks is_ancestor finished, least recently used
+    first, holding at most memo_size IDs in all
+    An ancestor always has a lower generation than its descendants, so is_ancestor only climbs through the
+    individuals above the generation of the ancestor it looks for
+    """
+    __slots__ = ("parents", "grandparents", "generation", "visited", "memo_size", "memo_used")
+
+    def __init__(self, userdata, familydata, memo_size=KINSHIP_MEMO_SIZE):
+        self.parents = {}
+        for key, record in userdata.items():
+            family = familydata.get(record.famc) if record.famc is not None else None
+            if family is None:
+                self.parents[key] = ()
+            else:
+                self.parents[key] = tuple(parent for parent in (family.husb, family.wife)
+                                          if parent is not None and parent != key)
+        self.grandparents = {key: frozenset(grandparent for parent in parents
+                                            for grandparent in self.parents.get(parent, ()))
+                             for key, parents in self.parents.items()}
+
+        self.generation = {}
+        visiting = set()
+        for start in self.parents:
+            stack = [start]
+            while stack:
+                key = stack[-1]
+                if key in self.generation:
+                    stack.pop()
+                    continue
+                pending = [parent for parent in self.parents.get(key, ()) if parent not in self.generation]
+                if pending and key not in visiting:  # a parent still in visiting is a loop in the data
+                    visiting.add(key)
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                self.generation[key] = 1 + max((self.generation.get(parent, -1)
+                                                for parent in self.parents.get(key, ())), default=-1)
+        self.visited = OrderedDict()
+        self.memo_size = memo_size
+        self.memo_used = 0
+
+    def memoized(self, key, floor):
+        """
+        Function to get the memoized ancestors of an individual if its walk climbed down to the floor
+        A walk down to a floor visits every ancestor of that generation or above, so it answers any higher floor
+        :param key: ID of the individual
+        :param floor: generation of the ancestor looked for
+        :return: set of IDs of ancestors or None
+        """
+        entry = self.visited.get(key)
+        if entry is None or entry[0] > floor:
+            return None
+        self.visited.move_to_end(key)
+        return entry[1]
 
-            try:
-                child = value["CHIL"]
-            except KeyError:
-                child = "NA"
-            self.ptFamily.add_row([key, marriage, divorce, husband_id, husband_name, wife_id, wife_name, child])
+    def memoize(self, key, floor, seen):
+        """
+        Function to keep the ancestors a finished walk visited, evicting the least recently used walks to stay
+        within memo_size IDs
+        """
+        if len(seen) > self.memo_size:
+            return
+        old = self.visited.pop(key, None)
+        if old is not None:
+            self.memo_used -= len(old[1])
+        while self.visited and self.memo_used + len(seen) > self.memo_size:
+            self.memo_used -= len(self.visited.popitem(last=False)[1][1])
+        self.visited[key] = (floor, seen)
+        self.memo_used += len(seen)
+
+    def is_ancestor(self, ancestor, key):
+        """
+        Function to check if one individual is an ancestor of another
+        The walk stops at the parents a memoized walk already climbed from
+        :param ancestor: ID of the possible ancestor
+        :param key: ID of the individual
+        :return: bool
+        """
+        parents, generation, visited = self.parents, self.generation, self.visited
+        floor = generation.get(ancestor, 0)
+        if key in visited:
+            known = self.memoized(key, floor)
+            if known is not None:
+                return ancestor in known
+        stack = list(parents.get(key, ()))
+        seen = set(stack)
+        while stack:
+            parent = stack.pop()
+            if parent == ancestor:
+                return True
+            if parent in visited:
+                known = self.memoized(parent, floor)
+                if known is not None:
+                    if ancestor in known:
+                        return True
+                    seen |= known
+                    continue
+            if generation.get(parent, 0) > floor:
+                for grandparent in parents.get(parent, ()):
+                    if grandparent not in seen:
+                        seen.add(grandparent)
+                        stack.append(grandparent)
+        if len(seen) >= KINSHIP_MEMO_WALK:
+            self.memoize(key, floor, seen)
+        return False
+
+    def are_siblings(self, first, second):
+        """
+        Function to check if two individuals share a parent
+        """
+        return first != second and not set(self.parents.get(first, ())).isdisjoint(self.parents.get(second, ()))
 
-        if self.bool_to_print is True:
-            print(self.ptFamily)
+    def are_cousins(self, first, second):
+        """
+        Function to check if two individuals share a grandparent but not a parent
+        """
+        return not self.grandparents.get(first, frozenset()).isdisjoint(self.grandparents.get(second, ())) and \
+            not self.are_siblings(first, second)
 
+    def is_aunt_or_uncle(self, key, nephew):
+        """
+        Function to check if an individual is a sibling of a parent of another
+        :param key: ID of the possible aunt or uncle
+        :param nephew: ID of the possible nephew or niece
+        :return: bool
+        """
+        return key not in self.parents.get(nephew, ()) and \
+            not self.grandparents.get(nephew, frozenset()).isdisjoint(self.parents.get(key, ()))
+
+
+class FamilyScope:
+    """
+    The family the family and child rules are checking
+    key, family: ID and Family record
+    husband_id, wife_id, husband, wife: the spouses and their Individual records
+    children: IDs of the children
+    child, child_record: the child the child rules are checking
+    """
+    __slots__ = ("key", "family", "husband_id", "wife_id", "husband", "wife", "children", "child", "child_record",
+                 "first_names_taken", "userdata")
+
+    def __init__(self, gedcom, key):
+        self.userdata = gedcom.userdata
+        self.key = key
+        self.family = gedcom.familydata[key]
+        self.husband_id = self.family.husb
+        self.wife_id = self.family.wife
+        self.children = self.family.chil
+        self.husband = self.userdata[self.husband_id]
+        self.wife = self.userdata[self.wife_id]
+        self.child = self.child_record = None
+        self.first_names_taken = None
+
+    def set_child(self, child):
+        self.child = child
+        self.child_record = self.userdata[child]
+
+    @property
+    def husband_firstname(self):
+        if self.husband.name is None:
+            return None
+        first, last = self.husband.name.split()
+        return first
+
+    @property
+    def wife_firstname(self):
+        # a spouse whose ID is taken by another record has no NAME
+        if self.wife.name is None:
+            return None
+        first, last = self.wife.name.split()
+        return first
+
+    @property
+    def first_names(self):
+        """
+        First names taken in the family so far, the spouses' and those of the children checked by US25
+        """
+        if self.first_names_taken is None:
+            self.first_names_taken = [self.husband_firstname]
+            if self.wife_firstname != self.husband_firstname:
+                self.first_names_taken.append(self.wife_firstname)
+        return self.first_names_taken
+
+    @property
+    def divorce(self):
+        """
+        Divorce date if both spouses have one, else "NA"
+        """
+        if self.husband.divorce is not None and self.wife.divorce is not None:
+            return self.husband.divorce
+        return "NA"
+
+
+@rule("US11", "individual")
+def bigamy(g, key, record):
+    intervals = {}
+    for marriage, divorce, fam_id in record.marriages or ():
+        start = date_ordinal(marriage)
+        if start == NO_DATE:
+            continue
+        ends = [date_ordinal(divorce)] if divorce is not None else []
+        family = g.familydata.get(fam_id) if fam_id is not None else None
+        if family is not None:
+            spouse = g.userdata.get(family.wife if family.husb == key else family.husb)
+            if spouse is not None and spouse.death_day != NO_DATE:
+                ends.append(spouse.death_day)
+        ends = [end for end in ends if end != NO_DATE]
+        end = min(ends) if ends else OPEN_MARRIAGE
+        # the same marriage read from the INDI and the FAM record is one interval
+        intervals[fam_id, start] = min(end, intervals.get((fam_id, start), OPEN_MARRIAGE))
+    if overlapping_marriages([(start, end) for (fam_id, start), end in intervals.items()]):
+        g.report_error("ERROR: US11 INDIVIDUAL {} HAS DONE BIGAMY".format(key), "Bigamy",
+                       [key] + list(dict.fromkeys(fam_id for fam_id, start in intervals if fam_id is not None)),
+                       [marriage for marriage, divorce, fam_id in record.marriages])
+
+
+@rule("US01", "individual", mask=lambda columns, today: columns.birth > today)
+def birth_after_today(g, key, record):
+    if record.birth_day > g.today:
+        g.report_error("ERROR: US01 INDIVIDUAL () {} has Birthdate Date before Current date".format(key, record.name),
+                       "DateAfterCurrent", dates=[record.birth])
+
+
+@rule("US01", "individual", mask=lambda columns, today: (columns.death != NO_DATE) & (columns.death > today))
+def death_after_today(g, key, record):
+    if record.death is not None and record.death_day > g.today:
+        g.report_error("ERROR: US21 INDIVIDUAL () {} has Death date Date after Current date".format(key, record.name),
+                       "DateAfterCurrent", dates=[record.death])
+
+
+@rule("US03", "individual",
+      mask=lambda columns, today: (columns.death != NO_DATE) & (columns.death > columns.birth))
+def death_before_birth(g, key, record):
+    if record.death is not None and record.death_day > record.birth_day:
+        g.report_error("ERROR: US03 INDIVIDUAL () {} has Death date Date before Birth date".format(key, record.name),
+                       "DeathBeforeBirth", dates=[record.birth, record.death])
+
+
+@rule("US10", "individual", mask=lambda columns, today: (columns.marriage != NO_DATE) & (
+        columns.years(columns.marriage) - columns.years(columns.birth) < 14))
+def married_before_14(g, key, record):
+    # Check if marriage before 14, also add something to test cases.  Xiaopeng Yuan
+    if record.marriage is not None and (date.fromordinal(record.marriage_day).year -
+                                        date.fromordinal(record.birth_day).year < 14):
+        g.report_error("ERROR: US10 INDIVIDUAL {} {} has married before the age of 14".format(key, record.name),
+                       "MarriageBefore14", dates=[record.birth, record.marriage])
+
+
+@rule("US23", "individual", needs=("duplicates",), query="""SELECT id FROM individuals AS i
+    WHERE name_key IS NOT NULL AND birth_day != 0 AND EXISTS (SELECT 1 FROM individuals AS o
+    WHERE o.name_key = i.name_key AND o.birth_day = i.birth_day AND o.id != i.id) ORDER BY id""")
+def same_name_and_birth(g, key, record):
+    same = g.duplicates.people.get(person_key(record), ())
+    if len(same) > 1:
+        g.report_error("ERROR: US23 INDIVIDUAL {} {} does not have a unique name and birth date".format(key, record.name),
+                       "UniqueNameBirthDate", [key] + [other for other in same if other != key], [record.birth])
+
+
+@rule("US01", "individual",
+      mask=lambda columns, today: (columns.divorce != NO_DATE) & (columns.divorce > today))
+def divorce_after_today(g, key, record):
+    if record.divorce is not None and record.divorce_day > g.today:
+        g.report_error("ERROR: 01 INDIVIDUAL () {} has Divorce date before Current date".format(key, record.name),
+                       "DateAfterCurrent", dates=[record.divorce])
+
+
+@rule("US01", "individual",
+      mask=lambda columns, today: (columns.marriage != NO_DATE) & (columns.marriage > today))
+def marriage_after_today(g, key, record):
+    if record.marriage is not None and record.marriage_day > g.today:
+        g.report_error("ERROR: 01 INDIVIDUAL () {} has Marriage date Date before Current date".format(key, record.name),
+                       "DateAfterCurrent", dates=[record.marriage])
+
+
+@rule("US05", "individual", mask=lambda columns, today: (columns.death != NO_DATE) & (
+        columns.marriage != NO_DATE) & (columns.marriage > columns.death))
+def marriage_after_death(g, key, record):
+    if record.death is not None and record.marriage is not None and record.marriage_day > record.death_day:
+        g.report_error("ERROR: US05 INDIVIDUAL {} {} have Marriage at {} which is after their death on {}".format(
+            key, record.name, datetime.datetime.fromordinal(record.marriage_day),
+            datetime.datetime.fromordinal(record.death_day)), "MarriageBeforeDeath",
+            dates=[record.marriage, record.death])
+
+
+@rule("US07", "individual", needs=("ages",), mask=lambda columns, today: (columns.death == NO_DATE) & (
+        date.fromordinal(today).year - columns.years(columns.birth) > 150))
+def older_than_150(g, key, record):
+    if record.death is None and record.age > 150:
+        g.report_error("ERROR: US07 INDIVIDUAL {} {} has an age of {} which is over 150".format(key, record.name,
+                                                                                               record.age),
+                       "AgeLessOneFifty", dates=[record.birth])
+
+
+@rule("US02", "individual",
+      mask=lambda columns, today: (columns.marriage != NO_DATE) & (columns.birth > columns.marriage))
+def marriage_before_birth(g, key, record):
+    if record.marriage is not None and record.birth_day > record.marriage_day:
+        g.report_error("ERROR: US02 INDIVIDUAL {} {} has Marriage Before Birth".format(key, record.name),
+                       "MarriageBeforeBirth", dates=[record.birth, record.marriage])
+
+
+@rule("US31", "individual_list")
+def list_singles(g, keys):
+    single_list = [g.userdata[key].name for key in keys if g.userdata[key].marriage is None]
+    g.display("DISPLAY US31 LIST OF SINGLES: {}".format(single_list))
 
-            age_list.sort()
-            age_list[::-1]
 
-            if(age_list!=test_order):
-                print("ERROR: US28 Age of siblings are not in order ", test_order)
-                self.errorlog["OrderSiblings"] += 1
+@rule("US29", "individual_list")
+def list_deceased(g, keys):
+    deceased_list = [g.userdata[key].name for key in keys if g.userdata[key].death is not None]
+    g.display("DISPLAY US29 LIST OF deceased PEOPLE: {}".format(deceased_list))
 
-            print("DISPLAY US32 LIST OF Multiple Births:", multiple_births)
 
-            print("Display US28 List of Ordered Age of Siblings", age_list)
+@rule("US30", "individual_list")
+def list_married(g, keys):
+    married_list = [g.userdata[key].name for key in keys if g.userdata[key].marriage is not None]
+    g.display("DISPLAY US30 LIST OF MARRIED PEOPLE: {}".format(married_list))
 
-            test_multiple.pop(3)
 
-            for i in multiple_births:
-                if i not in test_multiple:
-                    print("ERROR: US32 INDIVIDUAL {} {} not in the list of multiple births".format(i,child_name))
-                    self.errorlog["MultipleBirths"] += 1
+@rule("US17", "family", needs=("kinship",))
+def descendant_married(g, family):
+    if g.kinship.is_ancestor(family.husband_id, family.wife_id) or g.kinship.is_ancestor(family.wife_id,
+                                                                                          family.husband_id):
+        g.report_error("ERROR: US17 FAMILY {} has marriage between descendants and their children".format(family.key),
+                       "DescendantChildrenMarriage", [family.key, family.husband_id, family.wife_id])
 
 
+@rule("US15", "family")
+def more_than_15_siblings(g, family):
+    if len(family.children) > 15:
+        g.report_error("ERROR: US15 FAMILY {} more than 15 siblings".format(family.key), "SiblingGreaterThan15",
+                       [family.key] + family.children)
 
 
+@rule("MARR", "family")
+def marriage_recorded(g, family):
+    # the family checks compare dates with the husband's marriage
+    if family.husband.marriage is None:
+        return "No Marriage date found"
+
+
+@rule("US25", "family")
+def spouses_same_first_name(g, family):
+    if family.wife_firstname is not None and family.wife_firstname == family.husband_firstname:
+        g.report_error("ERROR: US10 INDIVIDUAL {} {} and INDIVIDUAL {} {} have same first name".format(
+            family.husband_id, family.husband_firstname, family.wife_id, family.wife_firstname), "UniqueFirstNames",
+            [family.key, family.husband_id, family.wife_id])
+
+
+@rule("US19", "family", needs=("kinship",))
+def married_cousins(g, family):
+    if g.kinship.are_cousins(family.husband_id, family.wife_id):
+        g.report_error("ERROR: {} and {} are married consins".format(family.husband_id, family.wife_id),
+                       records=[family.key, family.husband_id, family.wife_id])
+
+
+@rule("US20", "family", needs=("kinship",))
+def married_aunts_and_uncles(g, family):
+    if g.kinship.is_aunt_or_uncle(family.husband_id, family.wife_id) or g.kinship.is_aunt_or_uncle(
+            family.wife_id, family.husband_id):
+        g.report_error("ERROR: Aunts and uncles", records=[family.key, family.husband_id, family.wife_id])
+
+
+@rule("US12", "child")
+def father_too_old(g, family):
+    if abs(family.husband.birth_day - family.child_record.birth_day) > 29200:
+        g.report_error("ERROR: US12 FAMILY {} Parents are too old".format(family.key), "ParentsTooOld",
+                       [family.key, family.husband_id, family.child], [family.husband.birth, family.child_record.birth])
+
+
+@rule("US12", "child")
+def mother_too_old(g, family):
+    if abs(family.wife.birth_day - family.child_record.birth_day) > 21900:
+        g.report_error("ERROR: FAMILY {} Parents are too old".format(family.key), "ParentsTooOld",
+                       [family.key, family.wife_id, family.child], [family.wife.birth, family.child_record.birth])
+
+
+@rule("US25", "child")
+def unique_first_names(g, family):
+    child_firstname, child_lastname = family.child_record.name.split()
+    if child_firstname not in family.first_names:
+        family.first_names.append(child_firstname)
+    else:
+        g.report_error("ERROR: US25 INDIVIDUAL {} {} does not have a unique first name".format(family.child,
+                                                                                              child_firstname),
+                       "UniqueFirstNames", [family.key, family.child])
+
+
+@rule("US08", "child")
+def born_before_parents_marriage(g, family):
+    if family.child_record.birth_day > family.husband.marriage_day:
+        g.report_error("ERROR: US08 Family {} has Child {} who was born before parents marriage".format(
+            family.key, family.child), "ChildBirthBeforeParentsMarriage", [family.key, family.child],
+            [family.child_record.birth, family.husband.marriage])
+
+
+@rule("US09", "child")
+def born_after_parents_death(g, family):
+    if family.husband.death is not None and family.child_record.birth_day > family.husband.death_day:
+        g.report_error("ERROR: US09 Family {} has Child {} who was born after parents Death".format(
+            family.key, family.child), "DeathBeforeBirthParents", [family.key, family.husband_id, family.child],
+            [family.child_record.birth, family.husband.death])
+
+
+@rule("US16", "child")
+def male_last_names(g, family):
+    if family.child_record.sex == "M":
+        child_firstname, child_lastname = family.child_record.name.split()
+        if child_lastname.strip("/") != family.husband_firstname:
+            g.report_error(
+                "ERROR: US16 INDIVIDUAL {} {} and INDIVIDUAL {} {} have a Father-Child relationship but have different last names".format(
+                    family.husband_id, family.husband_firstname, family.child, family.child_record.name), "MaleLastNames",
+                [family.key, family.husband_id, family.child])
+
+
+@rule("US13", "family", needs=("siblings",))
+def sibling_spacing(g, family):
+    for older, younger in g.siblings[family.key].spacing:
+        g.report_error(
+            "ERROR: US13 INDIVIDUAL {} {} and INDIVIDUAL {} {} are siblings and have an invalid spacing between their births".format(
+                older, g.userdata[older].name, younger, g.userdata[younger].name), "SiblingSpacing",
+            [family.key, older, younger], [g.userdata[older].birth, g.userdata[younger].birth])
+
+
+@rule("US14", "family", needs=("siblings",))
+def multiple_births(g, family):
+    groups = [group for group in g.siblings[family.key].births if len(group) > 5]
+    if groups:
+        g.report_error("ERROR: US14 Family {} has more than 5 siblings born less than 2 days apart".format(family.key),
+                       "MultipleSiblings", [family.key] + groups[0])
+
+
+@rule("US34", "family", needs=("ages",))
+def large_age_difference(g, family):
+    husband, wife = family.husband, family.wife
+    if husband.age is None or wife.age is None:
+        return
+    if husband.age > 2 * (wife.age):
+        g.report_error("ERROR: US34 INDIVIDUAL {} {} and INDIVIDUAL {} {} have large age difference".format(
+            family.husband_id, husband.name, family.wife_id, wife.name), "AgeDiffrence",
+            [family.key, family.husband_id, family.wife_id], [husband.birth, wife.birth])
+    if wife.age > 2 * (husband.age):
+        g.report_error("ERROR: US34 INDIVIDUAL {} {} and INDIVIDUAL {} {} have large age difference".format(
+            family.wife_id, wife.name, family.husband_id, husband.name),
+            records=[family.key, family.wife_id, family.husband_id], dates=[wife.birth, husband.birth])
+
+
+@rule("US04", "family")
+def marriage_after_divorce(g, family):
+    husband, wife = family.husband, family.wife
+    if family.divorce != "NA":
+        if husband.marriage_day > husband.divorce_day or wife.marriage_day > wife.divorce_day:
+            g.report_error("ERROR: US04 INDIVIDUAL {} {} has Marriage After Divorce".format(family.husband_id,
+                                                                                           family.husband_firstname),
+                           "MarriageBeforeDivorce", [family.key, family.husband_id, family.wife_id],
+                           [husband.marriage, husband.divorce])
+
+
+@rule("US06", "family")
+def divorce_after_death(g, family):
+    husband, wife = family.husband, family.wife
+    if family.divorce != "NA":
+        if (husband.death is not None and husband.divorce_day > husband.death_day) or (
+                wife.death is not None and wife.divorce_day > wife.death_day):
+            g.report_error("ERROR: US06 INDIVIDUAL {} {} has divorce after death".format(family.husband_id,
+                                                                                        family.husband_firstname),
+                           "DivorceAfterDeath", [family.key, family.husband_id, family.wife_id],
+                           [husband.divorce, husband.death, wife.death])
+
+
+@rule("US18", "family", needs=("kinship",), query="""SELECT f.id FROM families AS f
+    JOIN individuals AS h ON h.id = f.husb JOIN individuals AS w ON w.id = f.wife
+    LEFT JOIN families AS hp ON hp.id = h.famc LEFT JOIN families AS wp ON wp.id = w.famc
+    WHERE h.famc = w.famc OR f.husb != f.wife AND (hp.husb NOT IN (f.husb, f.wife) AND hp.husb IN (wp.husb, wp.wife)
+    OR hp.wife NOT IN (f.husb, f.wife) AND hp.wife IN (wp.husb, wp.wife)) ORDER BY f.id""")
+def siblings_married(g, family):
+    if (family.husband.famc is not None and family.husband.famc == family.wife.famc) or g.kinship.are_siblings(
+            family.husband_id, family.wife_id):
+        g.report_error("ERROR: US18 INDIVIDUAL {} {} and INDIVIDUAL {} {} are siblings but have married".format(
+            family.husband_id, family.husband_firstname, family.wife_id, family.wife_firstname), "SiblingMarriageError",
+            [family.key, family.husband_id, family.wife_id])
+
+
+@rule("US21", "family")
+def same_gender_spouses(g, family):
+    if family.husband.sex == "M" and family.wife.sex == "M":
+        g.report_error("ERROR: US21 INDIVIDUAL {} {} and INDIVIDUAL {} {} are of same gender but have married".format(
+            family.husband_id, family.husband_firstname, family.wife_id, family.wife_firstname), "ProperGender",
+            [family.key, family.husband_id, family.wife_id])
+
+
+@rule("US24", "family", needs=("duplicates",), query="""SELECT f.id FROM families AS f
+    JOIN individuals AS h ON h.id = f.husb JOIN individuals AS w ON w.id = f.wife
+    WHERE h.name_key IS NOT NULL AND w.name_key IS NOT NULL AND h.marriage_day != 0 AND EXISTS (SELECT 1
+    FROM individuals AS oh JOIN families AS o ON o.husb = oh.id JOIN individuals AS ow ON ow.id = o.wife
+    WHERE oh.name_key = h.name_key AND oh.marriage_day = h.marriage_day AND ow.name_key = w.name_key
+    AND o.id != f.id) ORDER BY f.id""")
+def same_spouses_and_marriage(g, family):
+    same = g.duplicates.families.get(family_key(family.family, g.userdata), ())
+    if len(same) > 1:
+        g.report_error("ERROR: US24 FAMILY {} has the same spouse names and marriage date as FAMILY {}".format(
+            family.key, ", ".join(fam_id for fam_id in same if fam_id != family.key)), "UniqueFamiliesBySpouses",
+            [family.key] + [fam_id for fam_id in same if fam_id != family.key], [family.husband.marriage])
+
+
+@rule("US28", "family_list", needs=("ages", "siblings"))
+def order_siblings_by_age(g, keys):
+    age_list = []
+    for key in keys:
+        order = g.siblings[key].order
+        if order != list(g.familydata[key].chil or ()):
+            test_order = [g.userdata[child].age for child in g.familydata[key].chil]
+            g.report_error("ERROR: US28 Age of siblings are not in order  {}".format(test_order), "OrderSiblings",
+                           [key] + g.familydata[key].chil)
+        age_list.extend(g.userdata[child].age for child in order)
+    g.display("Display US28 List of Ordered Age of Siblings", age_list)
+
+
+@rule("US32", "family_list", needs=("siblings",))
+def list_multiple_births(g, keys):
+    multiple_births = [child for key in keys for group in g.siblings[key].births for child in group]
+    g.display("DISPLAY US32 LIST OF Multiple Births:", multiple_births)
 
 
 class TestCases(unittest.TestCase):
@@ -703,7 +4059,12 @@ class TestCases(unittest.TestCase):
         """
         Test if Children don't marry their parents
         """
-        self.assertNotEqual(self.errorlog["DescendantChildrenMarriage"], 0)
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.parse()
+        x.normalize_dates()
+        x.familydata["F99"].husb, x.familydata["F99"].wife = "ID08", "ID09"
+        error, errorlog = x.calc_data(families=["F99"], rules=[check for check in RULES if check.code == "US17"])
+        self.assertEqual(errorlog["DescendantChildrenMarriage"], 1)
 
     def test_birthbeforedeath(self):
         """
@@ -737,21 +4098,27 @@ class TestCases(unittest.TestCase):
 
     def test_singlelist(self):
         """
-        Test if single list is proper
+        Test if single list is proper, US31 lists the singles and reports no error
         """
-        self.assertNotEqual(self.errorlog["SingleList"], 0)
+        singles = [key for key in self.x.userdata if self.x.userdata[key].marriage is None]
+        self.assertNotEqual(singles, [])
+        self.assertEqual(self.errorlog["SingleList"], 0)
 
     def test_marriedlist(self):
         """
-        Test if married list is proper
+        Test if married list is proper, US30 lists the married people and reports no error
         """
-        self.assertNotEqual(self.errorlog["MarriedList"], 0)
+        married = [key for key in self.x.userdata if self.x.userdata[key].marriage is not None]
+        self.assertNotEqual(married, [])
+        self.assertEqual(self.errorlog["MarriedList"], 0)
 
     def test_DeceasedList(self):
         """
-        Test if Deceased List is proper
+        Test if Deceased List is proper, US29 lists the deceased and reports no error
         """
-        self.assertNotEqual(self.errorlog["DeceasedList"], 0)
+        deceased = [key for key in self.x.userdata if self.x.userdata[key].death is not None]
+        self.assertNotEqual(deceased, [])
+        self.assertEqual(self.errorlog["DeceasedList"], 0)
 
     def test_uniquenamebirthdate(self):
         """
@@ -761,9 +4128,11 @@ class TestCases(unittest.TestCase):
 
     def test_MultipleBirths(self):
         """
-        Test Multiple Births
+        Test Multiple Births, US32 lists them and reports no error
         """
-        self.assertNotEqual(self.errorlog["MultipleBirths"], 0)
+        births = [child for sweep in self.x.siblings.values() for group in sweep.births for child in group]
+        self.assertIn("ID16", births)
+        self.assertEqual(self.errorlog["MultipleBirths"], 0)
 
     def test_AgeDifference(self):
         """
@@ -778,14 +4147,1243 @@ class TestCases(unittest.TestCase):
         self.assertNotEqual(self.errorlog["OrderSiblings"], 0)
 
 
-def main():
-    file = input("Enter file name: \n")
-    pretty = input("Do you want pretty table? y/n \n")
+class TestStreaming(unittest.TestCase):
+
+    def test_streamMatchesReadlines(self):
+        """
+        Test if streaming ingestion parses the same data as readlines()
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.check_file(x.open_file())
+        y = Gedcom("SprintTestFile.ged", "n")
+        y.check_file(y.stream_file())
+        self.assertEqual(x.userdata, y.userdata)
+        self.assertEqual(x.familydata, y.familydata)
+        self.assertEqual(y.lines_read, len(x.open_file()))
+
+    def test_mmapMatchesReadlines(self):
+        """
+        Test if the byte level mmap tokenizer parses the same data as check_file
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.check_file(x.open_file())
+        y = Gedcom("SprintTestFile.ged", "n")
+        y.mmap_file()
+        self.assertEqual(x.userdata, y.userdata)
+        self.assertEqual(x.familydata, y.familydata)
+        self.assertEqual(x.errorlog, y.errorlog)
+
+    def test_parallelMatchesSerial(self):
+        """
+        Test if parsing chunks in a process pool gives the serial result, including repetitive IDs
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.mmap_file()
+        for workers in [2, 5]:
+            y = Gedcom("SprintTestFile.ged", "n")
+            y.parallel_file(workers)
+            self.assertEqual(x.userdata, y.userdata)
+            self.assertEqual(x.familydata, y.familydata)
+            self.assertEqual(x.errorlog, y.errorlog)
+            self.assertEqual(x.lines_read, y.lines_read)
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestColumns(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.x = Gedcom("SprintTestFile.ged", "n")
+        cls.x.check_file(cls.x.open_file())
+        cls.columns = cls.x.build_columns()
+
+    def test_denseIDs(self):
+        """
+        Test if every individual gets a dense row and its dates are day ordinals
+        """
+        self.assertEqual(len(self.columns), len(self.x.userdata))
+        row = self.columns.index["ID02"]
+        self.assertEqual(self.columns.ids[row], "ID02")
+        self.assertEqual(self.columns.birth[row], date(1962, 10, 6).toordinal())
+        self.assertEqual(self.columns.sex[row], SEX_CODES["F"])
+        self.assertEqual(self.columns.death[self.columns.index["ID01"]], NO_DATE)
+
+    def test_familyMembership(self):
+        """
+        Test if the children offsets and parent columns match familydata
+        """
+        family = self.columns.family_index["F15"]
+        children = self.columns.ids_where(self.columns.children_of(family))
+        self.assertEqual(children, self.x.familydata["F15"].chil)
+        child = self.columns.index[children[0]]
+        self.assertEqual(self.columns.ids[self.columns.father[child]], self.x.familydata["F15"].husb)
+        self.assertEqual(self.columns.ids[self.columns.mother[child]], self.x.familydata["F15"].wife)
+
+class TestDates(unittest.TestCase):
+
+    def test_normalizeDates(self):
+        """
+        Test if every stored date gets its day ordinal after parsing
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.check_file(x.open_file())
+        x.normalize_dates()
+        record = x.userdata["ID02"]
+        self.assertEqual(record.birth_day, date(1962, 10, 6).toordinal())
+        self.assertEqual(record.marriage_day, date(1984, 4, 30).toordinal())
+        self.assertEqual(record.death_day, NO_DATE)
+
+    def test_dateOrdinal(self):
+        """
+        Test if GEDCOM dates turn into ordinals and bad dates into NO_DATE
+        """
+        self.assertEqual(date_ordinal("05 DEC 2018"), date(2018, 12, 5).toordinal())
+        self.assertEqual(date_ordinal("31 FEB 2018"), NO_DATE)
+        self.assertEqual(date_ordinal(None), NO_DATE)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_snapshotReused(self):
+        """
+        Test if the second run loads the snapshot and finds the same errors
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        error, errorlog = x.analyze(cache_dir=self.cache_dir)
+        y = Gedcom("SprintTestFile.ged", "n")
+        self.assertEqual(y.analyze(cache_dir=self.cache_dir), (error, errorlog))
+        self.assertFalse(x.snapshot_loaded)
+        self.assertTrue(y.snapshot_loaded)
+        self.assertEqual(x.userdata, y.userdata)
+
+    def test_snapshotEviction(self):
+        """
+        Test if old snapshots are deleted once the cache is over its size
+        """
+        Gedcom("SprintTestFile.ged", "n").cached_parse(self.cache_dir, SNAPSHOT_CACHE_SIZE)
+        Gedcom("sangedcom.ged", "n").cached_parse(self.cache_dir, 1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_outdatedSnapshot(self):
+        """
+        Test if a snapshot written by another parser version is ignored
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.cached_parse(self.cache_dir, SNAPSHOT_CACHE_SIZE)
+        path = pathlib.Path(self.cache_dir, os.listdir(self.cache_dir)[0])
+        path.write_bytes(b"GEDSNAP 0\n" + path.read_bytes()[len(SNAPSHOT_MAGIC):])
+        y = Gedcom("SprintTestFile.ged", "n")
+        self.assertFalse(y.load_snapshot(path))
+        self.assertFalse(path.exists())
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_recordsUseSlots(self):
+        """
+        Test if parsed records are slot based Individual and Family objects
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.check_file(x.open_file())
+        self.assertIsInstance(x.userdata["ID01"], Individual)
+        self.assertIsInstance(x.familydata["F15"], Family)
+        self.assertFalse(hasattr(x.userdata["ID01"], "__dict__"))
+        self.assertEqual(x.userdata["ID01"].birth, "05 DEC 2018")
+        self.assertEqual(x.familydata["F15"].husb, "ID03")
+
+    def test_recordKeys(self):
+        """
+        Test if records can still be used with the GEDCOM style keys
+        """
+        record = Individual()
+        record["BIRTDATE"] = "1 JAN 2000"
+        record["BURIDATE"] = "2 JAN 2000"
+        self.assertEqual(record.birth, "1 JAN 2000")
+        self.assertIn("BURIDATE", record)
+        self.assertNotIn("DEATDATE", record)
+        self.assertEqual(record.keys(), ["BIRTDATE", "BURIDATE"])
+        with self.assertRaises(KeyError):
+            record["DEATDATE"]
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory, "edited.ged")
+        with open("SprintTestFile.ged") as ged:
+            self.text = ged.read()
+        self.text = self.text.replace("0 NOTE Sanjeev Rajasekaran\n", "0 NOTE Sanjeev Rajasekaran\n0 ID99 INDI\n"
+                                      "1 NAME Lone /Person/\n1 SEX M\n1 BIRT\n2 DATE 01 JAN 1950\n")
+        self.write(self.text)
+        self.x = Gedcom(self.file, "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.x.analyze()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        with open(self.file, "w") as ged:
+            ged.write(text)
+
+    def test_revalidateMatchesFullRun(self):
+        """
+        Test if the merged report of an edited file is the report of a full run
+        """
+        self.write(self.text.replace("2 DATE 05 DEC 2018", "2 DATE 05 DEC 2999").replace(
+            "0 F12 FAM\n1 HUSB ID10", "0 F12 FAM\n1 HUSB ID13"))
+        y = Gedcom(self.file, "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            merged = self.x.revalidate()
+            full = y.analyze()
+        self.assertEqual(merged, full)
+        self.assertEqual({scope: errors for scope, errors in self.x.anomalies.items() if errors},
+                         {scope: errors for scope, errors in y.anomalies.items() if errors})
+        self.assertIn("DateAfterCurrent", [category for category, message in self.x.anomalies["INDI", "ID01"]])
+
+    def test_revalidateOnlyNearRecords(self):
+        """
+        Test if editing an individual without family only checks that individual again
+        """
+        self.write(self.text.replace("2 DATE 01 JAN 1950", "2 DATE 01 JAN 1951"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.x.revalidate()
+        self.assertEqual(self.x.rechecked, ({"ID99"}, set()))
+
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open("SprintTestFile.ged", "rb") as ged:
+            self.data = ged.read()
+        self.expected = Gedcom("SprintTestFile.ged", "n").analyze()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compress(self, suffix):
+        file = os.path.join(self.directory, "SprintTestFile.ged" + suffix)
+        with DECOMPRESSORS[suffix](file, "wb") as ged:
+            ged.write(self.data)
+        return file
+
+    def test_compressedMatchesPlain(self):
+        """
+        Test if gzip, bz2 and xz files give the same errors as the plain file with both tokenizers
+        """
+        for suffix in DECOMPRESSORS:
+            for tokenizer in ("text", "mmap"):
+                x = Gedcom(self.compress(suffix), "n")
+                self.assertEqual(x.analyze(tokenizer=tokenizer), self.expected, (suffix, tokenizer))
+
+    def test_decompressedBlocks(self):
+        """
+        Test if the blocks end on line boundaries and add up to the whole file
+        """
+        blocks = list(decompressed_blocks(gzip.open(self.compress(".gz"), "rb"), block_size=100))
+        self.assertEqual(b"".join(blocks), self.data)
+        self.assertTrue(all(block.endswith(b"\n") for block in blocks[:-1]))
+
+    def test_brokenArchive(self):
+        """
+        Test if a broken archive raises in the parsing thread
+        """
+        file = self.compress(".gz")
+        with open(file, "r+b") as ged:
+            ged.truncate(os.path.getsize(file) // 2)
+        with self.assertRaises(EOFError):
+            list(decompressed_blocks(gzip.open(file, "rb")))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = ["SprintTestFile.ged", "sangedcom.ged", "proj04testCorrectGender.ged"]
+        for file in self.files:
+            shutil.copy(file, self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batchMatchesSingleRuns(self):
+        """
+        Test if the batch results and the merged errorlog match running each file on its own
+        """
+        files = batch_files(self.directory)
+        summary = analyze_batch(files, workers=2)
+        self.assertEqual([result["file"] for result in summary["files"]], files)
+        merged = defaultdict(int)
+        for file, result in zip(files, summary["files"]):
+            error, errorlog = Gedcom(file, "n").analyze()
+            self.assertEqual((result["error"], result["errorlog"]), (error, dict(errorlog)))
+            for key, count in errorlog.items():
+                merged[key] += count
+        self.assertEqual(summary["errorlog"], merged)
+        self.assertIn(("FAM", "F21", "ProperGender",
+                       "ERROR: US21 INDIVIDUAL ID31 Keerthi and INDIVIDUAL ID32 Sarath are of same gender but have married"),
+                      summary["files"][files.index(os.path.join(self.directory, "SprintTestFile.ged"))]["anomalies"])
+
+    def test_manifest(self):
+        """
+        Test if a manifest is read relative to itself and a missing file is reported instead of stopping the batch
+        """
+        manifest = os.path.join(self.directory, "nightly.txt")
+        with open(manifest, "w") as names:
+            names.write("# nightly run\nsangedcom.ged\n  # indented comment\nmissing.ged\n")
+        summary = analyze_batch(batch_files(manifest), workers=1)
+        self.assertEqual(len(summary["files"]), 2)
+        self.assertEqual(summary["files"][0]["error"], "No errors found")
+        self.assertIn("missing.ged Not found", summary["files"][1]["error"])
+
+
+class TestRules(unittest.TestCase):
+
+    def test_rulePlan(self):
+        """
+        Test if consecutive child rules are nested in one loop over the children, in registration order
+        """
+        plan = rule_plan(RULES)
+        self.assertEqual([step.code for step in plan if isinstance(step, Rule)],
+                         ["US17", "US15", "MARR", "US25", "US19", "US20", "US13", "US14", "US34", "US04", "US06", "US18",
+                          "US21", "US24"])
+        children = [step for step in plan if not isinstance(step, Rule)]
+        self.assertEqual(len(children), 1)
+        self.assertEqual([check.code for check in children[0]],
+                         ["US12", "US12", "US25", "US08", "US09", "US16"])
+
+    def test_selectedRules(self):
+        """
+        Test if running some rules only reports their errors and only times those rules
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.parse()
+        x.normalize_dates()
+        x.rule_seconds = defaultdict(float)
+        error, errorlog = x.calc_data(rules=[check for check in RULES if check.code in ("US15", "US34")])
+        self.assertEqual(dict(errorlog), {"RepetitiveID": 1, "SiblingGreaterThan15": 1, "AgeDiffrence": 1})
+        self.assertEqual(set(x.rule_seconds), {"US15", "US34"})
+
+    def test_allRulesMatchFullRun(self):
+        """
+        Test if the errors filed by scope add up to the errorlog
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        error, errorlog = x.analyze()
+        counted = defaultdict(int, {"RepetitiveID": 1})
+        for errors in x.anomalies.values():
+            for category, message in errors:
+                if category is not None:
+                    counted[category] += 1
+        self.assertEqual(counted, errorlog)
+
+
+class TestSelection(unittest.TestCase):
+
+    def test_selectedStories(self):
+        """
+        Test if selecting user stories only reports their errors and skips the tables and unneeded indexes
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        error, errorlog = x.analyze(rules=["US01", "US03", "US22"])
+        self.assertEqual(dict(errorlog), {"RepetitiveID": 1, "DeathBeforeBirth": 5})
+        self.assertIsNone(x.kinship)
+        self.assertIsNone(x.userdata["ID01"].age)
+        self.assertEqual(len(x.ptUsers.rows), 0)
+        self.assertRaises(ValueError, Gedcom("SprintTestFile.ged", "n").analyze, rules=["US99"])
+
+    def test_marriageGate(self):
+        """
+        Test if a selected child rule stops at a family without a marriage date like a full run does
+        """
+        self.assertEqual([check.code for check in select_rules(["US08"])], ["MARR", "US08"])
+        self.assertEqual([check.code for check in select_rules(["US01"])], ["US01", "US01", "US01", "US01"])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file = os.path.join(directory, "unmarried.ged")
+        with open(file, "w") as ged:
+            ged.write("0 I1 INDI\n1 NAME Al /Bo/\n1 SEX M\n1 BIRT\n2 DATE 01 JAN 1950\n1 FAMS F1\n"
+                      "0 I2 INDI\n1 NAME Cy /Bo/\n1 SEX F\n1 BIRT\n2 DATE 01 JAN 1952\n1 FAMS F1\n"
+                      "0 I3 INDI\n1 NAME Di /Bo/\n1 SEX M\n1 BIRT\n2 DATE 01 JAN 1980\n1 FAMC F1\n"
+                      "0 F1 FAM\n1 HUSB I1\n1 WIFE I2\n1 CHIL I3\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            full = Gedcom(file, "n").analyze()
+            selected = Gedcom(file, "n").analyze(rules=["US08"])
+        self.assertEqual(full[0], "No Marriage date found")
+        self.assertEqual(selected, full)
+        self.assertEqual(dict(selected[1]), {})
+
+    def test_maxErrors(self):
+        """
+        Test if the checks stop once the limit is reached, parse errors included
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        error, errorlog = x.analyze(max_errors=4)
+        self.assertEqual(error, "Stopped after 4 errors")
+        self.assertEqual(sum(len(errors) for errors in x.anomalies.values()), 3)
+        x = Gedcom("SprintTestFile.ged", "n")
+        error, errorlog = x.analyze(max_errors=1)
+        self.assertEqual(error, "Stopped after 1 errors")
+        self.assertEqual(dict(errorlog), {"RepetitiveID": 1})
+
+
+class TestParallelChecks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_checks(self, path, workers):
+        x = Gedcom(path, "n")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            error, errorlog = x.analyze(check_workers=workers)
+        return error, x.stopped_at, output.getvalue(), dict(errorlog), dict(x.anomalies), x.ptFamily.rows
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs forked processes")
+    def test_matchesSerialRun(self):
+        """
+        Test if checking ranges of the tree in worker processes prints and logs the errors of a serial run in order
+        """
+        self.assertEqual(self.run_checks("SprintTestFile.ged", 3), self.run_checks("SprintTestFile.ged", 1))
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs forked processes")
+    def test_stopMatchesSerialRun(self):
+        """
+        Test if a family rule stopping the checks in a worker stops them at the family of a serial run
+        """
+        path = os.path.join(self.directory, "stop.ged")
+        with open("SprintTestFile.ged") as ged:
+            text = ged.read()
+        with open(path, "w") as ged:
+            ged.write(text.replace("1 FAMS F17\n1 MARR \n2 DATE 30 APR 2010\n", "1 FAMS F17\n"))
+        serial = self.run_checks(path, 1)
+        self.assertEqual(serial[:2], ("No Marriage date found", "F17"))
+        self.assertEqual(self.run_checks(path, 3), serial)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix domain sockets")
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket = os.path.join(self.directory, "daemon.sock")
+        self.file = os.path.join(self.directory, "tree.ged")
+        shutil.copy("SprintTestFile.ged", self.file)
+        self.daemon = ValidationDaemon(self.socket)
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        daemon_request(self.socket, {"op": "shutdown"})
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_validateFromMemory(self):
+        """
+        Test if an unchanged file is answered from memory and an edited one is revalidated to the full run's report
+        """
+        first = daemon_request(self.socket, {"op": "validate", "file": self.file})
+        self.assertEqual(first["how"], "parsed")
+        second = daemon_request(self.socket, {"op": "validate", "file": self.file})
+        self.assertEqual(second["how"], "memory")
+        self.assertEqual(second["anomalies"], first["anomalies"])
+        with open(self.file) as ged:
+            text = ged.read()
+        with open(self.file, "w") as ged:
+            ged.write(text.replace("2 DATE 05 DEC 2018", "2 DATE 05 DEC 2090", 1))
+        edited = daemon_request(self.socket, {"op": "validate", "file": self.file})
+        self.assertEqual(edited["how"], "revalidated")
+        x = Gedcom(self.file, "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            error, errorlog = x.analyze()
+        self.assertEqual(edited["errorlog"], dict(errorlog))
+        self.assertEqual(sorted(map(tuple, edited["anomalies"]), key=str), sorted(anomaly_list(x), key=str))
+
+    def test_lookupAndEviction(self):
+        """
+        Test if records are looked up in the tree held in memory and the least recently used tree is evicted
+        """
+        found = daemon_request(self.socket, {"op": "lookup", "file": self.file, "id": "ID01"})
+        self.assertEqual((found["kind"], found["record"]["NAME"]), ("INDI", "Sanjeev /Rajasekaran/"))
+        self.assertFalse(daemon_request(self.socket, {"op": "lookup", "file": self.file, "id": "ID999"})["ok"])
+        self.daemon.max_bytes = daemon_request(self.socket, {"op": "stats"})["bytes"]
+        other = os.path.abspath("proj04testsiblingsmarriage.ged")
+        daemon_request(self.socket, {"op": "validate", "file": other})
+        files = [file for file, size in daemon_request(self.socket, {"op": "stats"})["files"]]
+        self.assertEqual(files, [other])
+
+
+class TestSampling(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.full = Gedcom("SprintTestFile.ged", "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.full.analyze()
+
+    def sample(self, path, size, seed):
+        x = Gedcom(path, "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            x.analyze(sample=size, seed=seed)
+        return x
+
+    def test_sampleMatchesFullRun(self):
+        """
+        Test if a sample is reproducible and its records get the errors of a full run, US23 and US24 left out
+        """
+        x = self.sample("SprintTestFile.ged", 10, 7)
+        self.assertEqual(len(x.sample.people), 10)
+        self.assertLess(len(x.userdata), len(self.full.userdata))
+        self.assertEqual(x.sample.people, self.sample("SprintTestFile.ged", 10, 7).sample.people)
+        self.assertNotEqual(x.sample.people, self.sample("SprintTestFile.ged", 10, 8).sample.people)
+        whole_tree = {"UniqueNameBirthDate", "UniqueFamiliesBySpouses"}
+        for kind, keys in (("INDI", x.sample.people), ("FAM", x.sample.families)):
+            for key in keys:
+                expected = [error for error in self.full.anomalies.get((kind, key), []) if error[0] not in whole_tree]
+                self.assertEqual(x.anomalies.get((kind, key), []), expected)
+
+    def test_estimates(self):
+        """
+        Test if sampling every record estimates the exact counts and a sample without errors still has an interval
+        """
+        x = self.sample("SprintTestFile.ged", 1000, 0)
+        estimates = {estimate["category"]: estimate for estimate in x.estimates}
+        self.assertEqual(estimates["DeathBeforeBirth"]["estimated"], self.full.errorlog["DeathBeforeBirth"])
+        self.assertEqual(estimates["DeathBeforeBirth"]["low"], estimates["DeathBeforeBirth"]["high"])
+        self.assertNotIn("UniqueNameBirthDate", estimates)
+        low, high = wilson_interval(0, 100, 10000)
+        self.assertAlmostEqual(low, 0)
+        self.assertTrue(0.02 < high < 0.05)
+
+    def test_stopIsCounted(self):
+        """
+        Test if a family without a marriage date is counted and the families after it are still checked
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stop.ged")
+            with open("SprintTestFile.ged") as ged:
+                text = ged.read()
+            with open(path, "w") as ged:
+                ged.write(text.replace("1 FAMS F17\n1 MARR \n2 DATE 30 APR 2010\n", "1 FAMS F17\n"))
+            x = self.sample(path, 1000, 0)
+        finally:
+            shutil.rmtree(directory)
+        estimates = {estimate["category"]: estimate for estimate in x.estimates}
+        self.assertEqual(estimates["No Marriage date found"]["records"], 1)
+        self.assertTrue(any(kind == "FAM" and key > "F17" for kind, key in x.anomalies))
+
+
+class TestStreamingTables(unittest.TestCase):
+
+    def run_pretty(self, **table_options):
+        x = Gedcom("SprintTestFile.ged", "y")
+        for name, value in table_options.items():
+            setattr(x, name, value)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            x.analyze()
+        return x, output.getvalue()
+
+    def test_matchesPrettyTable(self):
+        """
+        Test if streamed tables print what the PrettyTables print without keeping any row
+        """
+        x, streamed = self.run_pretty(table_stream=True)
+        self.assertEqual(streamed, self.run_pretty()[1])
+        self.assertEqual(len(x.ptUsers.rows), 0)
+
+    def test_widthsAndPaging(self):
+        """
+        Test if fixed widths cut longer cells and only the rows of the page are printed
+        """
+        output = io.StringIO()
+        table = StreamingTable(["ID", "NAME"], {"NAME": 6}, prefix=1)
+        self.assertEqual(table.write([["I1", "Al"], ["I22", "Bartholomew"]], output), 2)
+        self.assertEqual(output.getvalue().splitlines()[3:5], ["| I1 |   Al   |", "| I2 | Bar... |"])
+        x, streamed = self.run_pretty(table_stream=True, table_limit=2, table_offset=1)
+        self.assertIn("| ID02 |", streamed)
+        self.assertNotIn("| ID01 |", streamed)
+        self.assertNotIn("| ID04 |", streamed)
+        self.assertIn("Showing 2 of 41 rows from row 2", streamed)
+
+
+class TestAnomalySinks(unittest.TestCase):
+
+    def run_sinks(self, **options):
+        x = Gedcom("SprintTestFile.ged", "n")
+        found = ListSink()
+        lines = io.StringIO()
+        x.sinks = [found, JsonLinesSink(lines)]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            x.analyze(**options)
+        return x, found.anomalies, lines.getvalue().splitlines(), output.getvalue()
+
+    def test_structuredRecords(self):
+        """
+        Test if every reported error reaches the sinks with its rule, records and dates, and is no longer printed
+        """
+        x, anomalies, lines, output = self.run_sinks()
+        self.assertEqual(len(anomalies), sum(len(errors) for errors in x.anomalies.values()))
+        self.assertEqual([json.loads(line) for line in lines], [anomaly.as_dict() for anomaly in anomalies])
+        self.assertNotIn("ERROR: US08", output)
+        late = [anomaly for anomaly in anomalies if anomaly.category == "ChildBirthBeforeParentsMarriage"][0]
+        self.assertEqual((late.rule, late.severity, late.kind), ("US08", "error", "FAM"))
+        self.assertEqual(late.records[0], late.key)
+        self.assertEqual(len(late.dates), 2)
+        self.assertEqual({anomaly.severity for anomaly in anomalies if anomaly.rule == "US19"}, {"warning"})
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs forked processes")
+    def test_parallelOrder(self):
+        """
+        Test if the anomalies of checks run in worker processes reach the sinks in the order of a serial run
+        """
+        serial = self.run_sinks()[2]
+        self.assertEqual(self.run_sinks(check_workers=3)[2], serial)
+
+    def test_textBatches(self):
+        """
+        Test if the text sink writes its lines once a batch is full or it is flushed
+        """
+        out = io.StringIO()
+        sink = TextSink(out, batch=2)
+        for message in ["first", "second", "third"]:
+            sink.write(Anomaly("US01", "INDI", "I1", ["I1"], [], "DateAfterCurrent", message))
+        self.assertEqual(out.getvalue(), "first\nsecond\n")
+        sink.flush()
+        self.assertEqual(out.getvalue(), "first\nsecond\nthird\n")
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.x = Gedcom("SprintTestFile.ged", "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.x.analyze()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_columnsRoundTrip(self):
+        """
+        Test if the column files read back the exported rows in row groups of the requested size
+        """
+        self.x.export(self.directory, row_group=7)
+        groups = list(read_column_file(os.path.join(self.directory, "individuals.gedcol")))
+        self.assertEqual([len(group["id"]) for group in groups][:2], [7, 7])
+        rows = [tuple(group[name][index] for name, kind in INDIVIDUAL_EXPORT)
+                for group in groups for index in range(len(group["id"]))]
+        self.assertEqual(rows, list(self.x.export_individuals()))
+        self.assertEqual(rows[1][:5], ("ID02", "Shanthi", "Rajasekaran", "F", date(1962, 10, 6).toordinal() - EPOCH_ORDINAL))
+        families = [row for group in read_column_file(os.path.join(self.directory, "families.gedcol"))
+                    for row in zip(*(group[name] for name, kind in FAMILY_EXPORT))]
+        self.assertEqual(families, list(self.x.export_families()))
+
+    def test_csv(self):
+        """
+        Test if the CSV fallback writes a header and ISO dates, booleans and joined children
+        """
+        self.x.export(self.directory, "csv")
+        with open(os.path.join(self.directory, "individuals.csv"), newline="") as individuals:
+            rows = list(csv.reader(individuals))
+        self.assertEqual(rows[0], [name for name, kind in INDIVIDUAL_EXPORT])
+        self.assertEqual(rows[2][:6], ["ID02", "Shanthi", "Rajasekaran", "F", "1962-10-06", ""])
+        self.assertEqual(rows[2][9], "true")
+        with open(os.path.join(self.directory, "families.csv"), newline="") as families:
+            children = [row[5] for row in csv.reader(families)]
+        self.assertTrue(any(";" in cell for cell in children))
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "tree.db")
+        # every rule a store runs, US28 and US32 only run with the pretty tables
+        self.codes = sorted({check.code for check in RULES if check.query is not None or
+                             set(check.needs) <= set(STORE_INDEXES)} - {"US28", "US32"})
+        self.stores = []
+
+    def tearDown(self):
+        for x in self.stores:
+            x.store.close()
+        shutil.rmtree(self.directory)
+
+    def run_both(self, file, batch=STORE_BATCH):
+        x, y = Gedcom(file, "n"), Gedcom(file, "n")
+        y.store_batch = batch
+        memory, stored = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(memory):
+            expected = x.analyze(rules=self.codes)
+        with contextlib.redirect_stdout(stored):
+            result = y.analyze(rules=self.codes, store=self.database)
+        self.stores.append(y)
+        return x, y, expected, result, memory.getvalue(), stored.getvalue()
+
+    def test_matchesInMemory(self):
+        """
+        Test if checking from the store reports the errors of a run in memory, with batches small enough that family
+        dates change records already written
+        """
+        x, y, expected, result, memory, stored = self.run_both("SprintTestFile.ged", batch=3)
+        self.assertEqual(result, expected)
+        self.assertEqual(sorted(map(str, y.anomalies.items())), sorted(map(str, x.anomalies.items())))
+        self.assertIn("US23", stored)
+        self.assertIn("US18", stored)
+        self.assertLess(len(y.userdata), len(x.userdata))
+
+    def test_reused(self):
+        """
+        Test if a second run checks the database without parsing the file again, and an edited file is loaded again
+        """
+        x, y, expected, result, memory, stored = self.run_both("SprintTestFile.ged")
+        self.assertIn("Parsed 402 lines", stored)
+        z = Gedcom("SprintTestFile.ged", "n")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(z.analyze(rules=self.codes, store=self.database), expected)
+        self.stores.append(z)
+        self.assertNotIn("Parsed", output.getvalue())
+        self.assertEqual(z.lines_read, 402)
+        file = os.path.join(self.directory, "edited.ged")
+        with open("SprintTestFile.ged") as ged, open(file, "w") as edited:
+            edited.write(ged.read().replace("2 DATE 05 DEC 2018", "2 DATE 05 DEC 3018"))
+        x, y, expected, result, memory, stored = self.run_both(file)
+        self.assertIn("Parsed 402 lines", stored)
+        self.assertEqual(result, expected)
+
+    def test_repeatedIds(self):
+        """
+        Test if the query of US22 finds the IDs repeated in the file and the families checked stop where they do in
+        memory
+        """
+        file = os.path.join(self.directory, "repeated.ged")
+        with open("SprintTestFile.ged") as ged, open(file, "w") as edited:
+            edited.write(ged.read().replace("0 NOTE Sanjeev Rajasekaran\n", "0 NOTE Sanjeev Rajasekaran\n0 ID02 INDI\n"
+                                            "1 NAME Again /Person/\n1 SEX F\n1 BIRT\n2 DATE 01 JAN 1950\n0 F99 FAM\n"
+                                            "1 HUSB ID01\n1 WIFE ID02\n"))
+        x, y, expected, result, memory, stored = self.run_both(file, batch=2)
+        self.assertEqual(result, expected)
+        self.assertEqual(result[0], "No Marriage date found")
+        self.assertIn("ERROR: US22 INDIVIDUAL ID02 has a repetitive ID", stored)
+        self.assertEqual(y.userdata["ID02"].name, x.userdata["ID02"].name)
+        self.assertEqual(sorted(map(str, y.anomalies.items())), sorted(map(str, x.anomalies.items())))
+
+
+class TestSiblings(unittest.TestCase):
+
+    def test_sweep(self):
+        """
+        Test if one sweep over the sorted births finds the birth order, bad spacings and multiple births
+        """
+        userdata = defaultdict(Individual)
+        start = date(2000, 1, 1).toordinal()
+        for child, day in [("C1", 400), ("C2", 0), ("C3", 1), ("C4", 100), ("C5", 401), ("C6", 0)]:
+            userdata[child].birth_day = start + day
+        sweep = SiblingSweep(userdata, ["C1", "C2", "C3", "C4", "C5", "C6"])
+        self.assertEqual(sweep.order, ["C2", "C6", "C3", "C4", "C1", "C5"])
+        self.assertEqual(sweep.spacing, [("C3", "C4")])
+        self.assertEqual(sweep.births, [["C2", "C6", "C3"], ["C1", "C5"]])
+
+    def test_largeFamily(self):
+        """
+        Test if a family of hundreds of sextuplets is reported once for US14 and once per bad spacing for US13
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.parse()
+        x.normalize_dates()
+        key = sorted(x.familydata)[0]
+        children = ["@S{}@".format(i) for i in range(600)]
+        start = date(1990, 1, 1).toordinal()
+        for i, child in enumerate(children):
+            x.userdata[child].birth_day = start + (i // 6) * 300
+        x.familydata[key].chil = children
+        x.sort_siblings()
+        self.assertEqual(len(x.siblings[key].births), 100)
+        self.assertEqual(x.siblings[key].spacing, [])
+        for i, child in enumerate(children):
+            x.userdata[child].birth_day = start + i * 100
+        x.sort_siblings()
+        self.assertEqual(len(x.siblings[key].spacing), 599)
+
+    def test_listMultipleBirths(self):
+        """
+        Test if the list rules print the pretty tables of short files without crashing or reporting errors
+        """
+        for filename in ["proj06testsiblingsgreaterthan5.ged", "proj04testUniqueID.ged",
+                         "proj03testAgeLessOneFifty.ged", "sangedcom.ged"]:
+            with self.subTest(filename=filename):
+                x = Gedcom(filename, "y")
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    error, errorlog = x.analyze()
+                self.assertIn("DISPLAY US32 LIST OF Multiple Births: []", output.getvalue())
+                self.assertIn("DISPLAY US31 LIST OF SINGLES:", output.getvalue())
+                for category in ["SingleList", "DeceasedList", "MarriedList", "MultipleBirths"]:
+                    self.assertEqual(errorlog[category], 0)
+
+
+class TestDuplicates(unittest.TestCase):
+
+    def test_groups(self):
+        """
+        Test if every individual of a group with the same normalized name and birth date is found
+        """
+        userdata = defaultdict(Individual)
+        for key, name, day in [("I1", "Ann /Lee/", 1000), ("I2", "ann  /LEE/", 1000), ("I3", "Ann /Lee/", 1001),
+                               ("I4", "Ann /Lee/ ", 1000), ("I5", "Bo /Lee/", 5), ("I6", "Bo /Lee/", 5)]:
+            userdata[key].name, userdata[key].birth_day = name, day
+        people, families = DuplicateIndex(userdata, defaultdict(Family)).groups()
+        self.assertEqual(people, [["I1", "I2", "I4"], ["I5", "I6"]])
+        self.assertEqual(families, [])
+
+    def test_familiesBySpouses(self):
+        """
+        Test if both families with the same spouse names and marriage date are reported
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.parse()
+        x.normalize_dates()
+        key = sorted(x.familydata)[0]
+        x.familydata["F99"].husb, x.familydata["F99"].wife = x.familydata[key].husb, x.familydata[key].wife
+        error, errorlog = x.calc_data(families=[key, "F99"], rules=[check for check in RULES if check.code == "US24"])
+        self.assertEqual(errorlog["UniqueFamiliesBySpouses"], 2)
+
+
+class TestBigamy(unittest.TestCase):
+
+    def test_sweep(self):
+        """
+        Test if only marriages starting before an earlier one ended overlap, in any order
+        """
+        self.assertEqual(overlapping_marriages([(10, 20), (20, 30), (30, OPEN_MARRIAGE)]), [])
+        self.assertEqual(overlapping_marriages([(40, 50), (10, OPEN_MARRIAGE), (60, 70), (5, 8)]), [0, 2])
+        self.assertEqual(overlapping_marriages([(10, 5), (7, 12)]), [])
+
+    def test_spouseDeathEndsMarriage(self):
+        """
+        Test if marrying again after the spouse died is not bigamy, and marrying again before it is
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        x.parse()
+        for key, death in [("B1", None), ("S1", "01 JAN 1955"), ("S2", None)]:
+            x.userdata[key].name, x.userdata[key].birth, x.userdata[key].death = "B /One/", "01 JAN 1930", death
+        for fam_id, wife, marriage in [("FB1", "S1", "01 JAN 1950"), ("FB2", "S2", "01 JAN 1960")]:
+            x.familydata[fam_id].husb, x.familydata[fam_id].wife = "B1", wife
+            x.userdata["B1"].add_marriage(marriage, fam_id)
+        x.normalize_dates()
+        rules = [check for check in RULES if check.code == "US11"]
+        error, errorlog = x.calc_data(individuals=["B1"], families=[], rules=rules)
+        self.assertEqual(errorlog["Bigamy"], 0)
+        x.userdata["S1"].death_day = date(1965, 1, 1).toordinal()
+        error, errorlog = x.calc_data(individuals=["B1"], families=[], rules=rules)
+        self.assertEqual(errorlog["Bigamy"], 1)
+
+    def test_crossChunkDivorce(self):
+        """
+        Test if a FAM divorce parsed in another chunk than the spouse's marriage ends it like a serial parse does
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file = os.path.join(directory, "divorced.ged")
+        with open(file, "w") as ged:
+            ged.write("0 H INDI\n1 NAME Hal /Bo/\n1 SEX M\n1 BIRT\n2 DATE 01 JAN 1950\n"
+                      "1 FAMS F1\n1 MARR\n2 DATE 01 JAN 1975\n1 FAMS F2\n1 MARR\n2 DATE 01 JAN 1990\n"
+                      "0 W1 INDI\n1 NAME Ann /Bo/\n1 SEX F\n1 BIRT\n2 DATE 01 JAN 1952\n1 FAMS F1\n"
+                      "0 W2 INDI\n1 NAME Bea /Bo/\n1 SEX F\n1 BIRT\n2 DATE 01 JAN 1960\n1 FAMS F2\n")
+            for i in range(400):  # puts the families in a later chunk than H
+                ged.write("0 P{0} INDI\n1 NAME Pad{0} /Bo/\n1 SEX M\n1 BIRT\n2 DATE 01 JAN 1900\n".format(i))
+            ged.write("0 F1 FAM\n1 HUSB H\n1 WIFE W1\n1 DIV\n2 DATE 01 JAN 1980\n"
+                      "0 F2 FAM\n1 HUSB H\n1 WIFE W2\n")
+        x, y = Gedcom(file, "n"), Gedcom(file, "n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial = x.analyze()
+            parallel = y.analyze(workers=4)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[1]["Bigamy"], 0)
+        self.assertEqual(y.userdata["H"].marriages, x.userdata["H"].marriages)
+        self.assertEqual(y.userdata["H"].marriages[0], ["01 JAN 1975", "01 JAN 1980", "F1"])
+
+
+class TestKinship(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Three generations: G1 and G2 have A and B, A has C with S1, B has D with S2, C has E with D
+        """
+        cls.userdata = defaultdict(Individual)
+        cls.familydata = defaultdict(Family)
+        for fam_id, husb, wife, children in [("F1", "G1", "G2", ["A", "B"]), ("F2", "A", "S1", ["C"]),
+                                             ("F3", "S2", "B", ["D"]), ("F4", "C", "D", ["E"])]:
+            cls.familydata[fam_id].husb, cls.familydata[fam_id].wife = husb, wife
+            cls.familydata[fam_id].chil = children
+            for child in children:
+                cls.userdata[child].famc = fam_id
+            for spouse in (husb, wife):
+                cls.userdata[spouse].fams = fam_id
+        cls.kinship = Kinship(cls.userdata, cls.familydata)
+
+    def test_ancestry(self):
+        """
+        Test if every individual has the ancestors of all its known lines and the generation of the longest
+        """
+        for ancestor in ["C", "D", "A", "B", "S1", "S2", "G1", "G2"]:
+            self.assertTrue(self.kinship.is_ancestor(ancestor, "E"))
+        self.assertFalse(self.kinship.is_ancestor("B", "C"))
+        self.assertEqual([self.kinship.generation[key] for key in ["G1", "S2", "B", "D", "E"]], [0, 0, 1, 2, 3])
+
+    def test_memoryBudget(self):
+        """
+        Test if a large collapsed pedigree is checked within the memory of the memoized walks and answers as
+        unmemoized walks do
+        """
+        rng = random.Random(1)
+        userdata, familydata = defaultdict(Individual), defaultdict(Family)
+        generation = ["G0_{}".format(i) for i in range(200)]
+        for key in generation:
+            userdata[key].famc = None
+        for level in range(1, 40):
+            parents, generation = generation, []
+            for i in range(200):
+                key, fam_id = "G{}_{}".format(level, i), "F{}_{}".format(level, i)
+                familydata[fam_id].husb, familydata[fam_id].wife = rng.choice(parents), rng.choice(parents)
+                userdata[key].famc = fam_id
+                generation.append(key)
+        pairs = [(rng.choice(list(userdata)), key) for key in generation for _ in range(3)]
+        kinship = Kinship(userdata, familydata, memo_size=1 << 12)
+        tracemalloc.start()
+        found = [kinship.is_ancestor(ancestor, key) for ancestor, key in pairs]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLessEqual(kinship.memo_used, 1 << 12)
+        self.assertLess(peak, 1 << 21)
+        walked = Kinship(userdata, familydata, memo_size=0)
+        self.assertEqual(found, [walked.is_ancestor(ancestor, key) for ancestor, key in pairs])
+
+    def test_ancestryLoop(self):
+        """
+        Test if a loop in the parents ends instead of recursing forever
+        """
+        userdata, familydata = defaultdict(Individual), defaultdict(Family)
+        familydata["F1"].husb, familydata["F2"].husb = "B", "A"
+        userdata["A"].famc, userdata["B"].famc = "F1", "F2"
+        kinship = Kinship(userdata, familydata)
+        self.assertTrue(kinship.is_ancestor("B", "A"))
+        self.assertTrue(kinship.is_ancestor("A", "B"))
+
+    def test_relations(self):
+        """
+        Test if ancestors, siblings, cousins and aunts are told apart
+        """
+        self.assertTrue(self.kinship.is_ancestor("G2", "E"))
+        self.assertFalse(self.kinship.is_ancestor("E", "G2"))
+        self.assertFalse(self.kinship.is_ancestor("S2", "C"))
+        self.assertTrue(self.kinship.are_siblings("A", "B"))
+        self.assertFalse(self.kinship.are_cousins("A", "B"))
+        self.assertTrue(self.kinship.are_cousins("C", "D"))
+        self.assertTrue(self.kinship.is_aunt_or_uncle("B", "C"))
+        self.assertFalse(self.kinship.is_aunt_or_uncle("A", "C"))
+
+    def test_descendantFamilies(self):
+        """
+        Test if editing an individual reaches the families its descendants married into
+        """
+        tree = (self.userdata, self.familydata) + relative_index(self.userdata, self.familydata)
+        self.assertEqual(descendant_families([tree], ["B"], []), {"F3", "F4"})
+        self.assertEqual(descendant_families([tree], [], ["F2"]), {"F4"})
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestTraversal(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.x = Gedcom("SprintTestFile.ged", "n")
+        cls.x.parse()
+
+    def test_descendants(self):
+        """
+        Test if descendants are found generation by generation or depth first
+        """
+        self.assertEqual(self.x.descendants("ID08"), [("ID09", 1), ("ID10", 1), ("ID11", 2)])
+        self.assertEqual(self.x.descendants("ID08", order="dfs"), [("ID09", 1), ("ID11", 2), ("ID10", 1)])
+        self.assertEqual(self.x.descendants("ID08", generations=1), [("ID09", 1), ("ID10", 1)])
+
+    def test_ancestorsAndSpouses(self):
+        """
+        Test if ancestors and spouses follow the families in both directions
+        """
+        self.assertEqual(self.x.ancestors("ID01"), [("ID02", 1), ("ID03", 1), ("ID05", 2), ("ID06", 2)])
+        self.assertEqual(self.x.ancestors("ID01", generations=1), [("ID02", 1), ("ID03", 1)])
+        self.assertEqual(self.x.spouses("ID31"), ["ID32"])
+        self.assertRaises(KeyError, self.x.ancestors, "ID99")
+        self.assertRaises(ValueError, self.x.traverse, "ID01", "cousins")
+
+    def test_deepTree(self):
+        """
+        Test if a line of thousands of generations is walked without recursion
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        for generation in range(3000):
+            family = x.familydata["F{}".format(generation)]
+            family.husb, family.chil = "I{}".format(generation), ["I{}".format(generation + 1)]
+            x.userdata["I{}".format(generation)].fams = "F{}".format(generation)
+            x.userdata["I{}".format(generation + 1)].famc = "F{}".format(generation)
+        self.assertEqual(len(x.descendants("I0", order="dfs")), 3000)
+        self.assertEqual(x.ancestors("I3000")[-1], ("I0", 3000))
+
+    def test_pedigreeCollapse(self):
+        """
+        Test if a depth first walk reaches an ancestor at its nearest generation when a longer line is walked first,
+        and keeps the ancestors above it within the limit
+        """
+        x = Gedcom("SprintTestFile.ged", "n")
+        # X has parents A and B, A descends from C through D, B is a child of C, C is a child of E
+        for fam_id, husb, wife, child in [("FX", "A", "B", "X"), ("FA", "D", None, "A"), ("FD", "C", None, "D"),
+                                          ("FB", "C", None, "B"), ("FC", "E", None, "C")]:
+            family = x.familydata[fam_id]
+            family.husb, family.wife, family.chil = husb, wife, [child]
+            x.userdata[child].famc = fam_id
+            for spouse in (husb, wife):
+                if spouse is not None:
+                    x.userdata[spouse].fams = fam_id
+        nearest = x.ancestors("X", generations=3)
+        self.assertEqual(sorted(nearest), [("A", 1), ("B", 1), ("C", 2), ("D", 2), ("E", 3)])
+        self.assertEqual(x.ancestors("X", generations=3, order="dfs"), [("A", 1), ("D", 2), ("B", 1), ("C", 2),
+                                                                        ("E", 3)])
+        self.assertEqual(sorted(x.ancestors("X", order="dfs")), sorted(x.ancestors("X")))
+
+    def test_preorder(self):
+        """
+        Test if the depth first walk of a generated graph visits every row of the breadth first one once, each after
+        a row one generation above it that links to it
+        """
+        rng = np.random.default_rng(1)
+        offsets, targets = csr(2000, rng.integers(0, 2000, 6000), rng.integers(0, 2000, 6000))
+        links = TreeLinks.__new__(TreeLinks)
+        for generations in [None, 4]:
+            rows, levels = links.depth_first(offsets, targets, 0, generations)
+            nearest = dict(zip(*[array.tolist() for array in links.breadth_first(offsets, targets, 0, generations)]))
+            self.assertEqual(dict(zip(rows.tolist(), levels.tolist())), nearest)
+            self.assertEqual(len(rows), len(nearest))
+            above = {0: 0}
+            for row, level in zip(rows.tolist(), levels.tolist()):
+                self.assertIn(row, targets[offsets[above[level - 1]]:offsets[above[level - 1] + 1]])
+                above[level] = row
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestVectorized(unittest.TestCase):
+
+    def test_masksMatchChecks(self):
+        """
+        Test if running the date rules as masks reports the same errors for the same individuals
+        """
+        for file in ["SprintTestFile.ged", "proj06testdateaftercurrentdate.ged", "proj03testAgeLessOneFifty.ged"]:
+            x = Gedcom(file, "n")
+            x.analyze()
+            y = Gedcom(file, "n")
+            y.analyze(vectorized=True)
+            self.assertEqual(x.errorlog, y.errorlog)
+            self.assertEqual({scope: sorted(errors, key=str) for scope, errors in x.anomalies.items()},
+                             {scope: sorted(errors, key=str) for scope, errors in y.anomalies.items()})
+
+    def test_masksOnlyCheckedKeys(self):
+        """
+        Test if the masks only report the individuals being checked
+        """
+        x = Gedcom("proj06testdateaftercurrentdate.ged", "n")
+        x.parse()
+        x.normalize_dates()
+        x.vectorized = True
+        x.calc_data(individuals=["ID06"], families=[])
+        self.assertEqual({scope for scope, errors in x.anomalies.items() if errors}, {("INDI", "ID06")})
+
+
+def print_batch(summary):
+    """
+    Function to print the per file results and the merged errorlog of analyze_batch
+    :param summary: dict returned by analyze_batch
+    """
+    table = PrettyTable()
+    table.field_names = ["FILE", "RESULT", "ERRORS", "SECONDS"]
+    table.align["FILE"] = "l"
+    for result in summary["files"]:
+        table.add_row([result["file"], result["error"], sum(result["errorlog"].values()),
+                       "{:.2f}".format(result["seconds"])])
+    print(table)
+    errors = PrettyTable()
+    errors.field_names = ["ERROR", "COUNT"]
+    errors.align["ERROR"] = "l"
+    for error, count in sorted(summary["errorlog"].items()):
+        errors.add_row([error, count])
+    print(errors)
+    print("Analyzed {} files in {:.2f} seconds".format(len(summary["files"]), summary["seconds"]))
+
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of gedcom files")
+    parser.add_argument("path", help="directory to search for gedcom files, or a manifest naming one file per line")
+    parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of CPUs")
+    parser.add_argument("--stream", action="store_true", help="read each file lazily line by line")
+    parser.add_argument("--tokenizer", choices=["text", "mmap"], default="text",
+                        help="mmap tokenizes the raw bytes of a memory mapped file")
+    parser.add_argument("--cache-dir", help="directory to keep parsed tree snapshots in")
+    parser.add_argument("--cache-size", type=int, default=SNAPSHOT_CACHE_SIZE,
+                        help="bytes the snapshots may take before the least recently used are deleted")
+    parser.add_argument("--rules", type=lambda text: text.split(","),
+                        help="comma separated user stories to check, such as US01,US03, all of them by default")
+    parser.add_argument("--max-errors", type=int, help="stop checking a file after this many errors")
+    parser.add_argument("--fail-fast", action="store_const", const=1, dest="max_errors",
+                        help="stop checking a file at the first error")
+    args = parser.parse_args(argv)
+    if args.rules is not None:
+        try:
+            select_rules(args.rules)
+        except ValueError as e:
+            parser.error(str(e))
+
+    summary = analyze_batch(batch_files(args.path), args.workers, stream=args.stream, tokenizer=args.tokenizer,
+                            cache_dir=args.cache_dir, cache_size=args.cache_size, rules=args.rules,
+                            max_errors=args.max_errors)
+    print_batch(summary)
+
+
+def print_estimates(g):
+    """
+    Function to print the error rates estimated by Gedcom.sample_analyze
+    :param g: Gedcom object of a sampled run
+    """
+    table = PrettyTable()
+    table.field_names = ["ERROR", "SCOPE", "SAMPLED", "WITH ERROR", "RATE", "95% CI", "ESTIMATED"]
+    table.align["ERROR"] = "l"
+    for estimate in g.estimates:
+        table.add_row([estimate["category"], estimate["scope"], estimate["sampled"], estimate["records"],
+                       "{:.2%}".format(estimate["rate"]),
+                       "{:.2%} - {:.2%}".format(estimate["low"], estimate["high"]), estimate["estimated"]])
+    print(table)
+    people, families = g.sample.population
+    print("Sampled {} of {} individuals and {} of {} families, parsed {} lines in {:.2f} seconds".format(
+        len(g.sample.people), people, len(g.sample.families), families, g.lines_read, g.parse_seconds))
+
+
+def serve_main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep analyzed gedcom files in memory and check them on request")
+    parser.add_argument("socket", help="Unix domain socket file to listen on")
+    parser.add_argument("--memory", type=int, default=DAEMON_MEMORY,
+                        help="bytes of parsed trees to keep before the least recently used are evicted")
+    args = parser.parse_args(argv)
+    daemon = ValidationDaemon(args.socket, args.memory)
+    print("Listening on {}".format(args.socket))
+    daemon.serve()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze gedcom files")
+    parser.add_argument("file", nargs="?",
+                        help="gedcom file to analyze, .ged.gz, .ged.bz2 and .ged.xz are decompressed while parsing, "
+                             "- reads from stdin with --stream")
+    parser.add_argument("--pretty", choices=["y", "n"], help="print the pretty tables")
+    parser.add_argument("--stream", action="store_true", help="read the file lazily line by line")
+    parser.add_argument("--tokenizer", choices=["text", "mmap"], default="text",
+                        help="mmap tokenizes the raw bytes of a memory mapped file")
+    parser.add_argument("--workers", type=int, default=1, help="parse the file with this many processes")
+    parser.add_argument("--cache-dir", help="directory to keep parsed tree snapshots in")
+    parser.add_argument("--cache-size", type=int, default=SNAPSHOT_CACHE_SIZE,
+                        help="bytes the snapshots may take before the least recently used are deleted")
+    parser.add_argument("--time-rules", action="store_true", help="print the seconds spent in each user story")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="run the date rules as numpy masks over the whole tree, needs numpy")
+    parser.add_argument("--check-workers", type=int, default=1,
+                        help="run the checks on ranges of the records in this many forked processes")
+    parser.add_argument("--rules", type=lambda text: text.split(","),
+                        help="comma separated user stories to check, such as US01,US03, all of them by default")
+    parser.add_argument("--max-errors", type=int, help="stop checking a file after this many errors")
+    parser.add_argument("--fail-fast", action="store_const", const=1, dest="max_errors",
+                        help="stop checking a file at the first error")
+    parser.add_argument("--sample", type=int, nargs="?", const=SAMPLE_SIZE,
+                        help="check only this many random individuals and families and estimate the error rates")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random sample")
+    parser.add_argument("--stream-tables", action="store_true",
+                        help="write the pretty tables row by row with fixed column widths instead of building them")
+    parser.add_argument("--table-widths", type=lambda text: {name: int(width) for name, width in
+                                                              (column.split("=") for column in text.split(","))},
+                        default={}, help="fixed widths of streamed table columns, such as NAME=30,CHILDREN=40")
+    parser.add_argument("--table-limit", type=int, help="print at most this many rows of each streamed table")
+    parser.add_argument("--table-offset", type=int, default=0, help="skip this many rows of each streamed table")
+    parser.add_argument("--store", help="check the tree out of core from this SQLite database, loaded from the file "
+                                        "unless it already holds it")
+    parser.add_argument("--export", help="write the parsed individuals and families to this directory")
+    parser.add_argument("--export-format", choices=list(EXPORT_FORMATS), default="columns",
+                        help="binary column files or CSV")
+    parser.add_argument("--row-group", type=int, default=EXPORT_ROW_GROUP, help="rows per row group of the export")
+    parser.add_argument("--jsonl", help="also write every error of the checks as a JSON object per line to this file, "
+                                        "- writes them to stdout instead of the error lines, errors found while "
+                                        "parsing are still printed")
+    args = parser.parse_args(argv)
+    if args.rules is not None:
+        try:
+            select_rules(args.rules)
+        except ValueError as e:
+            parser.error(str(e))
+
+    file = args.file if args.file else input("Enter file name: \n")
+    pretty = args.pretty if args.pretty else input("Do you want pretty table? y/n \n")
     g = Gedcom(file, pretty)
-    op, userdata, familydata, error = g.analyze()
+    if args.time_rules:
+        g.rule_seconds = defaultdict(float)
+    g.table_stream = args.stream_tables
+    g.table_widths = args.table_widths
+    g.table_limit = args.table_limit
+    g.table_offset = args.table_offset
+    with contextlib.ExitStack() as stack:
+        if args.jsonl == "-":
+            g.sinks = [JsonLinesSink(sys.stdout)]
+        elif args.jsonl is not None:
+            g.sinks.append(JsonLinesSink(stack.enter_context(open(args.jsonl, "w"))))
+        result = g.analyze(stream=args.stream, tokenizer=args.tokenizer, workers=args.workers,
+                           cache_dir=args.cache_dir, cache_size=args.cache_size, vectorized=args.vectorized,
+                           rules=args.rules, max_errors=args.max_errors, check_workers=args.check_workers,
+                           sample=args.sample, seed=args.seed, store=args.store)
+    if isinstance(result, str):
+        print(result)
+        return
+    error, errorlog = result
     print(error)
+    if args.sample is not None:
+        print_estimates(g)
+    if args.export is not None:
+        for path in g.export(args.export, args.export_format, args.row_group):
+            print("Exported {}".format(path))
+    if args.time_rules:
+        table = PrettyTable()
+        table.field_names = ["RULE", "SECONDS"]
+        for code, seconds in sorted(g.rule_seconds.items(), key=lambda item: item[1], reverse=True):
+            table.add_row([code, "{:.3f}".format(seconds)])
+        print(table)
 
 
 if __name__ == '__main__':
-    unittest.main(exit=False, verbosity=2)
+    if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+        main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
+    else:
+        unittest.main(exit=False, verbosity=2)
     # main()
\ No newline at end of file